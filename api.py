@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+API HTTP para integrações: geração, lote, histórico e busca
+
+É uma aplicação ASGI sem framework, servida por qualquer servidor ASGI:
+    uvicorn api:app --host 0.0.0.0 --port 8000 --workers 4
+    python api.py servir --porta 8000          # o mesmo, via uvicorn
+
+Usa o mesmo núcleo do app (generator.py), o mesmo banco e o mesmo pool de
+clientes Gemini (resources.py). Os handlers são assíncronos: a resposta da
+IA é aguardada direto no pool, sem prender uma thread por requisição, e o
+banco roda em um pool pequeno de threads (API_THREADS), cada uma com sua
+conexão SQLite reaproveitada entre as requisições.
+
+Autenticação: cabeçalho "Authorization: Bearer <chave>", com chaves de
+usuários dos planos em PLANOS_COM_API, criadas com
+    python api.py chave --email voce@empresa.com
+
+As gerações usam a chave Gemini do cabeçalho X-Gemini-Api-Key; sem ele a
+resposta é 400. A GEMINI_API_KEY do servidor (cobrada do operador) só é
+usada no lugar do cabeçalho com API_SERVER_KEY_FALLBACK=1.
+
+Rotas:
+    GET  /v1/health
+    POST /v1/generate            {"nome_produto": "...", "categoria": "...", "variantes": 1}
+    POST /v1/generate/batch      {"produtos": [{...}, ...], "modelo": "..."}
+    GET  /v1/history?limit=20&cursor=...
+    GET  /v1/descriptions/<id>
+    GET  /v1/search?q=...&limit=10&offset=0
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import batch
+import quota
+import resources
+from database import Database
+from generator import PEDIDO_PADRAO, formatar_descricao, gerar_e_salvar_async
+
+# Planos com acesso à API ("API dedicada" do plano Enterprise)
+PLANOS_COM_API = ('enterprise',)
+
+FORMATOS = ('Texto simples', 'HTML', 'Markdown')
+MAX_CORPO = 1024 * 1024
+MAX_LOTE = int(os.getenv("API_BATCH_MAX", 100))
+
+_executor = ThreadPoolExecutor(int(os.getenv("API_THREADS", 16)), thread_name_prefix="api")
+
+class ApiError(Exception):
+    """Erro que vira uma resposta JSON com o status HTTP indicado"""
+
+    def __init__(self, status, mensagem):
+        super().__init__(mensagem)
+        self.status = status
+        self.mensagem = mensagem
+
+async def _em_thread(func, *args):
+    """Executa uma função bloqueante (banco) no pool de threads da API"""
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+# ========== VALIDAÇÃO ==========
+
+def _inteiro(valor, nome, minimo, maximo):
+    """Converte um parâmetro em inteiro dentro dos limites, ou responde 400"""
+    try:
+        valor = int(valor)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{nome} deve ser um número inteiro")
+    if not minimo <= valor <= maximo:
+        raise ApiError(400, f"{nome} deve estar entre {minimo} e {maximo}")
+    return valor
+
+def _opcoes(dados, base=None):
+    """Modelo, temperatura, formato, variantes e cache de um pedido (com os padrões)"""
+    opcoes = dict(base or PEDIDO_PADRAO)
+    opcoes.update({campo: dados[campo] for campo in PEDIDO_PADRAO if campo in dados})
+
+    if not isinstance(opcoes['modelo'], str) or not opcoes['modelo']:
+        raise ApiError(400, "modelo inválido")
+    try:
+        opcoes['temperatura'] = float(opcoes['temperatura'])
+    except (TypeError, ValueError):
+        raise ApiError(400, "temperatura deve ser um número")
+    if not 0 <= opcoes['temperatura'] <= 2:
+        raise ApiError(400, "temperatura deve estar entre 0 e 2")
+    if opcoes['formato'] not in FORMATOS:
+        raise ApiError(400, f"formato deve ser um de: {', '.join(FORMATOS)}")
+    opcoes['variantes'] = _inteiro(opcoes['variantes'], 'variantes', 1, 3)
+    opcoes['forcar_nova_versao'] = bool(opcoes['forcar_nova_versao'])
+    return opcoes
+
+def _pedido(dados, base=None):
+    """Monta o pedido de geração de um produto (mesmos campos e aliases do lote)"""
+    if not isinstance(dados, dict):
+        raise ApiError(400, "Cada produto deve ser um objeto JSON")
+    produto = batch.normalizar_produto(dados)
+    if not produto['nome_produto']:
+        raise ApiError(400, "Informe nome_produto")
+    for campo in ('nome_produto', 'categoria', 'tom', 'palavras_chave', 'tamanho', 'template'):
+        produto[campo] = str(produto[campo])
+    return {**produto, **_opcoes(dados, base)}
+
+def _resposta_geracao(pedido, resultado):
+    """Corpo da resposta de uma geração"""
+    return {
+        'ids': resultado['ids'],
+        'group_id': resultado['group_id'],
+        'cache': resultado['cache'],
+        'modelo': resultado['modelo'],
+        'descricoes': [
+            formatar_descricao(texto, pedido['formato']) for texto in resultado['textos']
+        ],
+    }
+
+# ========== ROTAS ==========
+
+async def health(req):
+    """Estado dos recursos do processo"""
+    estados = resources.registry.health()
+    return (200 if all(estados.values()) else 503), {'recursos': estados}
+
+async def generate(req):
+    """Gera (ou reutiliza do cache) e salva a descrição de um produto"""
+    pedido = _pedido(req.json())
+    api_key = req.gemini_key()
+    db = resources.get_database()
+
+    try:
+        reserva = await _em_thread(quota.reserve, db, req.user_id, req.plan, pedido['variantes'])
+    except quota.QuotaExceeded as e:
+        raise ApiError(429, str(e))
+    try:
+        resultado = await gerar_e_salvar_async(db, req.user_id, pedido, api_key, _executor)
+    finally:
+        await _em_thread(reserva.release)
+    return 200, _resposta_geracao(pedido, resultado)
+
+async def generate_batch(req):
+    """Gera as descrições de vários produtos em paralelo (erros são informados por produto)"""
+    dados = req.json()
+    produtos = dados.get('produtos')
+    if not isinstance(produtos, list) or not produtos:
+        raise ApiError(400, "Informe produtos (lista não vazia)")
+    if len(produtos) > MAX_LOTE:
+        raise ApiError(400, f"No máximo {MAX_LOTE} produtos por requisição")
+
+    base = _opcoes(dados)
+    pedidos = [_pedido(produto, base) for produto in produtos]
+    total = sum(pedido['variantes'] for pedido in pedidos)
+    db = resources.get_database()
+    api_key = req.gemini_key()
+
+    try:
+        reserva = await _em_thread(quota.reserve, db, req.user_id, req.plan, total)
+    except quota.QuotaExceeded as e:
+        raise ApiError(429, str(e))
+
+    async def gerar(indice, pedido):
+        item = {'indice': indice, 'sku': pedido.get('sku'), 'nome_produto': pedido['nome_produto']}
+        try:
+            resultado = await gerar_e_salvar_async(db, req.user_id, pedido, api_key, _executor)
+            item.update(_resposta_geracao(pedido, resultado), erro=None)
+        except Exception as e:
+            item.update(ids=[], erro=str(e))
+        return item
+
+    # As chamadas em voo respeitam os limites da chave no pool de clientes
+    try:
+        resultados = await asyncio.gather(*(gerar(i, p) for i, p in enumerate(pedidos)))
+    finally:
+        await _em_thread(reserva.release)
+    erros = sum(1 for item in resultados if item['erro'])
+    return 200, {
+        'resultados': resultados,
+        'resumo': {
+            'processados': len(resultados) - erros,
+            'cache': sum(1 for item in resultados if item.get('cache')),
+            'erros': erros,
+        },
+    }
+
+async def history(req):
+    """Página do histórico, da mais recente para a mais antiga (paginação por cursor)"""
+    limite = _inteiro(req.param('limit', 20), 'limit', 1, 100)
+    cursor = req.param('cursor')
+    antes = None
+    if cursor:
+        created_at, _, desc_id = cursor.rpartition('|')
+        if not created_at or not desc_id.isdigit():
+            raise ApiError(400, "cursor inválido")
+        antes = (created_at, int(desc_id))
+
+    db = resources.get_database()
+    # Uma linha a mais diz se existe próxima página (sem cursor na última)
+    linhas = await _em_thread(db.get_description_summaries, req.user_id, limite + 1, antes)
+    proximo = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        created_at, desc_id = Database.summary_cursor(linhas[-1])
+        proximo = f"{created_at}|{desc_id}"
+    return 200, {
+        'descricoes': [dict(zip(Database.SUMMARY_COLUMNS, linha)) for linha in linhas],
+        'proximo_cursor': proximo,
+    }
+
+async def description(req, desc_id):
+    """Uma descrição completa do usuário"""
+    db = resources.get_database()
+    descricao = await _em_thread(db.get_description_record, int(desc_id), req.user_id)
+    if descricao is None:
+        raise ApiError(404, "Descrição não encontrada")
+    return 200, descricao
+
+async def search(req):
+    """Busca textual no histórico do usuário, por relevância"""
+    texto = req.param('q', '').strip()
+    if not texto:
+        raise ApiError(400, "Informe q")
+    limite = _inteiro(req.param('limit', 10), 'limit', 1, 50)
+    offset = _inteiro(req.param('offset', 0), 'offset', 0, 10000)
+
+    db = resources.get_database()
+    linhas = await _em_thread(db.search_descriptions, req.user_id, texto, limite, offset)
+    return 200, {
+        'resultados': [
+            dict(zip(('id', 'product_name', 'category', 'created_at', 'trecho'), linha))
+            for linha in linhas
+        ],
+    }
+
+# (método, rota) -> (handler, exige autenticação)
+ROTAS = {
+    ('GET', '/v1/health'): (health, False),
+    ('POST', '/v1/generate'): (generate, True),
+    ('POST', '/v1/generate/batch'): (generate_batch, True),
+    ('GET', '/v1/history'): (history, True),
+    ('GET', '/v1/search'): (search, True),
+}
+ROTA_DESCRICAO = re.compile(r'^/v1/descriptions/(\d+)$')
+
+# ========== ASGI ==========
+
+class Requisicao:
+    """Dados de uma requisição HTTP já lida"""
+
+    def __init__(self, scope, corpo):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        self.query = parse_qs(scope.get('query_string', b'').decode('utf-8'))
+        self.corpo = corpo
+        self.user_id = None
+        self.plan = None
+
+    def param(self, nome, padrao=None):
+        """Parâmetro da query string"""
+        valores = self.query.get(nome)
+        return valores[0] if valores else padrao
+
+    def json(self):
+        """Corpo da requisição como objeto JSON"""
+        try:
+            dados = json.loads(self.corpo or b'{}')
+        except ValueError:
+            raise ApiError(400, "Corpo da requisição não é um JSON válido")
+        if not isinstance(dados, dict):
+            raise ApiError(400, "O corpo da requisição deve ser um objeto JSON")
+        return dados
+
+    def gemini_key(self):
+        """Chave Gemini da requisição (a do servidor só com API_SERVER_KEY_FALLBACK=1)"""
+        chave = self.headers.get('x-gemini-api-key')
+        if not chave and os.getenv("API_SERVER_KEY_FALLBACK", "0") == "1":
+            chave = os.getenv("GEMINI_API_KEY")
+        if not chave:
+            raise ApiError(400, "Informe a chave Gemini no cabeçalho X-Gemini-Api-Key")
+        return chave
+
+async def _autenticar(req):
+    """Identifica o usuário pela chave de API do cabeçalho Authorization"""
+    tipo, _, chave = req.headers.get('authorization', '').partition(' ')
+    if tipo.lower() != 'bearer' or not chave.strip():
+        raise ApiError(401, "Use o cabeçalho Authorization: Bearer <chave>")
+    usuario = await _em_thread(resources.get_database().get_api_key_user, chave.strip())
+    if usuario is None:
+        raise ApiError(401, "Chave de API inválida ou revogada")
+    if usuario[2] not in PLANOS_COM_API:
+        raise ApiError(403, "A API está disponível no plano Enterprise")
+    req.user_id, req.plan = usuario[0], usuario[2]
+
+async def _ler_corpo(receive):
+    """Lê o corpo da requisição (limitado a MAX_CORPO bytes)"""
+    partes = []
+    tamanho = 0
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] == 'http.disconnect':
+            return None
+        parte = mensagem.get('body', b'')
+        tamanho += len(parte)
+        if tamanho > MAX_CORPO:
+            raise ApiError(413, "Corpo da requisição muito grande")
+        partes.append(parte)
+        if not mensagem.get('more_body'):
+            return b''.join(partes)
+
+async def _responder(send, status, corpo):
+    """Envia uma resposta JSON"""
+    dados = json.dumps(corpo, ensure_ascii=False, default=str).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json; charset=utf-8'),
+            (b'content-length', str(len(dados)).encode()),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': dados})
+
+async def _lifespan(receive, send):
+    """Cria os recursos na subida do servidor e os encerra na descida"""
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] == 'lifespan.startup':
+            await _em_thread(resources.get_database)
+            await send({'type': 'lifespan.startup.complete'})
+        elif mensagem['type'] == 'lifespan.shutdown':
+            await _em_thread(resources.registry.shutdown)
+            _executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    """Aplicação ASGI"""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    try:
+        rota = ROTAS.get((scope['method'], scope['path']))
+        argumentos = ()
+        if rota is None:
+            achado = ROTA_DESCRICAO.match(scope['path'])
+            if achado is None or scope['method'] != 'GET':
+                raise ApiError(404, "Rota não encontrada")
+            rota = (description, True)
+            argumentos = achado.groups()
+        handler, autenticar = rota
+
+        corpo = await _ler_corpo(receive)
+        if corpo is None:
+            return
+        req = Requisicao(scope, corpo)
+        if autenticar:
+            await _autenticar(req)
+        status, resposta = await handler(req, *argumentos)
+    except ApiError as e:
+        status, resposta = e.status, {'erro': e.mensagem}
+    except Exception as e:
+        print(f"❌ Erro na API ({scope['method']} {scope['path']}): {e}")
+        status, resposta = 500, {'erro': "Erro interno"}
+    await _responder(send, status, resposta)
+
+# ========== LINHA DE COMANDO ==========
+
+def main(argv=None):
+    """Ponto de entrada da linha de comando"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="API HTTP do DescriçõesIA Pro")
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    servir = sub.add_parser('servir', help="Sobe o servidor (requer uvicorn)")
+    servir.add_argument('--host', default='127.0.0.1')
+    servir.add_argument('--porta', type=int, default=8000)
+    servir.add_argument('--workers', type=int, default=1, help="Processos do servidor")
+
+    chave = sub.add_parser('chave', help="Cria uma chave de API para um usuário")
+    chave.add_argument('--email', required=True)
+    chave.add_argument('--nome', help="Nome para identificar a chave")
+    chave.add_argument('--db', default='data/descricoes.db')
+    args = parser.parse_args(argv)
+
+    if args.comando == 'chave':
+        db = Database(args.db)
+        user = db.get_user(args.email)
+        if not user:
+            print(f"❌ Usuário não encontrado: {args.email}")
+            return 1
+        if user[3] not in PLANOS_COM_API:
+            print(f"⚠️ O plano {user[3]} não tem acesso à API; a chave só funciona após o upgrade")
+        print(f"🔑 Chave criada (guarde-a, ela não será mostrada de novo):\n{db.create_api_key(user[0], args.nome)}")
+        db.close()
+        return 0
+
+    try:
+        import uvicorn
+    except ImportError:
+        print("❌ Instale o servidor ASGI: pip install uvicorn")
+        return 1
+    uvicorn.run('api:app', host=args.host, port=args.porta, workers=args.workers)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,18 +2,20 @@ import streamlit as st
 import os
 import json
 import html
+import hashlib
 from datetime import datetime
 from dotenv import load_dotenv
 
-# 🔧 Importações corretas
-from google import genai
-
 # 🔧 NOVAS IMPORTAÇÕES
-import database as db
+import resources
 import auth
 import utils
+import batch
+import quota
+import bulk
 import templates as temp
 from upgrade import show_upgrade_page
+from generator import formatar_descricao
 
 # ============================================
 # CONFIGURAÇÃO INICIAL
@@ -30,9 +32,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Inicializar banco de dados
-if 'db' not in st.session_state:
-    st.session_state.db = db.Database()
+# Recursos compartilhados pelo processo (criados uma vez, com verificação de saúde):
+# a sessão só guarda a referência, renovada a cada rerun caso o banco seja recriado
+st.session_state.db = resources.get_database()
 
 # Inicializar estado da sessão
 if 'user_id' not in st.session_state:
@@ -63,85 +65,44 @@ if 'incluir_hashtags' not in st.session_state:
     st.session_state.incluir_hashtags = True
 if 'incluir_especificacoes' not in st.session_state:
     st.session_state.incluir_especificacoes = True
+if 'forcar_nova_versao' not in st.session_state:
+    st.session_state.forcar_nova_versao = False
+if 'num_variantes' not in st.session_state:
+    st.session_state.num_variantes = 1
+if 'variantes' not in st.session_state:
+    st.session_state.variantes = None
+if 'trabalho_id' not in st.session_state:
+    # Geração na fila de segundo plano que a página está acompanhando
+    st.session_state.trabalho_id = None
+if 'descricao_gerada' not in st.session_state:
+    st.session_state.descricao_gerada = None
+if 'historico_cursores' not in st.session_state:
+    # Cursores (created_at, id) das páginas já visitadas do histórico
+    st.session_state.historico_cursores = [None]
 
 # ============================================
-# FUNÇÕES AUXILIARES
+# ACOMPANHAMENTO DA FILA DE GERAÇÕES
 # ============================================
 
-def formatar_descricao(texto, formato):
-    """Formata a descrição no formato selecionado"""
-    if formato == "Texto simples":
-        return texto
-    elif formato == "HTML":
-        html_text = texto.replace('**', '<strong>').replace('**', '</strong>')
-        html_text = html_text.replace('* ', '<li>').replace('\n', '</li>\n')
-        html_text = f"<div class='produto-descricao'>{html_text}</div>"
-        return html_text
-    else:  # Markdown
-        return texto
-
-def calcular_palavras(tamanho):
-    """Calcula o limite de palavras baseado no tamanho selecionado"""
-    if tamanho == "Curta (50 palavras)":
-        return 50
-    elif tamanho == "Média (150 palavras)":
-        return 150
-    else:  # Longa
-        return 300
-
-def criar_prompt(nome_produto, categoria, tom, palavras_chave, tamanho, incluir_hashtags, template_selecionado, incluir_especificacoes):
-    """Cria o prompt para a IA baseado nas configurações"""
-    
-    limite_palavras = calcular_palavras(tamanho)
-    
-    # Obter instruções específicas do template
-    template_info = temp.get_template_instructions(template_selecionado)
-    
-    prompt = f"""
-    Você é um redator especialista em e-commerce, SEO e copywriting.
-    Crie uma descrição de venda PERSUASIVA para o seguinte produto:
-
-    **INFORMAÇÕES DO PRODUTO:**
-    - Nome: {nome_produto}
-    - Categoria: {categoria}
-    - Tom desejado: {tom}
-    - Palavras-chave: {palavras_chave if palavras_chave else "Não especificadas"}
-    - Tamanho: {tamanho} (máximo {limite_palavras} palavras)
-    - Template: {template_selecionado}
-
-    **DIRETRIZES ESTRITAS:**
-    1. ESTRUTURA:
-       - Título chamativo (use 1-2 emojis relevantes)
-       - Introdução breve (1-2 frases)
-       - 4-6 bullet points com características e BENEFÍCIOS
-       {'- Seção "Especificações Técnicas" (se aplicável)' if incluir_especificacoes else ''}
-       - Chamada para ação forte no final
-
-    2. ESTILO:
-       - Tom: {tom}
-       - Foco em benefícios (não só características)
-       - Use palavras de poder: exclusivo, premium, garantido, etc.
-       - Linguagem persuasiva que gere urgência
-
-    3. SEO:
-       - Use palavras-chave naturalmente
-       - Estrutura otimizada para motores de busca
-       - Meta-descrição implícita
-
-    4. FORMATAÇÃO:
-       - Use negrito (**) para destaques
-       - Use emojis moderadamente (3-5 no total)
-       - Bullet points claros
-    
-    **5. TEMPLATE ESPECÍFICO:**
-    {template_info}
-    
-    {'6. HASHTAGS: Inclua 3-5 hashtags relevantes no final' if incluir_hashtags else ''}
+def _acompanhar_trabalho(job_id):
+    """Mostra o andamento da geração; quando ela termina, recarrega a página"""
+    trabalho = resources.get_jobs().status(job_id)
+    if trabalho is not None and trabalho['status'] in ('pending', 'running'):
+        if trabalho['status'] == 'pending':
+            st.info("⏳ Geração na fila... você pode continuar usando o app; o resultado vai para o histórico.")
+        elif trabalho['partial']:
+            # Texto que a IA já mandou (streaming gravado pelo worker)
+            st.markdown(trabalho['partial'] + " ▌")
+        else:
+            st.info("🧠 A IA está criando a descrição perfeita...")
+        if not hasattr(st, 'fragment'):
+            st.button("🔄 Atualizar status", key="atualizar_trabalho")
+    else:
+        st.rerun()
 
-    **SAÍDA:** Apenas a descrição formatada em Markdown, sem comentários adicionais.
-    """
-    
-    return prompt
+# Consulta o status a cada segundo sem rerodar a página inteira (Streamlit >= 1.37)
+if hasattr(st, 'fragment'):
+    _acompanhar_trabalho = st.fragment(run_every=1)(_acompanhar_trabalho)
 
 # ============================================
 # INTERFACE PRINCIPAL
@@ -158,21 +119,27 @@ if not st.session_state.user_id:
     auth.show_auth_page()
 else:
     # Usuário logado - mostrar aplicação principal
+    # Uso do plano lido uma única vez por rerun (contador mantido pelo banco)
+    uso = st.session_state.db.get_usage(st.session_state.user_id)
+    descricoes_usadas = uso['lifetime']
+    # Limite mensal do plano e vagas livres (None = ilimitado)
+    limite_mensal = quota.monthly_limit(st.session_state.user_plan)
+    descricoes_restantes = quota.remaining(st.session_state.db, st.session_state.user_id,
+                                           st.session_state.user_plan)
+    
     # Barra lateral
     with st.sidebar:
         st.header(f"👤 {st.session_state.user_email}")
         st.caption(f"Plano: {st.session_state.user_plan}")
         
         # Contador de uso
-        if st.session_state.user_plan == 'free':
-            descricoes_usadas = st.session_state.db.get_user_description_count(st.session_state.user_id)
-            descricoes_restantes = max(0, 5 - descricoes_usadas)
+        if limite_mensal is not None:
             st.metric(
-                label="Descrições restantes (plano grátis)",
-                value=f"{descricoes_restantes}/5"
+                label="Descrições restantes neste mês",
+                value=f"{descricoes_restantes}/{limite_mensal}"
             )
             
-            if descricoes_usadas >= 5:
+            if descricoes_restantes == 0:
                 st.error("✋ Limite do plano grátis atingido!")
                 st.info("**Faça upgrade para Pro para continuar usando!**")
         
@@ -184,6 +151,12 @@ else:
             help="Obtenha uma chave gratuita em https://aistudio.google.com/apikey"
         )
         
+        # Fila compartilhada da chave (outras sessões podem usar a mesma chave)
+        if api_key:
+            fila_api = resources.get_pool().queue_depth(api_key)
+            if fila_api:
+                st.caption(f"⏳ {fila_api} pedido(s) aguardando na fila desta chave")
+        
         # Modelos disponíveis
         modelo = st.selectbox(
             "Modelo Gemini",
@@ -204,10 +177,9 @@ else:
         
         # Informações da conta
         st.header("📊 Sua Conta")
-        if st.session_state.user_plan == 'free':
-            descricoes_usadas = st.session_state.db.get_user_description_count(st.session_state.user_id)
-            st.progress(min(descricoes_usadas / 5, 1.0))
-            st.caption(f"Usado: {descricoes_usadas}/5 descrições")
+        if limite_mensal is not None:
+            st.progress(min(uso['month'] / limite_mensal, 1.0))
+            st.caption(f"Usado neste mês: {uso['month']}/{limite_mensal} descrições")
         else:
             st.info("✅ Plano Pro - Descrições ilimitadas!")
         
@@ -224,7 +196,7 @@ else:
     # ============================================
 
     # Usar abas para organização
-    tab1, tab2, tab3, tab4, tab5 = st.tabs(["🚀 Gerar Nova", "📋 Histórico", "📊 Analytics", "💎 Upgrade", "📞 Suporte"])
+    tab1, tab_lote, tab2, tab3, tab4, tab5 = st.tabs(["🚀 Gerar Nova", "📦 Lote", "📋 Histórico", "📊 Analytics", "💎 Upgrade", "📞 Suporte"])
 
     with tab1:
         st.header("📝 Informações do Produto")
@@ -297,6 +269,19 @@ else:
                     "Incluir seção de especificações técnicas",
                     value=st.session_state.incluir_especificacoes
                 )
+                
+                forcar_nova_versao = st.checkbox(
+                    "Forçar nova versão (ignorar cache)",
+                    value=st.session_state.forcar_nova_versao,
+                    help="Por padrão, pedidos idênticos reutilizam a última resposta da IA"
+                )
+                
+                num_variantes = st.select_slider(
+                    "**Número de variantes:**",
+                    options=[1, 2, 3],
+                    value=st.session_state.num_variantes,
+                    help="Gera várias versões em uma única chamada para você escolher a melhor"
+                )
         
         # Palavras-chave
         palavras_chave = st.text_input(
@@ -312,102 +297,57 @@ else:
         col_btn1, col_btn2, col_btn3 = st.columns([2, 1, 1])
         
         with col_btn1:
-            # Verificar limite do plano free
-            if st.session_state.user_plan == 'free':
-                descricoes_usadas = st.session_state.db.get_user_description_count(st.session_state.user_id)
-                gerar_disabled = descricoes_usadas >= 5
-            else:
-                gerar_disabled = False
+            # Sem vagas no mês (a reserva abaixo é que garante o limite)
+            gerar_disabled = descricoes_restantes == 0
             
             if st.button("✨ Gerar Descrição com IA", 
                         type="primary", 
                         use_container_width=True,
                         disabled=gerar_disabled):
                 
+                reserva = None
                 if not nome_produto:
                     st.warning("Por favor, insira o nome do produto.")
                 elif not api_key:
                     st.warning("Por favor, insira sua chave da API Gemini na barra lateral.")
                 else:
-                    with st.spinner('🧠 A IA está criando a descrição perfeita...'):
-                        try:
-                            # Criar cliente Gemini
-                            client = genai.Client(api_key=api_key, http_options={'api_version': 'v1'})
-                            
-                            # Criar prompt com template
-                            prompt = criar_prompt(
-                                nome_produto, categoria, tom_descricao,
-                                palavras_chave, tamanho, incluir_hashtags, 
-                                template_selecionado, incluir_especificacoes
-                            )
-                            
-                            # Chamar a API
-                            response = client.models.generate_content(
-                                model=modelo,
-                                contents=prompt
-                            )
-                            
-                            descricao_gerada = response.text
-                            
-                            # Formatar de acordo com o formato selecionado
-                            descricao_formatada = formatar_descricao(descricao_gerada, formato_exportacao)
-                            
-                            # Salvar no banco de dados
-                            st.session_state.db.save_description(
-                                user_id=st.session_state.user_id,
-                                product_name=nome_produto,
-                                category=categoria,
-                                tone=tom_descricao,
-                                keywords=palavras_chave,
-                                size=tamanho,
-                                template=template_selecionado,
-                                description=descricao_gerada,
-                                formato=formato_exportacao
-                            )
-                            
-                            # Exibir resultado
-                            st.success(f"✅ Descrição gerada com sucesso!")
-                            st.divider()
-                            
-                            st.subheader("📋 Descrição Gerada:")
-                            
-                            # Mostrar de acordo com o formato
-                            if formato_exportacao == "HTML":
-                                st.components.v1.html(descricao_formatada, height=300, scrolling=True)
-                            else:
-                                st.markdown(descricao_formatada)
-                            
-                            # Botões de ação
-                            col_acao1, col_acao2, col_acao3 = st.columns(3)
-                            
-                            with col_acao1:
-                                st.code(descricao_gerada, language="markdown")
-                                st.caption("📋 Copie o texto acima")
-                            
-                            with col_acao2:
-                                # Exportação real
-                                if st.button("💾 Exportar como .txt", use_container_width=True):
-                                    utils.export_to_txt(descricao_gerada, nome_produto)
-                                    st.success("Arquivo salvo como descricao.txt")
-                            
-                            with col_acao3:
-                                if st.button("🔄 Gerar outra versão", use_container_width=True):
-                                    st.rerun()
-                            
-                            st.divider()
-                            st.caption("💡 **Dica:** Esta descrição está otimizada para SEO e conversão. Use em Shopee, Mercado Livre, OLX, Amazon, etc.")
-                            
-                        except Exception as e:
-                            st.error(f"❌ Erro ao gerar descrição: {str(e)}")
-                            if "429" in str(e) or "quota" in str(e).lower():
-                                st.info("""
-                                **Erro de cota excedida (Plano Gratuito).** Para continuar:
-                                1.  Acesse o [Google AI Studio](https://makersuite.google.com/app/apikey).
-                                2.  Verifique o projeto da sua chave API.
-                                3.  **Ative o faturamento** e faça **upgrade do plano gratuito** para um plano pago (ex: Tier 1).
-                                """)
-                            else:
-                                st.info("Verifique sua chave da API e conexão com a internet.")
+                    # Reservar as vagas antes de chamar a IA (atômico entre abas e sessões)
+                    try:
+                        reserva = quota.reserve(st.session_state.db, st.session_state.user_id,
+                                                st.session_state.user_plan, num_variantes)
+                    except quota.QuotaExceeded as e:
+                        st.warning(f"Seu plano permite mais {e.remaining} descrição(ões) neste mês. "
+                                   "Reduza o número de variantes ou faça upgrade.")
+                
+                if reserva is not None:
+                    # A geração roda na fila em segundo plano: reruns e abas fechadas não a
+                    # interrompem. A reserva passa para o trabalho, que a libera ao terminar
+                    try:
+                        st.session_state.trabalho_id = resources.get_jobs().submit(
+                            st.session_state.user_id,
+                            {
+                                'nome_produto': nome_produto,
+                                'categoria': categoria,
+                                'tom': tom_descricao,
+                                'palavras_chave': palavras_chave,
+                                'tamanho': tamanho,
+                                'template': template_selecionado,
+                                'incluir_hashtags': incluir_hashtags,
+                                'incluir_especificacoes': incluir_especificacoes,
+                                'formato': formato_exportacao,
+                                'modelo': modelo,
+                                'temperatura': temperatura,
+                                'variantes': num_variantes,
+                                'forcar_nova_versao': forcar_nova_versao,
+                            },
+                            api_key, reserva.id
+                        )
+                    except Exception as e:
+                        reserva.release()
+                        st.error(f"❌ Erro ao enviar a geração: {str(e)}")
+                    else:
+                        st.session_state.variantes = None
+                        st.session_state.descricao_gerada = None
         
         with col_btn2:
             # Exemplo rápido
@@ -422,6 +362,8 @@ else:
                 st.session_state.formato_exportacao = "Texto simples"
                 st.session_state.incluir_hashtags = True
                 st.session_state.incluir_especificacoes = True
+                st.session_state.forcar_nova_versao = False
+                st.session_state.num_variantes = 1
                 
                 # Recarregar
                 st.rerun()
@@ -440,58 +382,393 @@ else:
                 st.session_state.formato_exportacao = 'Texto simples'
                 st.session_state.incluir_hashtags = True
                 st.session_state.incluir_especificacoes = True
+                st.session_state.forcar_nova_versao = False
+                st.session_state.num_variantes = 1
+                st.session_state.variantes = None
+                st.session_state.descricao_gerada = None
                 
                 st.rerun()
 
+        # Retomar a geração de uma sessão anterior (página recarregada ou aba reaberta)
+        if not st.session_state.get('trabalhos_verificados'):
+            st.session_state.trabalhos_verificados = True
+            if st.session_state.trabalho_id is None:
+                ativos = st.session_state.db.get_active_jobs(st.session_state.user_id)
+                if ativos:
+                    st.session_state.trabalho_id = ativos[-1]['id']
+        
+        # Geração na fila: acompanhar até terminar e então mostrar o resultado
+        if st.session_state.trabalho_id:
+            trabalho = resources.get_jobs().status(st.session_state.trabalho_id, st.session_state.user_id)
+            if trabalho is not None and trabalho['status'] in ('pending', 'running'):
+                _acompanhar_trabalho(trabalho['id'])
+            elif trabalho is not None:
+                st.session_state.trabalho_id = None
+                
+                if trabalho['status'] == 'failed':
+                    st.error(f"❌ Erro ao gerar descrição: {trabalho['error']}")
+                    if "429" in trabalho['error'] or "quota" in trabalho['error'].lower():
+                        st.info("""
+                        **Erro de cota excedida (Plano Gratuito).** Para continuar:
+                        1.  Acesse o [Google AI Studio](https://makersuite.google.com/app/apikey).
+                        2.  Verifique o projeto da sua chave API.
+                        3.  **Ative o faturamento** e faça **upgrade do plano gratuito** para um plano pago (ex: Tier 1).
+                        """)
+                    else:
+                        st.info("Verifique sua chave da API e conexão com a internet.")
+                else:
+                    resultado = trabalho['result']
+                    pedido = trabalho['params']
+                    textos = [
+                        st.session_state.db.get_description_text(desc_id, st.session_state.user_id)
+                        for desc_id in resultado['ids']
+                    ]
+                    if resultado['cache']:
+                        st.caption("⚡ Resposta reutilizada do cache (marque \"Forçar nova versão\" para gerar outra)")
+                    
+                    if resultado['group_id']:
+                        st.session_state.variantes = {
+                            'group_id': resultado['group_id'],
+                            'ids': resultado['ids'],
+                            'textos': textos,
+                            'formato': pedido['formato'],
+                            'escolhida': None,
+                        }
+                        st.success(f"✅ {len(textos)} variantes geradas! Escolha a sua abaixo.")
+                    else:
+                        st.session_state.descricao_gerada = {
+                            'texto': textos[0],
+                            'nome_produto': pedido['nome_produto'],
+                            'formato': pedido['formato'],
+                        }
+                        st.success(f"✅ Descrição gerada com sucesso!")
+            else:
+                st.session_state.trabalho_id = None
+        
+        # Última descrição gerada (fica na sessão até a próxima geração)
+        if st.session_state.descricao_gerada:
+            gerada = st.session_state.descricao_gerada
+            st.divider()
+            
+            st.subheader("📋 Descrição Gerada:")
+            
+            # Mostrar de acordo com o formato
+            if gerada['formato'] == "HTML":
+                st.components.v1.html(formatar_descricao(gerada['texto'], "HTML"), height=300, scrolling=True)
+            else:
+                st.markdown(gerada['texto'])
+            
+            # Botões de ação
+            col_acao1, col_acao2, col_acao3 = st.columns(3)
+            
+            with col_acao1:
+                st.code(gerada['texto'], language="markdown")
+                st.caption("📋 Copie o texto acima")
+            
+            with col_acao2:
+                # Arquivos gerados em memória e enviados direto ao navegador
+                nome_txt, arquivo_txt = utils.export_to_txt(gerada['texto'], gerada['nome_produto'])
+                st.download_button("💾 Baixar .txt", data=arquivo_txt, file_name=nome_txt,
+                                   mime="text/plain", use_container_width=True)
+                if st.session_state.user_plan != 'free':
+                    nome_html, arquivo_html = utils.export_to_html(gerada['texto'], gerada['nome_produto'])
+                    st.download_button("🌐 Baixar .html", data=arquivo_html, file_name=nome_html,
+                                       mime="text/html", use_container_width=True)
+            
+            with col_acao3:
+                if st.button("🔄 Gerar outra versão", use_container_width=True):
+                    st.session_state.descricao_gerada = None
+                    st.rerun()
+            
+            st.divider()
+            st.caption("💡 **Dica:** Esta descrição está otimizada para SEO e conversão. Use em Shopee, Mercado Livre, OLX, Amazon, etc.")
+        
+        # Variantes geradas (ficam na sessão para a escolha sobreviver aos reruns)
+        if st.session_state.variantes:
+            grupo = st.session_state.variantes
+            st.divider()
+            st.subheader("🔀 Escolha a melhor variante")
+            
+            abas_variantes = st.tabs([
+                f"{'✅ ' if grupo['escolhida'] == i else ''}Variante {i + 1}"
+                for i in range(len(grupo['textos']))
+            ])
+            for i, (aba, texto) in enumerate(zip(abas_variantes, grupo['textos'])):
+                with aba:
+                    if grupo['formato'] == "HTML":
+                        st.components.v1.html(formatar_descricao(texto, "HTML"), height=300, scrolling=True)
+                    else:
+                        st.markdown(texto)
+                    
+                    if grupo['escolhida'] == i:
+                        st.success("Esta é a variante escolhida.")
+                        st.code(texto, language="markdown")
+                    elif st.button("✅ Escolher esta variante", key=f"escolher_{grupo['group_id']}_{i}"):
+                        st.session_state.db.select_variant(grupo['group_id'], grupo['ids'][i])
+                        grupo['escolhida'] = i
+                        st.rerun()
+
     # ============================================
-    # ABA 2 - HISTÓRICO
+    # ABA LOTE - GERAÇÃO EM LOTE
     # ============================================
 
-    with tab2:
-        st.header("📋 Histórico de Descrições Geradas")
+    with tab_lote:
+        st.header("📦 Geração em Lote")
+        st.caption("Envie um catálogo CSV ou JSONL com uma linha por produto. "
+                   "Colunas aceitas: nome_produto, categoria, tom, palavras_chave, tamanho, template, sku.")
         
-        historico = st.session_state.db.get_user_descriptions(st.session_state.user_id)
+        arquivo_lote = st.file_uploader("Catálogo de produtos", type=["csv", "jsonl", "json"])
+        concorrencia_lote = st.slider("Gerações simultâneas", min_value=1, max_value=8, value=4)
         
-        if not historico:
-            st.info("📭 Nenhuma descrição gerada ainda. Vá para a aba 'Gerar Nova Descrição' para começar!")
-        else:
-            # Mostrar histórico em ordem reversa (mais recente primeiro)
-            for i, registro in enumerate(historico[:10]):  # Últimas 10
-                with st.expander(f"{registro[7]} - {registro[1]} ({registro[2]})", expanded=(i==0)):
-                    col_hist1, col_hist2 = st.columns([3, 1])
+        # Planos com limite só podem gerar o que resta da cota do mês
+        limite_lote = descricoes_restantes
+        if limite_lote is not None:
+            st.caption(f"Seu plano: até {limite_lote} descrições neste lote")
+        
+        if arquivo_lote is not None:
+            conteudo_lote = arquivo_lote.getvalue()
+            # Mesmo arquivo enviado de novo = mesma saída, então o lote é retomado
+            assinatura = hashlib.sha256(conteudo_lote).hexdigest()[:12]
+            caminho_saida = os.path.join('data', 'lotes', f"{st.session_state.user_id}_{assinatura}.jsonl")
+            ja_concluidas = len(batch.carregar_concluidas(caminho_saida))
+            if ja_concluidas:
+                st.info(f"♻️ {ja_concluidas} produtos deste catálogo já foram gerados; o lote continuará de onde parou.")
+            
+            if st.button("🚀 Processar Lote", type="primary", disabled=(limite_lote == 0)):
+                if not api_key:
+                    st.warning("Por favor, insira sua chave da API Gemini na barra lateral.")
+                else:
+                    progresso = st.progress(0.0)
+                    status_lote = st.empty()
+                    total_linhas = max(1, sum(1 for _ in batch.abrir_upload(conteudo_lote, arquivo_lote.name)))
                     
-                    with col_hist1:
-                        st.markdown(registro[6])  # Descrição
+                    def atualizar_progresso(resultado, resumo):
+                        feitos = resumo['processados'] + resumo['erros'] + resumo['pulados']
+                        progresso.progress(min(feitos / total_linhas, 1.0))
+                        status_lote.caption(f"Linha {resultado['linha']}: {resultado['nome_produto']}")
                     
-                    with col_hist2:
-                        st.caption(f"**Template:** {registro[5]}")
-                        st.caption(f"**Formato:** {registro[8]}")
-                        st.caption(f"**Tamanho:** {registro[4]}")
-                        
-                        # Botão para copiar
-                        if st.button("📋 Copiar", key=f"copy_{i}_{registro[0]}", use_container_width=True):
-                            st.code(registro[6], language="markdown")
-                            st.success("Texto pronto para cópia! Selecione e use Ctrl+C.")
+                    try:
+                        # Reservar as vagas do lote inteiro antes de começar
+                        with quota.reserve(st.session_state.db, st.session_state.user_id,
+                                           st.session_state.user_plan, limite_lote or 1) as reserva:
+                            resumo = batch.processar_lote(
+                                st.session_state.db, st.session_state.user_id,
+                                batch.abrir_upload(conteudo_lote, arquivo_lote.name),
+                                caminho_saida, api_key, modelo,
+                                temperatura=temperatura,
+                                formato_exportacao=formato_exportacao,
+                                concorrencia=concorrencia_lote,
+                                forcar_nova_versao=forcar_nova_versao,
+                                limite=limite_lote,
+                                ao_concluir=atualizar_progresso,
+                                reserva=reserva
+                            )
+                            progresso.progress(1.0)
+                            st.success(f"✅ Lote concluído: {resumo['processados']} geradas "
+                                       f"({resumo['cache']} do cache), {resumo['pulados']} já existentes, "
+                                       f"{resumo['erros']} erros")
+                    except quota.QuotaExceeded as e:
+                        st.warning(f"Seu plano permite mais {e.remaining} descrição(ões) neste mês.")
+                    except Exception as e:
+                        st.error(f"❌ Erro no lote: {str(e)}")
+                        st.info("O progresso foi salvo. Envie o mesmo arquivo novamente para continuar.")
             
-            # Estatísticas
-            st.divider()
-            col_stat1, col_stat2, col_stat3 = st.columns(3)
+            if os.path.exists(caminho_saida):
+                with open(caminho_saida, 'rb') as f:
+                    st.download_button(
+                        label="⬇️ Baixar resultados (JSONL)",
+                        data=f.read(),
+                        file_name=f"resultados_{os.path.splitext(arquivo_lote.name)[0]}.jsonl",
+                        mime="application/jsonl"
+                    )
+
+    # ============================================
+    # ABA 2 - HISTÓRICO
+    # ============================================
+
+    with tab2:
+        st.header("📋 Histórico de Descrições Geradas")
+        
+        # Busca textual em todo o histórico (nome, palavras-chave e texto)
+        busca_historico = st.text_input(
+            "🔎 Buscar no histórico",
+            key="busca_historico",
+            placeholder="Ex.: camiseta algodão"
+        )
+        
+        if busca_historico.strip():
+            RESULTADOS_POR_PAGINA = 10
+            if st.session_state.get('busca_historico_termo') != busca_historico:
+                # Nova busca volta para a primeira página
+                st.session_state.busca_historico_termo = busca_historico
+                st.session_state.busca_historico_pagina = 0
+            pagina_busca = st.session_state.busca_historico_pagina
             
-            with col_stat1:
-                st.metric("Total Gerado", len(historico))
+            resultados = st.session_state.db.search_descriptions(
+                st.session_state.user_id, busca_historico,
+                limit=RESULTADOS_POR_PAGINA + 1, offset=pagina_busca * RESULTADOS_POR_PAGINA
+            )
+            tem_mais_resultados = len(resultados) > RESULTADOS_POR_PAGINA
+            resultados = resultados[:RESULTADOS_POR_PAGINA]
             
-            with col_stat2:
-                # Categoria mais comum
-                if historico:
-                    categorias = [h[2] for h in historico]
-                    mais_comum = max(set(categorias), key=categorias.count)
-                    st.metric("Categoria Mais Frequente", mais_comum)
+            if not resultados:
+                st.info("Nenhuma descrição encontrada para essa busca.")
+            for desc_id, produto, categoria_hist, criado_em, trecho in resultados:
+                with st.expander(f"{criado_em} - {produto} ({categoria_hist})"):
+                    st.caption(trecho)
+                    if st.toggle("👁️ Mostrar descrição", key=f"busca_ver_{desc_id}"):
+                        st.markdown(st.session_state.db.get_description_text(desc_id, st.session_state.user_id))
             
-            with col_stat3:
-                if st.button("🧹 Limpar Histórico", type="secondary"):
-                    st.session_state.db.clear_user_history(st.session_state.user_id)
-                    st.success("Histórico limpo com sucesso!")
+            col_busca1, col_busca2, col_busca3 = st.columns([1, 2, 1])
+            with col_busca1:
+                if st.button("⬅️ Anteriores", key="busca_anteriores", disabled=pagina_busca == 0,
+                             use_container_width=True):
+                    st.session_state.busca_historico_pagina -= 1
+                    st.rerun()
+            with col_busca2:
+                st.caption(f"Resultados - página {pagina_busca + 1}")
+            with col_busca3:
+                if st.button("Próximos ➡️", key="busca_proximos", disabled=not tem_mais_resultados,
+                             use_container_width=True):
+                    st.session_state.busca_historico_pagina += 1
                     st.rerun()
+        else:
+            # Só os resumos da página atual; o texto é carregado ao abrir cada item
+            HISTORICO_POR_PAGINA = 10
+            cursor_pagina = st.session_state.historico_cursores[-1]
+            historico = st.session_state.db.get_description_summaries(
+                st.session_state.user_id, limit=HISTORICO_POR_PAGINA + 1, before=cursor_pagina
+            )
+            tem_proxima = len(historico) > HISTORICO_POR_PAGINA
+            historico = historico[:HISTORICO_POR_PAGINA]
+            
+            if not historico and cursor_pagina is None:
+                st.info("📭 Nenhuma descrição gerada ainda. Vá para a aba 'Gerar Nova Descrição' para começar!")
+            else:
+                # Mais recente primeiro
+                for i, registro in enumerate(historico):
+                    desc_id, produto, categoria_hist, _, _, tamanho_hist, template_hist, formato_hist, _, criado_em = registro
+                    primeira = (i == 0 and cursor_pagina is None)
+                    with st.expander(f"{criado_em} - {produto} ({categoria_hist})", expanded=primeira):
+                        col_hist1, col_hist2 = st.columns([3, 1])
+                        
+                        with col_hist2:
+                            st.caption(f"**Template:** {template_hist}")
+                            st.caption(f"**Formato:** {formato_hist}")
+                            st.caption(f"**Tamanho:** {tamanho_hist}")
+                            mostrar = primeira or st.toggle("👁️ Mostrar descrição", key=f"ver_{desc_id}")
+                        
+                        texto_hist = None
+                        if mostrar:
+                            texto_hist = st.session_state.db.get_description_text(desc_id, st.session_state.user_id)
+                            with col_hist1:
+                                st.markdown(texto_hist)  # Descrição
+                        
+                        with col_hist2:
+                            # Botão para copiar
+                            if texto_hist and st.button("📋 Copiar", key=f"copy_{desc_id}", use_container_width=True):
+                                st.code(texto_hist, language="markdown")
+                                st.success("Texto pronto para cópia! Selecione e use Ctrl+C.")
+                
+                # Paginação por cursor
+                col_pag1, col_pag2, col_pag3 = st.columns([1, 2, 1])
+                with col_pag1:
+                    if st.button("⬅️ Mais recentes", disabled=cursor_pagina is None, use_container_width=True):
+                        st.session_state.historico_cursores.pop()
+                        st.rerun()
+                with col_pag2:
+                    st.caption(f"Página {len(st.session_state.historico_cursores)}")
+                with col_pag3:
+                    if st.button("Mais antigas ➡️", disabled=not tem_proxima, use_container_width=True):
+                        st.session_state.historico_cursores.append(
+                            st.session_state.db.summary_cursor(historico[-1])
+                        )
+                        st.rerun()
+                
+                # Estatísticas
+                st.divider()
+                col_stat1, col_stat2, col_stat3 = st.columns(3)
+                
+                with col_stat1:
+                    st.metric("Total Gerado", descricoes_usadas)
+                
+                with col_stat2:
+                    # Categoria mais comum (agregados de analytics)
+                    categorias = st.session_state.db.get_category_stats(st.session_state.user_id)
+                    if categorias:
+                        st.metric("Categoria Mais Frequente", categorias[0][0])
+                
+                with col_stat3:
+                    if st.button("🧹 Limpar Histórico", type="secondary"):
+                        st.session_state.db.clear_user_history(st.session_state.user_id)
+                        st.session_state.historico_cursores = [None]
+                        st.success("Histórico limpo com sucesso!")
+                        st.rerun()
+        
+        # Histórico completo em arquivo (lido do banco em blocos)
+        with st.expander("📦 Exportar / importar histórico"):
+            col_exp1, col_exp2 = st.columns(2)
+            
+            with col_exp1:
+                formato_hist = st.selectbox(
+                    "Formato", bulk.formatos_disponiveis(), format_func=str.upper, key="formato_historico"
+                )
+                if st.button("📤 Preparar exportação", use_container_width=True):
+                    # Montada em arquivo temporário e limitada a EXPORT_MAX_MB: o
+                    # download_button guarda os bytes em memória até o clique
+                    try:
+                        with bulk.exportar_arquivo(st.session_state.db, st.session_state.user_id,
+                                                   formato_hist) as arquivo_exportado:
+                            st.download_button(
+                                label="⬇️ Baixar histórico",
+                                data=arquivo_exportado.read(),
+                                file_name=bulk.nome_arquivo(formato_hist),
+                                mime=bulk.FORMATOS[formato_hist][0],
+                                use_container_width=True
+                            )
+                    except ValueError as e:
+                        st.error(f"❌ {e}")
+                
+                # Um arquivo por descrição, compactados juntos
+                formato_zip = st.radio("Arquivos do .zip", ["txt", "html"], format_func=str.upper,
+                                       horizontal=True, key="formato_zip")
+                if st.button("🗜️ Preparar .zip", use_container_width=True):
+                    nome_zip, arquivo_zip = utils.export_to_zip(
+                        (
+                            linha
+                            for bloco in st.session_state.db.iter_user_descriptions(
+                                st.session_state.user_id, ('id', 'product_name', 'description')
+                            )
+                            for linha in bloco
+                        ),
+                        formato_zip
+                    )
+                    st.download_button("⬇️ Baixar .zip", data=arquivo_zip, file_name=nome_zip,
+                                       mime="application/zip", use_container_width=True)
+            
+            with col_exp2:
+                if st.session_state.user_plan == 'free':
+                    st.caption("📥 Importação disponível nos planos Pro e Enterprise.")
+                else:
+                    arquivo_hist = st.file_uploader(
+                        "Importar arquivo exportado",
+                        type=[f for f in bulk.formatos_disponiveis()] + ["json"],
+                        key="importar_historico"
+                    )
+                    if arquivo_hist is not None and st.button("📥 Importar", use_container_width=True):
+                        try:
+                            with st.spinner("Importando..."):
+                                importadas, ignoradas, repetidas = bulk.importar(
+                                    st.session_state.db, st.session_state.user_id,
+                                    arquivo_hist, bulk.detectar_formato(arquivo_hist.name)
+                                )
+                            st.success(f"✅ {importadas} descrição(ões) importada(s)")
+                            if repetidas:
+                                st.info(f"{repetidas} descrição(ões) já estavam no histórico")
+                            if ignoradas:
+                                st.warning(f"{ignoradas} linha(s) ignorada(s) por falta de nome ou texto")
+                        except Exception as e:
+                            st.error(f"❌ Erro ao importar: {e}")
 
     # ============================================
     # ABA 3 - ANALYTICS
@@ -512,7 +789,8 @@ else:
     # ============================================
 
     with tab4:
-        show_upgrade_page(st.session_state.user_id, st.session_state.user_plan, st.session_state.db)
+        show_upgrade_page(st.session_state.user_id, st.session_state.user_plan, st.session_state.db,
+                          descricoes_usadas=descricoes_usadas)
 
     # ============================================
     # ABA 5 - SUPORTE E VALIDAÇÃO
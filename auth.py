@@ -1,11 +1,7 @@
 import streamlit as st
-import hashlib
 import re
-from database import Database
-
-def hash_password(password):
-    """Cria hash da senha usando SHA-256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+import resources
+import credentials
 
 def validate_email(email):
     """Valida formato de email"""
@@ -25,9 +21,8 @@ def show_auth_page():
     if 'auth_page' not in st.session_state:
         st.session_state.auth_page = 'login'  # 'login' ou 'register'
     
-    # Inicializar banco de dados
-    if 'db' not in st.session_state:
-        st.session_state.db = Database()
+    # Banco de dados compartilhado pelo processo
+    st.session_state.db = resources.get_database()
     
     # Layout centralizado
     col1, col2, col3 = st.columns([1, 2, 1])
@@ -87,21 +82,23 @@ def show_login_form():
             elif not validate_email(email):
                 st.error("Por favor, insira um email válido.")
             else:
-                # Buscar usuário no banco
-                user = st.session_state.db.get_user(email)
-                if user:
-                    user_id, stored_email, stored_hash, plan, created_at = user 
-                    if hash_password(password) == stored_hash:
-                        # Login bem-sucedido
-                        st.session_state.user_id = user_id
-                        st.session_state.user_email = email
-                        st.session_state.user_plan = plan
-                        st.success(f"Bem-vindo de volta, {email}!")
-                        st.rerun()
-                    else:
-                        st.error("Senha incorreta.")
+                # Conferir a senha (com limite de tentativas por email e por processo)
+                try:
+                    user = credentials.authenticate(st.session_state.db, email, password)
+                except credentials.TooManyAttempts as e:
+                    user = None
+                    st.error(f"Muitas tentativas de login. Tente novamente em {e.retry_after} segundos.")
                 else:
-                    st.error("Usuário não encontrado. Crie uma conta primeiro.")
+                    if not user:
+                        st.error("Email ou senha incorretos.")
+                
+                if user:
+                    # Login bem-sucedido
+                    st.session_state.user_id = user['id']
+                    st.session_state.user_email = user['email']
+                    st.session_state.user_plan = user['plan']
+                    st.success(f"Bem-vindo de volta, {email}!")
+                    st.rerun()
     
     # Link para recuperar senha
     st.caption("[Esqueci minha senha](#)")
@@ -144,7 +141,7 @@ def show_register_form():
                         st.error("Este email já está em uso. Tente fazer login.")
                     else:
                         # Criar novo usuário
-                        password_hash = hash_password(password)
+                        password_hash = credentials.hash_password(password)
                         user_id = st.session_state.db.add_user(email, password_hash)
                         
                         if user_id:
@@ -164,4 +161,8 @@ def logout_user():
     st.session_state.user_id = None
     st.session_state.user_email = None
     st.session_state.user_plan = 'free'
+    # A geração em segundo plano continua; só a página deixa de acompanhá-la
+    st.session_state.trabalho_id = None
+    st.session_state.descricao_gerada = None
+    st.session_state.pop('trabalhos_verificados', None)
     st.success("Você saiu da sua conta.")
\ No newline at end of file
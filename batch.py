@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Geração em lote de descrições a partir de catálogos CSV/JSONL
+
+Uso pela linha de comando:
+    python batch.py catalogo.csv --email voce@loja.com --saida resultados.jsonl
+
+Cada linha concluída é gravada imediatamente no arquivo de saída (JSONL),
+que também serve de diário: ao executar de novo com a mesma saída, as
+linhas já concluídas são puladas e o lote continua de onde parou. A
+descrição de cada linha é salva no banco junto com o registro da linha
+(batch_lines), então uma queda entre o banco e o diário não duplica nada:
+na retomada a linha é copiada do banco para o diário, sem chamar a IA.
+
+O lote respeita o limite mensal do plano do usuário: as vagas restantes são
+reservadas antes de começar e o lote para quando elas acabam. A reserva é
+renovada enquanto as linhas vão sendo concluídas, então lotes mais longos
+que QUOTA_RESERVATION_TTL não perdem as vagas no meio.
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+
+import quota
+from generator import consultar_cache, criar_prompt, configuracao
+from gemini_pool import get_pool
+
+# Valores usados quando a coluna não existe no catálogo
+PADROES = {
+    'categoria': 'Outros',
+    'tom': 'Persuasivo/Vendedor',
+    'palavras_chave': '',
+    'tamanho': 'Média (150 palavras)',
+    'template': 'default',
+    'incluir_hashtags': True,
+    'incluir_especificacoes': True,
+}
+
+# Nomes de coluna aceitos para cada campo
+ALIASES = {
+    'nome_produto': ('nome_produto', 'nome', 'produto', 'product_name', 'name'),
+    'categoria': ('categoria', 'category'),
+    'tom': ('tom', 'tom_descricao', 'tone'),
+    'palavras_chave': ('palavras_chave', 'keywords'),
+    'tamanho': ('tamanho', 'size'),
+    'template': ('template', 'template_selecionado'),
+    'incluir_hashtags': ('incluir_hashtags', 'hashtags'),
+    'incluir_especificacoes': ('incluir_especificacoes', 'especificacoes'),
+    'sku': ('sku', 'id', 'codigo'),
+}
+
+def _to_bool(valor):
+    """Converte valores de planilha (sim/não, 1/0, true/false) em booleano"""
+    if isinstance(valor, bool):
+        return valor
+    return str(valor).strip().lower() in ('1', 'true', 'sim', 's', 'yes', 'y', 'x')
+
+def normalizar_produto(registro):
+    """Mapeia uma linha do catálogo para os parâmetros de criar_prompt"""
+    registro = {str(k).strip().lower(): v for k, v in registro.items() if k is not None}
+    produto = {}
+    for campo, nomes in ALIASES.items():
+        for nome in nomes:
+            valor = registro.get(nome)
+            if valor not in (None, ''):
+                produto[campo] = valor
+                break
+        else:
+            produto[campo] = PADROES.get(campo)
+
+    produto['incluir_hashtags'] = _to_bool(produto['incluir_hashtags'])
+    produto['incluir_especificacoes'] = _to_bool(produto['incluir_especificacoes'])
+    return produto
+
+def ler_produtos(arquivo, formato=None):
+    """Lê o catálogo linha a linha, gerando tuplas (linha, produto)
+
+    `arquivo` pode ser um caminho ou um arquivo de texto já aberto.
+    """
+    if isinstance(arquivo, str):
+        if formato is None:
+            formato = 'jsonl' if arquivo.lower().endswith(('.jsonl', '.json')) else 'csv'
+        with open(arquivo, 'r', encoding='utf-8-sig', newline='') as f:
+            yield from ler_produtos(f, formato)
+        return
+
+    if formato == 'jsonl':
+        for linha, texto in enumerate(arquivo, start=1):
+            if texto.strip():
+                yield linha, normalizar_produto(json.loads(texto))
+    else:
+        for linha, registro in enumerate(csv.DictReader(arquivo), start=1):
+            yield linha, normalizar_produto(registro)
+
+def carregar_concluidas(caminho_saida):
+    """Retorna as linhas já concluídas com sucesso no arquivo de saída"""
+    concluidas = set()
+    if not os.path.exists(caminho_saida):
+        return concluidas
+
+    with open(caminho_saida, 'r', encoding='utf-8') as f:
+        for texto in f:
+            try:
+                resultado = json.loads(texto)
+            except json.JSONDecodeError:
+                # Última linha truncada por uma queda: será reprocessada
+                continue
+            if not resultado.get('erro'):
+                concluidas.add(resultado['linha'])
+    return concluidas
+
+def identificador_lote(caminho_saida):
+    """ID do lote no banco, derivado do arquivo de saída (o diário do lote)"""
+    return hashlib.sha256(os.path.abspath(caminho_saida).encode('utf-8')).hexdigest()[:16]
+
+def processar_lote(db, user_id, produtos, caminho_saida, api_key, modelo,
+                   temperatura=0.7, formato_exportacao='Texto simples',
+                   concorrencia=4, forcar_nova_versao=False, limite=None,
+                   ao_concluir=None, reserva=None):
+    """Gera descrições para um catálogo com concorrência limitada
+
+    As chamadas à API vão para o pool compartilhado (até `concorrencia` em voo
+    por lote, respeitando os limites da chave); cache, banco de dados e
+    arquivo de saída são acessados só pela thread que chamou esta função,
+    na ordem em que as respostas chegam. `reserva` (quota.Reservation do
+    lote) é renovada enquanto as linhas vão sendo concluídas.
+    """
+    concluidas = carregar_concluidas(caminho_saida)
+    lote_id = identificador_lote(caminho_saida)
+    salvas = db.get_batch_lines(user_id, lote_id)
+    resumo = {'processados': 0, 'pulados': 0, 'erros': 0, 'cache': 0}
+
+    pasta = os.path.dirname(caminho_saida)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+
+    pool = get_pool()
+    renovada_em = time.monotonic()
+
+    with open(caminho_saida, 'a', encoding='utf-8') as saida:
+
+        def registrar(linha, produto, descricao=None, erro=None, veio_do_cache=False, modelo_usado=None):
+            """Salva o resultado no banco e no diário de saída"""
+            desc_id = None
+            if descricao is not None:
+                desc_id = db.save_batch_description(
+                    user_id=user_id,
+                    batch_id=lote_id,
+                    line=linha,
+                    product_name=produto['nome_produto'],
+                    category=produto['categoria'],
+                    tone=produto['tom'],
+                    keywords=produto['palavras_chave'],
+                    size=produto['tamanho'],
+                    template=produto['template'],
+                    description=descricao,
+                    formato=formato_exportacao,
+                    model=modelo_usado or modelo
+                )
+                resumo['processados'] += 1
+                resumo['cache'] += int(veio_do_cache)
+            else:
+                resumo['erros'] += 1
+
+            escrever(linha, produto, desc_id, descricao, erro, veio_do_cache)
+
+        def recuperar(linha, produto, desc_id):
+            """Completa o diário com uma linha que já estava salva no banco"""
+            resumo['pulados'] += 1
+            escrever(linha, produto, desc_id, db.get_description_text(desc_id, user_id))
+
+        def escrever(linha, produto, desc_id, descricao, erro=None, veio_do_cache=False):
+            """Acrescenta o resultado da linha ao diário de saída"""
+            nonlocal renovada_em
+            resultado = {
+                'linha': linha,
+                'sku': produto.get('sku'),
+                'nome_produto': produto.get('nome_produto'),
+                'description_id': desc_id,
+                'cache': veio_do_cache,
+                'descricao': descricao,
+                'erro': erro,
+            }
+            saida.write(json.dumps(resultado, ensure_ascii=False) + '\n')
+            saida.flush()
+
+            # O lote segue vivo: adiar o vencimento da reserva de cota
+            if reserva is not None and time.monotonic() - renovada_em > quota.RESERVATION_TTL / 3:
+                reserva.renew()
+                renovada_em = time.monotonic()
+
+            if ao_concluir:
+                ao_concluir(resultado, resumo)
+
+        pendentes = {}
+        novos = 0
+        for linha, produto in produtos:
+            if linha in concluidas:
+                resumo['pulados'] += 1
+                continue
+            if linha in salvas:
+                # Salva no banco mas ausente do diário (queda no meio): só completar o diário
+                recuperar(linha, produto, salvas[linha])
+                continue
+            if limite is not None and novos >= limite:
+                break
+            novos += 1
+
+            if not produto.get('nome_produto'):
+                registrar(linha, produto, erro="Linha sem nome do produto")
+                continue
+
+            prompt = criar_prompt(
+                produto['nome_produto'], produto['categoria'], produto['tom'],
+                produto['palavras_chave'], produto['tamanho'], produto['incluir_hashtags'],
+                produto['template'], produto['incluir_especificacoes']
+            )
+            cache_key, cached = consultar_cache(db, prompt, modelo, temperatura, forcar_nova_versao)
+            if cached is not None:
+                registrar(linha, produto, cached[0], veio_do_cache=True, modelo_usado=cached[1])
+                continue
+
+            futuro = pool.submit(api_key, modelo, prompt.texto, configuracao(prompt, temperatura))
+            pendentes[futuro] = (linha, produto, cache_key)
+
+            # Limitar as chamadas em voo para não carregar o catálogo todo na fila
+            if len(pendentes) >= concorrencia:
+                _coletar(db, pendentes, modelo, temperatura, registrar)
+
+        while pendentes:
+            _coletar(db, pendentes, modelo, temperatura, registrar)
+
+    return resumo
+
+def _coletar(db, pendentes, modelo, temperatura, registrar):
+    """Registra as chamadas concluídas e as remove da lista de pendentes"""
+    prontos, _ = wait(list(pendentes), return_when=FIRST_COMPLETED)
+    for futuro in prontos:
+        linha, produto, cache_key = pendentes.pop(futuro)
+        try:
+            modelo_usado, resposta = futuro.result()
+            descricao = resposta.text
+        except Exception as e:
+            registrar(linha, produto, erro=str(e))
+            continue
+        db.save_cached_generation(cache_key, modelo_usado, temperatura, descricao)
+        registrar(linha, produto, descricao, modelo_usado=modelo_usado)
+
+def abrir_upload(conteudo, nome_arquivo):
+    """Converte o conteúdo enviado pelo st.file_uploader em leitura de produtos"""
+    formato = 'jsonl' if nome_arquivo.lower().endswith(('.jsonl', '.json')) else 'csv'
+    texto = io.TextIOWrapper(io.BytesIO(conteudo), encoding='utf-8-sig', newline='')
+    return ler_produtos(texto, formato)
+
+def main(argv=None):
+    """Ponto de entrada da linha de comando"""
+    from dotenv import load_dotenv
+    from database import Database
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Gera descrições em lote a partir de um catálogo CSV/JSONL")
+    parser.add_argument('entrada', help="Arquivo .csv ou .jsonl com os produtos")
+    parser.add_argument('--email', required=True, help="Email do usuário dono das descrições")
+    parser.add_argument('--saida', help="Arquivo .jsonl de resultados (padrão: <entrada>.resultados.jsonl)")
+    parser.add_argument('--modelo', default='gemini-2.5-flash')
+    parser.add_argument('--temperatura', type=float, default=0.7)
+    parser.add_argument('--formato', default='Texto simples', choices=['Texto simples', 'HTML', 'Markdown'])
+    parser.add_argument('--concorrencia', type=int, default=4)
+    parser.add_argument('--forcar-nova-versao', action='store_true', help="Ignora o cache de gerações")
+    parser.add_argument('--db', default='data/descricoes.db')
+    args = parser.parse_args(argv)
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        print("❌ Defina GEMINI_API_KEY no ambiente ou no arquivo .env")
+        return 1
+
+    db = Database(args.db)
+    user = db.get_user(args.email)
+    if not user:
+        print(f"❌ Usuário não encontrado: {args.email}")
+        return 1
+    user_id, plano = user[0], user[3]
+
+    # Planos com limite só podem gerar o que resta da cota do mês
+    limite = quota.remaining(db, user_id, plano)
+    if limite == 0:
+        print(f"❌ Limite do plano {plano} atingido neste mês")
+        return 1
+    if limite is not None:
+        print(f"🎟️ Plano {plano}: até {limite} descrições neste lote")
+
+    saida = args.saida or os.path.splitext(args.entrada)[0] + '.resultados.jsonl'
+
+    def mostrar(resultado, resumo):
+        status = "❌" if resultado['erro'] else ("⚡" if resultado['cache'] else "✅")
+        print(f"{status} linha {resultado['linha']}: {resultado['nome_produto']}")
+
+    try:
+        # Reservar as vagas do lote inteiro antes de começar
+        with quota.reserve(db, user_id, plano, limite or 1) as reserva:
+            resumo = processar_lote(
+                db, user_id, ler_produtos(args.entrada), saida, api_key, args.modelo,
+                temperatura=args.temperatura, formato_exportacao=args.formato,
+                concorrencia=args.concorrencia, forcar_nova_versao=args.forcar_nova_versao,
+                limite=limite, ao_concluir=mostrar, reserva=reserva
+            )
+    except quota.QuotaExceeded as e:
+        print(f"❌ {e}")
+        return 1
+    finally:
+        db.close()
+    print(f"\n📦 Lote concluído: {resumo['processados']} geradas "
+          f"({resumo['cache']} do cache), {resumo['pulados']} já existentes, {resumo['erros']} erros")
+    print(f"📍 Resultados: {os.path.abspath(saida)}")
+    return 0 if resumo['erros'] == 0 else 2
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+Benchmarks reproduzíveis das partes críticas do aplicativo
+
+Uso:
+    python benchmark.py busca                      # 1 milhão de descrições
+    python benchmark.py busca --descricoes 100000 --usuarios 100
+    python benchmark.py gravacao --sessoes 16      # com e sem gravação em grupo
+    python benchmark.py markdown                   # renderização HTML das descrições
+    python benchmark.py importacao                 # tempo de import na partida do app
+    python benchmark.py prompts                    # tokens por chamada (prefixo + pedido)
+    python benchmark.py senhas --meta-ms 100       # custo do hash de senha por KDF
+
+Os bancos de teste ficam em data/bench_*.db e são reaproveitados entre
+execuções (apague o arquivo para semear de novo).
+"""
+
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+# Adicionar o diretório atual ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+PALAVRAS = (
+    "camiseta algodão premium confortável tecido respirável costura reforçada "
+    "smartphone tela bateria câmera processador memória carregador rápido "
+    "sofá madeira maciça almofada veludo sala decoração moderna elegante "
+    "tênis corrida amortecimento leve solado aderente esportivo treino "
+    "panela antiaderente cozinha inox tampa vidro indução receita prática "
+    "mochila notebook impermeável bolso zíper viagem escola trabalho "
+    "perfume floral amadeirado fragrância duradoura presente especial "
+    "luminária led quarto regulável economia energia design minimalista"
+).split()
+
+CATEGORIAS = ["Eletrônicos", "Moda e Vestuário", "Casa e Decoração", "Esportes e Lazer"]
+
+def medir(funcao, repeticoes):
+    """Executa a função várias vezes e retorna os tempos em milissegundos"""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return tempos
+
+def p95(tempos):
+    """Percentil 95 de uma lista de tempos"""
+    ordenados = sorted(tempos)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * 0.95))]
+
+def resumo(tempos):
+    """p50, p95 e máximo de uma lista de tempos"""
+    return f"p50 {statistics.median(tempos):.2f} ms | p95 {p95(tempos):.2f} ms | máx {max(tempos):.2f} ms"
+
+# ========== BUSCA TEXTUAL ==========
+
+def vocabulario(rng, tamanho=5000):
+    """Palavras do catálogo + palavras sintéticas, com pesos de Zipf (poucas muito frequentes)"""
+    silabas = ["ba", "ca", "da", "fe", "gu", "li", "mo", "na", "po", "ra", "se", "ti", "vo", "xa", "ze"]
+    palavras = list(dict.fromkeys(PALAVRAS))
+    while len(palavras) < tamanho:
+        palavras.append(''.join(rng.choices(silabas, k=rng.randint(2, 4))))
+    rng.shuffle(palavras)
+    pesos = [1 / (posicao + 1) for posicao in range(len(palavras))]
+    return palavras, pesos
+
+def semear_descricoes(conn, total, usuarios, lote=20000):
+    """Insere `total` descrições sintéticas distribuídas entre `usuarios`"""
+    existentes = conn.execute('SELECT COUNT(*) FROM descriptions').fetchone()[0]
+    if existentes >= total:
+        return existentes
+
+    rng = random.Random(42)
+    palavras, pesos = vocabulario(rng)
+    conn.executemany(
+        'INSERT OR IGNORE INTO users (id, email, password_hash) VALUES (?, ?, ?)',
+        [(i, f"bench{i}@exemplo.com", "x") for i in range(1, usuarios + 1)]
+    )
+    inicio = time.perf_counter()
+    for base in range(existentes, total, lote):
+        linhas = []
+        for _ in range(min(lote, total - base)):
+            nome = ' '.join(rng.choices(palavras, pesos, k=3)).title()
+            linhas.append((
+                rng.randint(1, usuarios), nome, rng.choice(CATEGORIAS), 'Persuasivo/Vendedor',
+                ', '.join(rng.choices(palavras, pesos, k=4)), 'Média (150 palavras)', 'default',
+                ' '.join(rng.choices(palavras, pesos, k=60)), 'Texto simples'
+            ))
+        conn.executemany('''
+            INSERT INTO descriptions
+            (user_id, product_name, category, tone, keywords, size, template, description, formato)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', linhas)
+        conn.commit()
+        print(f"   🌱 {base + len(linhas):,} descrições ({time.perf_counter() - inicio:.0f} s)")
+    conn.execute("INSERT INTO descriptions_fts (descriptions_fts) VALUES ('optimize')")
+    conn.commit()
+    return total
+
+def bench_busca(args):
+    """Latência da busca textual por usuário em um banco semeado"""
+    from database import Database
+
+    caminho = args.db or f"data/bench_busca_{args.descricoes}.db"
+    db = Database(caminho)
+    total = semear_descricoes(db.conn, args.descricoes, args.usuarios)
+    print(f"📋 {total:,} descrições, {args.usuarios} usuários")
+
+    # Buscas com palavras frequentes (pior caso) e raras do mesmo vocabulário
+    rng = random.Random(7)
+    palavras, _ = vocabulario(random.Random(42))
+    frequentes, raras = palavras[:20], palavras[500:]
+    casos = {
+        'termo comum': lambda: rng.choice(frequentes),
+        'dois termos': lambda: ' '.join(rng.sample(frequentes, 2)),
+        'três termos': lambda: ' '.join(rng.sample(frequentes, 2) + [rng.choice(raras)]),
+        'termo raro': lambda: rng.choice(raras),
+    }
+    pior = 0.0
+    for nome, gerar in casos.items():
+        tempos = medir(
+            lambda: db.search_descriptions(rng.randint(1, args.usuarios), gerar()),
+            args.repeticoes
+        )
+        pior = max(pior, p95(tempos))
+        print(f"🔎 {nome:12s} {resumo(tempos)}")
+
+    db.close()
+    if pior > args.meta_ms:
+        print(f"❌ p95 acima da meta de {args.meta_ms} ms")
+        return 1
+    print(f"✅ p95 dentro da meta de {args.meta_ms} ms")
+    return 0
+
+# ========== GRAVAÇÃO ==========
+
+def bench_gravacao(args):
+    """Descrições gravadas por segundo com e sem gravação em grupo"""
+    from concurrent.futures import ThreadPoolExecutor
+    from database import Database, GroupCommitWriter
+
+    caminho = args.db or "data/bench_gravacao.db"
+    for sufixo in ('', '-wal', '-shm'):
+        if os.path.exists(caminho + sufixo):
+            os.remove(caminho + sufixo)
+    db = Database(caminho)
+    db.conn.execute("INSERT OR IGNORE INTO users (id, email, password_hash) VALUES (1, 'bench@exemplo.com', 'x')")
+    db.conn.commit()
+
+    rng = random.Random(42)
+    textos = [' '.join(rng.choices(PALAVRAS, k=60)) for _ in range(100)]
+
+    def gravar(i):
+        db.save_description_async(
+            1, f"Produto {i}", rng.choice(CATEGORIAS), 'Persuasivo/Vendedor', 'a, b',
+            'Média (150 palavras)', 'default', textos[i % len(textos)], 'Texto simples'
+        ).result()
+
+    def rodar(nome):
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(args.sessoes) as executor:
+            list(executor.map(gravar, range(args.descricoes)))
+        duracao = time.perf_counter() - inicio
+        print(f"💾 {nome:28s} {args.descricoes / duracao:>10,.0f} descrições/s")
+
+    rodar("uma transação por descrição")
+    db.writer = GroupCommitWriter(db, linger=args.linger_ms / 1000)
+    rodar("em grupo")
+
+    # Importações enfileiram tudo e só depois esperam os IDs
+    inicio = time.perf_counter()
+    futuros = [
+        db.save_description_async(
+            1, f"Produto {i}", CATEGORIAS[i % len(CATEGORIAS)], 'Persuasivo/Vendedor', 'a, b',
+            'Média (150 palavras)', 'default', textos[i % len(textos)], 'Texto simples'
+        )
+        for i in range(args.descricoes)
+    ]
+    for futuro in futuros:
+        futuro.result()
+    duracao = time.perf_counter() - inicio
+    print(f"💾 {'em grupo, sem esperar':28s} {args.descricoes / duracao:>10,.0f} descrições/s")
+    db.close()
+    return 0
+
+# ========== MARKDOWN ==========
+
+def formatar_legado(texto):
+    """Cadeia de replace usada antes do renderer (referência do benchmark)"""
+    html_text = texto.replace('**', '<strong>').replace('**', '</strong>')
+    html_text = html_text.replace('* ', '<li>').replace('\n', '</li>\n')
+    return f"<div class='produto-descricao'>{html_text}</div>"
+
+def descricao_sintetica(rng, palavras=300):
+    """Descrição no formato que a IA devolve: título, parágrafos, lista e hashtags"""
+    def frase(n):
+        termos = rng.choices(PALAVRAS, k=n)
+        termos[rng.randrange(n)] = f"**{rng.choice(PALAVRAS)}**"
+        return ' '.join(termos).capitalize() + '.'
+
+    linhas = [f"# {frase(5)}", '', frase(40), frase(40), '', "**Destaques:**"]
+    linhas += [f"* {frase(12)}" for _ in range(8)]
+    linhas += ['', frase(60), frase(50), '', ' '.join(f"#{p}" for p in rng.sample(PALAVRAS, 6))]
+    texto = '\n'.join(linhas)
+    return texto if len(texto.split()) >= palavras else texto + ' ' + frase(palavras - len(texto.split()))
+
+def bench_markdown(args):
+    """Renderização de descrições de ~300 palavras: replace encadeado x renderer (frio e em cache)"""
+    import renderer
+
+    rng = random.Random(42)
+    textos = [descricao_sintetica(rng) for _ in range(args.textos)]
+    print(f"📝 {len(textos)} descrições, ~{statistics.mean(len(t.split()) for t in textos):.0f} palavras")
+
+    def todas(funcao):
+        return lambda: [funcao(texto) for texto in textos]
+
+    def frio():
+        renderer.clear_cache()
+        for texto in textos:
+            renderer.markdown_to_html(texto)
+
+    casos = {
+        'replace encadeado': todas(formatar_legado),
+        'renderer (sem cache)': frio,
+        'renderer (em cache)': todas(renderer.markdown_to_html),
+    }
+    for nome, funcao in casos.items():
+        tempos = medir(funcao, args.repeticoes)
+        por_texto = [t * 1000 / len(textos) for t in tempos]
+        print(f"🖋️  {nome:22s} {statistics.median(por_texto):8.1f} µs/descrição (p95 {p95(por_texto):.1f} µs)")
+    return 0
+
+# ========== PARTIDA DO APP ==========
+
+# Módulos que o app.py importa ao carregar (antes de qualquer login)
+MODULOS_APP = ('resources', 'database', 'auth', 'utils', 'batch', 'bulk', 'templates', 'upgrade',
+               'generator', 'gemini_pool')
+# Dependências pesadas que só podem ser carregadas no primeiro uso
+MODULOS_PESADOS = ('google.genai', 'plotly', 'pandas', 'pyarrow')
+
+def tempos_de_import(modulos):
+    """Roda `python -X importtime` e retorna {módulo de topo: ms acumulados}, na ordem"""
+    codigo = 'import streamlit, dotenv\n' + '\n'.join(f'import {m}' for m in modulos)
+    resultado = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', codigo],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+    )
+    if resultado.returncode != 0:
+        raise RuntimeError(resultado.stderr.strip().splitlines()[-1])
+
+    tempos = {}
+    carregados = set()
+    for linha in resultado.stderr.splitlines():
+        if not linha.startswith('import time:') or 'cumulative' in linha:
+            continue
+        _, acumulado, nome = linha[len('import time:'):].split('|')
+        carregados.add(nome.strip())
+        # Sem recuo = importado diretamente pelo código acima
+        if not nome.startswith('  '):
+            tempos[nome.strip()] = int(acumulado) / 1000
+    return tempos, carregados
+
+def bench_importacao(args):
+    """Tempo de import dos módulos carregados na partida do app (tela de login)"""
+    medicoes = []
+    for _ in range(args.repeticoes):
+        tempos, carregados = tempos_de_import(MODULOS_APP)
+        medicoes.append(tempos)
+
+    def mediana(modulo):
+        return statistics.median(m.get(modulo, 0.0) for m in medicoes)
+
+    base = mediana('streamlit') + mediana('dotenv')
+    print(f"📦 {'streamlit + dotenv':22s} {base:8.1f} ms")
+    total = 0.0
+    for modulo in MODULOS_APP:
+        total += mediana(modulo)
+        print(f"📦 {modulo:22s} {mediana(modulo):8.1f} ms")
+    print(f"⏱️  Módulos do app: {total:.1f} ms (mediana de {args.repeticoes} execuções)")
+
+    falhas = 0
+    pesados = sorted(
+        nome for nome in carregados
+        if any(nome == p or nome.startswith(p + '.') for p in MODULOS_PESADOS)
+    )
+    if pesados:
+        print(f"❌ Dependências pesadas carregadas na partida: {', '.join(pesados[:10])}")
+        falhas += 1
+    if total > args.meta_ms:
+        print(f"❌ Import dos módulos do app acima da meta de {args.meta_ms} ms")
+        falhas += 1
+    if not falhas:
+        print(f"✅ Nenhuma dependência pesada na partida e import dentro da meta de {args.meta_ms} ms")
+    return 1 if falhas else 0
+
+# ========== PROMPTS ==========
+
+def prompt_legado(template_info, incluir_especificacoes=True, incluir_hashtags=True):
+    """Prompt montado por f-string a cada chamada, como antes dos templates compilados"""
+    return f"""
+    Você é um redator especialista em e-commerce, SEO e copywriting.
+    Crie uma descrição de venda PERSUASIVA para o seguinte produto:
+
+    **INFORMAÇÕES DO PRODUTO:**
+    - Nome: Fone Bluetooth à Prova d'Água com Cancelamento de Ruído
+    - Categoria: Eletrônicos
+    - Tom desejado: Persuasivo/Vendedor
+    - Palavras-chave: bluetooth, à prova d'água, cancelamento ruído, esportivo, bateria longa
+    - Tamanho: Média (150 palavras) (máximo 150 palavras)
+    - Template: template
+
+    **DIRETRIZES ESTRITAS:**
+    1. ESTRUTURA:
+       - Título chamativo (use 1-2 emojis relevantes)
+       - Introdução breve (1-2 frases)
+       - 4-6 bullet points com características e BENEFÍCIOS
+       {'- Seção "Especificações Técnicas" (se aplicável)' if incluir_especificacoes else ''}
+       - Chamada para ação forte no final
+
+    2. ESTILO:
+       - Tom: Persuasivo/Vendedor
+       - Foco em benefícios (não só características)
+       - Use palavras de poder: exclusivo, premium, garantido, etc.
+       - Linguagem persuasiva que gere urgência
+
+    3. SEO:
+       - Use palavras-chave naturalmente
+       - Estrutura otimizada para motores de busca
+       - Meta-descrição implícita
+
+    4. FORMATAÇÃO:
+       - Use negrito (**) para destaques
+       - Use emojis moderadamente (3-5 no total)
+       - Bullet points claros
+    
+    **5. TEMPLATE ESPECÍFICO:**
+    {template_info}
+    
+    {'6. HASHTAGS: Inclua 3-5 hashtags relevantes no final' if incluir_hashtags else ''}
+
+    **SAÍDA:** Apenas a descrição formatada em Markdown, sem comentários adicionais.
+    """
+
+def bench_prompts(args):
+    """Tokens de entrada por chamada e template: prompt antigo x prefixo estático + pedido"""
+    import templates
+    from generator import criar_prompt
+
+    contar = lambda texto: len(texto) // 4
+    if args.api_key:
+        from google import genai
+        cliente = genai.Client(api_key=args.api_key)
+        contar = lambda texto: cliente.models.count_tokens(model=args.modelo, contents=texto).total_tokens
+    print(f"🔢 Tokens {'contados pela API (' + args.modelo + ')' if args.api_key else 'estimados (≈4 caracteres/token)'}")
+    print(f"{'template':22s} {'antes':>7s} {'prefixo':>8s} {'pedido':>7s} {'por chamada':>12s} {'variação':>9s}")
+
+    for chave in templates.COMPILED_TEMPLATES:
+        antes = contar(prompt_legado(templates.get_template_instructions(chave)))
+        prompt = criar_prompt(
+            "Fone Bluetooth à Prova d'Água com Cancelamento de Ruído", "Eletrônicos",
+            "Persuasivo/Vendedor", "bluetooth, à prova d'água, cancelamento ruído, esportivo, bateria longa",
+            "Média (150 palavras)", True, chave, True
+        )
+        prefixo, pedido = contar(prompt.system), contar(prompt.texto)
+        por_chamada = prefixo + pedido
+        print(f"{chave:22s} {antes:>7d} {prefixo:>8d} {pedido:>7d} {por_chamada:>12d} "
+              f"{por_chamada / antes - 1:>+9.0%}")
+    print("💡 Por chamada = prefixo + pedido: a system_instruction é enviada e cobrada em toda "
+          "chamada, como o prompt antigo")
+    print("💡 A variação vem do texto mais enxuto; o prefixo só sai mais barato com cache de "
+          "contexto explícito da API (caches.create), que este projeto não usa")
+    return 0
+
+# ========== SENHAS ==========
+
+# Custos medidos para cada KDF, do mais barato ao mais caro
+CUSTOS_SCRYPT = [(2 ** k, 8, 1) for k in range(12, 19)]
+CUSTOS_PBKDF2 = [(i,) for i in (100_000, 200_000, 400_000, 600_000, 1_000_000, 2_000_000)]
+
+def bench_senhas(args):
+    """Custo de uma verificação de senha por KDF e custo; sugere o maior custo dentro da meta"""
+    import hashlib
+    import credentials
+
+    senha = "senha de teste 123"
+    legado = hashlib.sha256(senha.encode()).hexdigest()
+    tempos = medir(lambda: credentials.verify_password(senha, legado), 1000)
+    print(f"🔓 SHA-256 sem sal (legado): {statistics.median(tempos) * 1000:.1f} µs por verificação")
+    print(f"🎯 Meta: verificação de até {args.meta_ms:.0f} ms\n")
+    print(f"{'kdf':14s} {'custo':>20s} {'tempo':>10s} {'CPU':>10s} {'memória':>9s} {'logins/s/núcleo':>16s}")
+
+    sugestoes = {}
+    for kdf, custos in (('scrypt', CUSTOS_SCRYPT), ('pbkdf2_sha256', CUSTOS_PBKDF2)):
+        for params in custos:
+            armazenado = credentials.hash_password(senha, kdf, params)
+            cpu_inicio = time.process_time()
+            tempos = medir(lambda: credentials.verify_password(senha, armazenado), args.repeticoes)
+            cpu_ms = (time.process_time() - cpu_inicio) * 1000 / args.repeticoes
+            mediana = statistics.median(tempos)
+            memoria = f"{128 * params[1] * params[0] / 2 ** 20:.0f} MiB" if kdf == 'scrypt' else "-"
+            custo = ' '.join(f"{nome}={valor}" for nome, valor in zip(
+                ('n', 'r', 'p') if kdf == 'scrypt' else ('iterações',), params))
+            print(f"{kdf:14s} {custo:>20s} {mediana:7.1f} ms {cpu_ms:7.1f} ms {memoria:>9s} "
+                  f"{1000 / cpu_ms:16.1f}")
+            if mediana <= args.meta_ms:
+                sugestoes[kdf] = (params, mediana, cpu_ms)
+            elif mediana > 4 * args.meta_ms:
+                # Custos maiores só ficam mais lentos
+                break
+
+    if not sugestoes:
+        print(f"\n❌ Nenhum custo ficou dentro de {args.meta_ms:.0f} ms nesta máquina")
+        return 1
+
+    limiter = credentials.LoginLimiter()
+    print("\n💡 Sugestão para o .env (maior custo dentro da meta):")
+    for kdf, (params, mediana, cpu_ms) in sugestoes.items():
+        variaveis = (f"PASSWORD_SCRYPT_N={params[0]}" if kdf == 'scrypt'
+                     else f"PASSWORD_PBKDF2_ITERATIONS={params[0]}")
+        # Pior caso: o orçamento de verificações por minuto inteiro sendo usado
+        nucleos = limiter.max_per_minute * cpu_ms / 60000
+        print(f"   PASSWORD_KDF={kdf} {variaveis}   "
+              f"({mediana:.0f} ms; com LOGIN_MAX_PER_MINUTE={limiter.max_per_minute}, "
+              f"no máximo {nucleos:.2f} núcleo(s) ocupados com login)")
+    return 0
+
+def main(argv=None):
+    """Ponto de entrada da linha de comando"""
+    parser = argparse.ArgumentParser(description="Benchmarks do DescriçõesIA Pro")
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    busca = sub.add_parser('busca', help="Busca textual (FTS5) no histórico")
+    busca.add_argument('--db', help="Banco de teste (padrão: data/bench_busca_<N>.db)")
+    busca.add_argument('--descricoes', type=int, default=1_000_000)
+    busca.add_argument('--usuarios', type=int, default=1000)
+    busca.add_argument('--repeticoes', type=int, default=50)
+    busca.add_argument('--meta-ms', type=float, default=50.0)
+    busca.set_defaults(func=bench_busca)
+
+    gravacao = sub.add_parser('gravacao', help="Gravação de descrições com e sem group commit")
+    gravacao.add_argument('--db', help="Banco de teste (padrão: data/bench_gravacao.db, recriado)")
+    gravacao.add_argument('--descricoes', type=int, default=20000)
+    gravacao.add_argument('--sessoes', type=int, default=16, help="Threads gravando ao mesmo tempo")
+    gravacao.add_argument('--linger-ms', type=float, default=0.0,
+                          help="Espera por mais registros antes de gravar o lote")
+    gravacao.set_defaults(func=bench_gravacao)
+
+    markdown = sub.add_parser('markdown', help="Conversão das descrições para HTML")
+    markdown.add_argument('--textos', type=int, default=200)
+    markdown.add_argument('--repeticoes', type=int, default=50)
+    markdown.set_defaults(func=bench_markdown)
+
+    importacao = sub.add_parser('importacao', help="Tempo de import na partida do app (python -X importtime)")
+    importacao.add_argument('--repeticoes', type=int, default=5)
+    importacao.add_argument('--meta-ms', type=float, default=100.0,
+                            help="Limite para os módulos do app, sem contar streamlit e dotenv")
+    importacao.set_defaults(func=bench_importacao)
+
+    prompts = sub.add_parser('prompts', help="Tokens de entrada por template")
+    prompts.add_argument('--api-key', default=os.getenv("GEMINI_API_KEY"),
+                         help="Conta os tokens pela API (padrão: estimativa local)")
+    prompts.add_argument('--modelo', default="gemini-2.5-flash")
+    prompts.set_defaults(func=bench_prompts)
+
+    senhas = sub.add_parser('senhas', help="Custo do hash de senha por KDF (calibra o login)")
+    senhas.add_argument('--repeticoes', type=int, default=10)
+    senhas.add_argument('--meta-ms', type=float, default=100.0, help="Latência desejada por verificação")
+    senhas.set_defaults(func=bench_senhas)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
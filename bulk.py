@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Exportação e importação em massa do histórico de descrições
+
+Exportação: o histórico é lido do banco em blocos (Database.iter_user_descriptions)
+e cada bloco é convertido em bytes CSV, JSONL ou Parquet assim que chega, então
+a memória usada não cresce com o tamanho do histórico.
+
+Importação: o arquivo é lido linha a linha e gravado em lotes grandes com
+executemany (Database.import_descriptions); descrições que já estão no
+histórico são ignoradas, então importar de novo o mesmo arquivo não duplica.
+
+Uso pela linha de comando:
+    python bulk.py exportar --email voce@loja.com --formato jsonl --saida historico.jsonl
+    python bulk.py importar historico.jsonl --email voce@loja.com
+"""
+
+import argparse
+import csv
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+
+FORMATOS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+# Colunas aceitas na importação (o restante do arquivo é ignorado)
+COLUNAS_IMPORTACAO = ('product_name', 'category', 'tone', 'keywords', 'size', 'template',
+                      'description', 'formato', 'model', 'created_at')
+
+def parquet_disponivel():
+    """Indica se o pyarrow (dependência opcional do formato Parquet) está instalado"""
+    return importlib.util.find_spec('pyarrow') is not None
+
+def formatos_disponiveis():
+    """Formatos oferecidos na interface"""
+    return [f for f in FORMATOS if f != 'parquet' or parquet_disponivel()]
+
+# ========== EXPORTAÇÃO ==========
+
+def exportar_csv(blocos, colunas, rotulos=None):
+    """Gera o CSV em pedaços de bytes, um por bloco de linhas (`rotulos` = títulos do cabeçalho)"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(rotulos or colunas)
+    # BOM para o Excel reconhecer o UTF-8
+    yield ('\ufeff' + buffer.getvalue()).encode('utf-8')
+    for linhas in blocos:
+        buffer.seek(0)
+        buffer.truncate()
+        escritor.writerows(linhas)
+        yield buffer.getvalue().encode('utf-8')
+
+def exportar_jsonl(blocos, colunas):
+    """Gera o JSONL em pedaços de bytes, um por bloco de linhas"""
+    for linhas in blocos:
+        yield ''.join(
+            json.dumps(dict(zip(colunas, linha)), ensure_ascii=False) + '\n' for linha in linhas
+        ).encode('utf-8')
+
+def exportar_parquet(blocos, colunas):
+    """Gera o Parquet em pedaços de bytes, um row group por bloco de linhas"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tipos = {'id': pa.int64(), 'selected': pa.int64()}
+    schema = pa.schema([(coluna, tipos.get(coluna, pa.string())) for coluna in colunas])
+    saida = io.BytesIO()
+    with pq.ParquetWriter(saida, schema, compression='zstd') as escritor:
+        for linhas in blocos:
+            escritor.write_table(pa.Table.from_pylist(
+                [dict(zip(colunas, linha)) for linha in linhas], schema=schema
+            ))
+            # Entregar o que já foi escrito e esvaziar o buffer
+            yield saida.getvalue()
+            saida.seek(0)
+            saida.truncate()
+    # Rodapé do arquivo, escrito ao fechar
+    yield saida.getvalue()
+
+EXPORTADORES = {'csv': exportar_csv, 'jsonl': exportar_jsonl, 'parquet': exportar_parquet}
+
+def exportar(db, user_id, formato, colunas=None, chunk_size=1000):
+    """Gera o histórico do usuário no formato pedido, em pedaços de bytes"""
+    colunas = tuple(colunas or db.EXPORT_COLUMNS)
+    blocos = db.iter_user_descriptions(user_id, colunas, chunk_size)
+    return EXPORTADORES[formato](blocos, colunas)
+
+# Tamanho máximo da exportação pela interface: o Streamlit guarda o download
+# inteiro em memória, então históricos maiores saem pela linha de comando
+EXPORTACAO_MAX_BYTES = int(os.getenv("EXPORT_MAX_MB", 50)) * 1024 * 1024
+
+def exportar_arquivo(db, user_id, formato, limite=EXPORTACAO_MAX_BYTES, colunas=None):
+    """Grava a exportação em um arquivo temporário e o devolve posicionado no início
+
+    Os pedaços vão direto para o disco, sem juntar o histórico em memória.
+    Acima de `limite` bytes (None = sem limite) levanta ValueError. O arquivo
+    é apagado ao ser fechado.
+    """
+    arquivo = tempfile.TemporaryFile()
+    try:
+        for pedaco in exportar(db, user_id, formato, colunas):
+            arquivo.write(pedaco)
+            if limite is not None and arquivo.tell() > limite:
+                raise ValueError(
+                    f"Histórico maior que {limite // (1024 * 1024)} MB: exporte com "
+                    f"python bulk.py exportar --formato {formato}"
+                )
+    except Exception:
+        arquivo.close()
+        raise
+    arquivo.seek(0)
+    return arquivo
+
+def nome_arquivo(formato, prefixo='historico_descricoes'):
+    """Nome sugerido para o download"""
+    from datetime import datetime
+    return f"{prefixo}_{datetime.now().strftime('%Y%m%d')}.{FORMATOS[formato][1]}"
+
+# ========== IMPORTAÇÃO ==========
+
+def ler_registros(arquivo, formato):
+    """Lê um arquivo exportado (binário) e produz um dicionário por descrição"""
+    if formato == 'parquet':
+        import pyarrow.parquet as pq
+        for lote in pq.ParquetFile(arquivo).iter_batches(batch_size=5000):
+            yield from lote.to_pylist()
+        return
+
+    texto = io.TextIOWrapper(arquivo, encoding='utf-8-sig', newline='')
+    if formato == 'csv':
+        yield from csv.DictReader(texto)
+    else:
+        for linha in texto:
+            if linha.strip():
+                yield json.loads(linha)
+
+def normalizar_registro(registro):
+    """Mantém só as colunas conhecidas; valores vazios viram None"""
+    return {coluna: (registro.get(coluna) or None) for coluna in COLUNAS_IMPORTACAO}
+
+def importar(db, user_id, arquivo, formato, batch_size=5000):
+    """Importa um arquivo exportado para o histórico do usuário
+
+    Retorna (importadas, ignoradas por falta de nome ou texto, repetidas).
+    """
+    ignoradas = 0
+
+    def validos():
+        nonlocal ignoradas
+        for registro in ler_registros(arquivo, formato):
+            registro = normalizar_registro(registro)
+            if not registro['product_name'] or not registro['description']:
+                ignoradas += 1
+                continue
+            # Campos obrigatórios no banco
+            registro['category'] = registro['category'] or 'Outros'
+            registro['tone'] = registro['tone'] or 'Persuasivo/Vendedor'
+            yield registro
+
+    importadas, repetidas = db.import_descriptions(user_id, validos(), batch_size)
+    return importadas, ignoradas, repetidas
+
+def detectar_formato(nome):
+    """Formato a partir da extensão do arquivo"""
+    extensao = os.path.splitext(nome)[1].lower().lstrip('.')
+    if extensao == 'json':
+        return 'jsonl'
+    if extensao not in FORMATOS:
+        raise ValueError(f"Formato não suportado: .{extensao} (use CSV, JSONL ou Parquet)")
+    return extensao
+
+def main(argv=None):
+    """Ponto de entrada da linha de comando"""
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Exportação e importação do histórico de descrições")
+    parser.add_argument('--db', default='data/descricoes.db', help="Caminho do arquivo SQLite")
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    exp = sub.add_parser('exportar', help="Exporta o histórico de um usuário")
+    exp.add_argument('--email', required=True)
+    exp.add_argument('--formato', choices=list(FORMATOS), default='csv')
+    exp.add_argument('--saida', required=True, help="Arquivo de saída")
+
+    imp = sub.add_parser('importar', help="Importa um arquivo exportado para um usuário")
+    imp.add_argument('arquivo')
+    imp.add_argument('--email', required=True)
+    imp.add_argument('--formato', choices=list(FORMATOS), help="Padrão: pela extensão do arquivo")
+    imp.add_argument('--lote', type=int, default=5000, help="Descrições por transação")
+    args = parser.parse_args(argv)
+
+    db = Database(args.db)
+    user = db.get_user(args.email)
+    if not user:
+        print(f"❌ Usuário não encontrado: {args.email}", file=sys.stderr)
+        return 1
+
+    if args.comando == 'exportar':
+        with open(args.saida, 'wb') as saida:
+            for pedaco in exportar(db, user[0], args.formato):
+                saida.write(pedaco)
+        print(f"✅ Histórico exportado para {args.saida}")
+        return 0
+
+    formato = args.formato or detectar_formato(args.arquivo)
+    with open(args.arquivo, 'rb') as arquivo:
+        importadas, ignoradas, repetidas = importar(db, user[0], arquivo, formato, args.lote)
+    print(f"✅ {importadas} importada(s), {ignoradas} ignorada(s) por falta de nome ou texto, "
+          f"{repetidas} já no histórico")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+Senhas: hash com KDF e sal, verificação e limites de tentativas de login
+
+Formato guardado em users.password_hash:
+    scrypt$<n>$<r>$<p>$<sal>$<hash>
+    pbkdf2_sha256$<iterações>$<sal>$<hash>            (sal e hash em base64)
+
+Hashes antigos (SHA-256 sem sal, 64 dígitos hexadecimais) continuam
+aceitos e são refeitos com o KDF atual no primeiro login bem-sucedido; o
+mesmo acontece com hashes de custo diferente do configurado. O custo vem
+de PASSWORD_KDF, PASSWORD_SCRYPT_N/_R/_P e PASSWORD_PBKDF2_ITERATIONS;
+`python benchmark.py senhas --meta-ms 100` mede cada opção nesta máquina e
+sugere o maior custo dentro da latência de login desejada.
+
+Custo sob ataque (credential stuffing): cada tentativa calcula um KDF
+completo, então o processo só começa LOGIN_MAX_PER_MINUTE verificações por
+minuto e roda no máximo LOGIN_MAX_CONCURRENT ao mesmo tempo; acima disso o
+login é recusado sem calcular nada. No pior caso o login ocupa
+LOGIN_MAX_PER_MINUTE × (custo de um hash) de CPU por minuto. Cada email
+também tem um limite de falhas (LOGIN_MAX_FAILURES em LOGIN_FAILURE_WINDOW
+segundos).
+
+Verificações bem-sucedidas ficam em cache por PASSWORD_VERIFY_CACHE_TTL
+segundos (chaveadas por HMAC com um segredo do processo): entrar de novo
+em outra aba não paga o KDF outra vez.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# Custos padrão de cada KDF (ajuste com python benchmark.py senhas)
+KDF = os.getenv("PASSWORD_KDF", "scrypt")
+KDF_PARAMS = {
+    'scrypt': (
+        int(os.getenv("PASSWORD_SCRYPT_N", 2 ** 14)),
+        int(os.getenv("PASSWORD_SCRYPT_R", 8)),
+        int(os.getenv("PASSWORD_SCRYPT_P", 1)),
+    ),
+    'pbkdf2_sha256': (int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", 600_000)),),
+}
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+class TooManyAttempts(Exception):
+    """Tentativas de login acima do limite; tente de novo depois de `retry_after` segundos"""
+
+    def __init__(self, retry_after):
+        self.retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(f"Muitas tentativas de login; tente novamente em {self.retry_after} s")
+
+# ========== HASH E VERIFICAÇÃO ==========
+
+def _b64(dados):
+    return base64.b64encode(dados).decode('ascii').rstrip('=')
+
+def _unb64(texto):
+    return base64.b64decode(texto + '=' * (-len(texto) % 4))
+
+def _derive(kdf, password, salt, params):
+    """Calcula o KDF da senha com o sal e o custo informados"""
+    senha = password.encode('utf-8')
+    if kdf == 'scrypt':
+        n, r, p = params
+        # scrypt usa 128 * r * n bytes de memória; o padrão do OpenSSL (32 MiB) é pouco para n alto
+        return hashlib.scrypt(senha, salt=salt, n=n, r=r, p=p, maxmem=256 * r * n, dklen=HASH_BYTES)
+    if kdf == 'pbkdf2_sha256':
+        (iteracoes,) = params
+        return hashlib.pbkdf2_hmac('sha256', senha, salt, iteracoes, HASH_BYTES)
+    raise ValueError(f"KDF desconhecido: {kdf}")
+
+def hash_password(password, kdf=None, params=None):
+    """Hash da senha com sal aleatório, no formato kdf$custo$sal$hash"""
+    kdf = kdf or KDF
+    params = tuple(params or KDF_PARAMS[kdf])
+    salt = os.urandom(SALT_BYTES)
+    return '$'.join([kdf, *map(str, params), _b64(salt), _b64(_derive(kdf, password, salt, params))])
+
+def parse_hash(stored):
+    """Separa um hash guardado em (kdf, custo, sal, hash); hashes antigos vêm como 'sha256'"""
+    if '$' not in stored:
+        return 'sha256', (), b'', bytes.fromhex(stored)
+    kdf, *params, salt, derived = stored.split('$')
+    return kdf, tuple(int(p) for p in params), _unb64(salt), _unb64(derived)
+
+def verify_password(password, stored):
+    """Confere a senha com o hash guardado (comparação em tempo constante)"""
+    try:
+        kdf, params, salt, esperado = parse_hash(stored)
+    except (ValueError, TypeError):
+        return False
+    if kdf == 'sha256':
+        calculado = hashlib.sha256(password.encode('utf-8')).digest()
+    else:
+        calculado = _derive(kdf, password, salt, params)
+    return hmac.compare_digest(calculado, esperado)
+
+def needs_rehash(stored):
+    """O hash é antigo ou foi feito com um custo diferente do configurado"""
+    kdf, params, _, _ = parse_hash(stored)
+    return kdf != KDF or params != tuple(KDF_PARAMS[KDF])
+
+# ========== LIMITES DE TENTATIVAS ==========
+
+class LoginLimiter:
+    """Limites de login do processo: orçamento global de KDFs e falhas por email"""
+
+    # Emails com falhas acompanhados ao mesmo tempo (os mais antigos são esquecidos)
+    MAX_TRACKED = 10000
+
+    def __init__(self, max_per_minute=None, max_concurrent=None, max_failures=None,
+                 failure_window=None, queue_timeout=1.0):
+        self.max_per_minute = max_per_minute or int(os.getenv("LOGIN_MAX_PER_MINUTE", 600))
+        self.max_concurrent = max_concurrent or int(os.getenv("LOGIN_MAX_CONCURRENT", 4))
+        self.max_failures = max_failures or int(os.getenv("LOGIN_MAX_FAILURES", 5))
+        self.failure_window = failure_window or float(os.getenv("LOGIN_FAILURE_WINDOW", 900))
+        self.queue_timeout = queue_timeout
+        self._inicios = deque()
+        self._falhas = OrderedDict()
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        self._lock = threading.Lock()
+
+    def _falhas_recentes(self, email, agora):
+        """Falhas do email dentro da janela (descarta as vencidas)"""
+        falhas = self._falhas.get(email)
+        if falhas is None:
+            return ()
+        while falhas and agora - falhas[0] >= self.failure_window:
+            falhas.popleft()
+        if not falhas:
+            del self._falhas[email]
+        return falhas
+
+    @contextmanager
+    def attempt(self, email):
+        """Reserva a vez de uma verificação de senha; levanta TooManyAttempts acima dos limites"""
+        email = email.strip().lower()
+        agora = time.monotonic()
+        with self._lock:
+            falhas = self._falhas_recentes(email, agora)
+            if len(falhas) >= self.max_failures:
+                raise TooManyAttempts(falhas[0] + self.failure_window - agora)
+            while self._inicios and agora - self._inicios[0] >= 60:
+                self._inicios.popleft()
+            if len(self._inicios) >= self.max_per_minute:
+                raise TooManyAttempts(self._inicios[0] + 60 - agora)
+            self._inicios.append(agora)
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise TooManyAttempts(1)
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def failure(self, email):
+        """Registra uma senha errada para o email"""
+        email = email.strip().lower()
+        with self._lock:
+            self._falhas.setdefault(email, deque()).append(time.monotonic())
+            self._falhas.move_to_end(email)
+            while len(self._falhas) > self.MAX_TRACKED:
+                self._falhas.popitem(last=False)
+
+    def success(self, email):
+        """Login correto: zera as falhas do email"""
+        with self._lock:
+            self._falhas.pop(email.strip().lower(), None)
+
+class VerificationCache:
+    """Verificações bem-sucedidas recentes, para não recalcular o KDF"""
+
+    def __init__(self, ttl=None, max_entries=10000):
+        self.ttl = ttl if ttl is not None else float(os.getenv("PASSWORD_VERIFY_CACHE_TTL", 300))
+        self.max_entries = max_entries
+        # Segredo só deste processo: as chaves do cache não servem fora dele
+        self._segredo = os.urandom(32)
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _chave(self, stored, password):
+        return hmac.new(self._segredo, f"{stored}\0{password}".encode('utf-8'), hashlib.sha256).digest()
+
+    def hit(self, stored, password):
+        """A senha já foi conferida com este hash há menos de `ttl` segundos"""
+        if self.ttl <= 0:
+            return False
+        chave = self._chave(stored, password)
+        with self._lock:
+            expira = self._entradas.get(chave)
+            if expira is None:
+                return False
+            if expira < time.monotonic():
+                del self._entradas[chave]
+                return False
+            return True
+
+    def add(self, stored, password):
+        """Guarda uma verificação bem-sucedida"""
+        if self.ttl <= 0:
+            return
+        chave = self._chave(stored, password)
+        with self._lock:
+            self._entradas[chave] = time.monotonic() + self.ttl
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_entries:
+                self._entradas.popitem(last=False)
+
+login_limiter = LoginLimiter()
+verification_cache = VerificationCache()
+
+_hash_ficticio = None
+
+def _verificar_ficticio(password):
+    """Gasta o mesmo tempo de uma verificação real quando o email não existe"""
+    global _hash_ficticio
+    if _hash_ficticio is None:
+        _hash_ficticio = hash_password(os.urandom(16).hex())
+    verify_password(password, _hash_ficticio)
+
+def authenticate(db, email, password, limiter=None, cache=None):
+    """Confere email e senha; retorna {'id', 'email', 'plan'} ou None
+
+    Levanta TooManyAttempts acima dos limites de login. Hashes antigos ou
+    de custo desatualizado são refeitos com o KDF atual após o login.
+    """
+    limiter = limiter or login_limiter
+    cache = cache or verification_cache
+
+    with limiter.attempt(email):
+        user = db.get_credentials(email)
+        if user is None:
+            _verificar_ficticio(password)
+            limiter.failure(email)
+            return None
+        user_id, stored_email, stored, plan = user
+        if not (cache.hit(stored, password) or verify_password(password, stored)):
+            limiter.failure(email)
+            return None
+
+        limiter.success(email)
+        # O novo hash é outro KDF completo: roda na mesma vaga do limitador
+        if needs_rehash(stored):
+            novo = hash_password(password)
+            if db.update_password_hash(user_id, stored, novo):
+                print(f"🔐 Hash de senha atualizado para {KDF}: {stored_email}")
+                stored = novo
+    cache.add(stored, password)
+    return {'id': user_id, 'email': stored_email, 'plan': plan}
@@ -1,75 +1,132 @@
 import sqlite3
 import os
-import streamlit as st
+import time
+import hashlib
+import json
+import re
+import secrets
+import uuid
+import queue
+import threading
+import weakref
+from concurrent.futures import Future
+
+import migrations
 
 class Database:
+    """Acesso ao SQLite compartilhado pelo processo
+
+    Cada thread usa sua própria conexão (e cursor), obtida de um pequeno pool:
+    quando a thread termina, a conexão volta para o pool e é reaproveitada
+    pela próxima. Todas as conexões usam WAL, busy_timeout e synchronous=NORMAL.
+    """
+
     def __init__(self, db_name='data/descricoes.db'):
         """Inicializa a conexão com o banco de dados SQLite"""
         try:
             # Criar diretório se não existir
             os.makedirs(os.path.dirname(db_name), exist_ok=True)
             
-            # Conectar ao banco
-            self.conn = sqlite3.connect(db_name, check_same_thread=False)
-            self.cursor = self.conn.cursor()
+            self.db_name = db_name
+            self.busy_timeout_ms = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+            self.pool_size = int(os.getenv("SQLITE_POOL_SIZE", 8))
+            self._local = threading.local()
+            self._idle = []
+            self._pool_lock = threading.RLock()
+            self._closed = False
+            self._shutdown = threading.Event()
+            self._schema_version = 0
+            
+            # Configurações do cache de gerações (TTL em segundos e limite LRU)
+            self.cache_ttl = int(os.getenv("GENERATION_CACHE_TTL", 7 * 24 * 3600))
+            self.cache_max_entries = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", 5000))
+            
+            # Modo WAL é persistente no arquivo: basta ativar uma vez
+            self.conn.execute('PRAGMA journal_mode=WAL')
             
             # Criar todas as tabelas
             self.create_tables()
             
-            st.success("✅ Banco de dados conectado com sucesso!")
+            # Gravação em grupo (opcional): sem ela cada sessão confirma a própria transação
+            self.writer = None
+            if os.getenv("DB_GROUP_COMMIT", "0") == "1":
+                self.writer = GroupCommitWriter(
+                    self,
+                    max_rows=int(os.getenv("DB_GROUP_COMMIT_MAX_ROWS", 1000)),
+                    linger=float(os.getenv("DB_GROUP_COMMIT_LINGER_MS", 0)) / 1000
+                )
+            
             print(f"🗄️  Banco de dados: {os.path.abspath(db_name)}")
             
         except Exception as e:
-            st.error(f"❌ Erro ao conectar ao banco: {str(e)}")
+            print(f"❌ Erro ao conectar ao banco: {str(e)}")
             raise
     
+    # ========== CONEXÕES ==========
+    
+    def _connect(self):
+        """Abre uma nova conexão já configurada"""
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False
+        )
+        conn.execute(f'PRAGMA busy_timeout = {self.busy_timeout_ms}')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+    
+    def _release_connection(self, conn):
+        """Devolve ao pool a conexão de uma thread que terminou"""
+        with self._pool_lock:
+            if not self._closed and len(self._idle) < self.pool_size:
+                # Descartar transação deixada aberta pela thread anterior
+                conn.rollback()
+                self._idle.append(conn)
+                return
+        conn.close()
+    
+    @property
+    def conn(self):
+        """Conexão da thread atual (reaproveitada do pool ou criada)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            with self._pool_lock:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("Banco de dados já foi fechado")
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+            self._local.conn = conn
+            self._local.cursor = conn.cursor()
+            # Quando a thread terminar, a conexão volta para o pool
+            weakref.finalize(threading.current_thread(), self._release_connection, conn)
+        return conn
+    
+    @property
+    def cursor(self):
+        """Cursor da thread atual"""
+        self.conn
+        return self._local.cursor
+    
     def create_tables(self):
-        """Cria TODAS as tabelas necessárias"""
-        
-        # Tabela de usuários
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                plan TEXT DEFAULT 'free',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabela de descrições
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS descriptions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                product_name TEXT NOT NULL,
-                category TEXT NOT NULL,
-                tone TEXT NOT NULL,
-                keywords TEXT,
-                size TEXT,
-                template TEXT,
-                description TEXT NOT NULL,
-                formato TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Tabela de analytics (simplificada)
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS analytics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                total_descriptions INTEGER DEFAULT 0,
-                most_used_category TEXT,
-                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        self.conn.commit()
+        """Aplica as migrações pendentes do esquema"""
+        # Em produção, DB_AUTO_MIGRATE=0 deixa as migrações para o init_database.py
+        if os.getenv("DB_AUTO_MIGRATE", "1") == "1":
+            migrations.migrate(self.conn)
+        else:
+            migrations.ensure_version_table(self.conn)
+            pendentes = migrations.pending_migrations(self.conn)
+            if pendentes:
+                print(f"⚠️ {len(pendentes)} migração(ões) pendente(s): execute python init_database.py migrate")
         print("📋 Tabelas criadas/verificadas")
     
+    def schema_version(self):
+        """Versão do esquema aplicada no banco (relida enquanto houver migrações pendentes)"""
+        if self._schema_version < migrations.latest_version():
+            row = self.conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+            self._schema_version = row[0] or 0
+        return self._schema_version
+    
     # ========== MÉTODOS PARA USUÁRIOS ==========
     
     def add_user(self, email, password_hash, plan='free'):
@@ -96,76 +153,1264 @@ class Database:
         self.cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
         return self.cursor.fetchone()
     
+    def update_user_plan(self, user_id, plan):
+        """Altera o plano do usuário"""
+        self.cursor.execute('UPDATE users SET plan = ? WHERE id = ?', (plan, user_id))
+        self.conn.commit()
+    
+    def get_credentials(self, email):
+        """Dados para o login: (id, email, password_hash, plan) ou None"""
+        self.cursor.execute('SELECT id, email, password_hash, plan FROM users WHERE email = ?', (email,))
+        return self.cursor.fetchone()
+    
+    def update_password_hash(self, user_id, old_hash, new_hash):
+        """Troca o hash da senha, só se ele ainda for `old_hash` (dois logins juntos não se atropelam)"""
+        self.cursor.execute(
+            'UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+            (new_hash, user_id, old_hash)
+        )
+        self.conn.commit()
+        return self.cursor.rowcount > 0
+    
     # ========== MÉTODOS PARA DESCRIÇÕES ==========
     
     def save_description(self, user_id, product_name, category, tone, keywords, 
-                         size, template, description, formato):
-        """Salva uma descrição gerada"""
+                         size, template, description, formato, model=None):
+        """Salva uma descrição gerada (inserção e estatísticas em uma única transação)"""
         try:
-            self.cursor.execute('''
-                INSERT INTO descriptions 
-                (user_id, product_name, category, tone, keywords, size, template, description, formato)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, product_name, category, tone, keywords, size, 
-                  template, description, formato))
+            desc_id = self.save_description_async(
+                user_id, product_name, category, tone, keywords, size,
+                template, description, formato, model
+            ).result()
+            print(f"📝 Descrição salva: {product_name} (ID: {desc_id})")
+            return desc_id
+            
+        except Exception as e:
+            print(f"❌ Erro ao salvar descrição: {e}")
+            return None
+    
+    def save_description_async(self, user_id, product_name, category, tone, keywords,
+                               size, template, description, formato, model=None):
+        """Agenda a gravação de uma descrição; retorna um Future com o ID
+        
+        Com a gravação em grupo ativa (DB_GROUP_COMMIT=1), descrições de várias
+        sessões são confirmadas juntas pelo GroupCommitWriter; sem ela, grava
+        na hora e devolve o Future já resolvido.
+        """
+        record = (user_id, product_name, category, tone, keywords, size,
+                  template, description, formato, None, model, None)
+        if self.writer is not None:
+            return self.writer.submit(record)
+        
+        futuro = Future()
+        try:
+            futuro.set_result(self._write_descriptions([record])[0])
             self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            futuro.set_exception(e)
+        return futuro
+    
+    def save_description_group(self, user_id, product_name, category, tone, keywords,
+                               size, template, descriptions, formato, model=None):
+        """Salva variantes geradas juntas; retorna (group_id, lista de IDs)"""
+        group_id = uuid.uuid4().hex
+        records = [
+            (user_id, product_name, category, tone, keywords, size,
+             template, description, formato, group_id, model, None)
+            for description in descriptions
+        ]
+        try:
+            if self.writer is not None:
+                ids = self.writer.submit_many(records).result()
+            else:
+                ids = self._write_descriptions(records)
+                self.conn.commit()
             
-            # Atualizar analytics
-            self._update_analytics(user_id, category)
+            print(f"📝 {len(ids)} variantes salvas: {product_name} (grupo: {group_id})")
+            return group_id, ids
             
-            desc_id = self.cursor.lastrowid
-            print(f"📝 Descrição salva: {product_name} (ID: {desc_id})")
+        except Exception as e:
+            self.conn.rollback()
+            print(f"❌ Erro ao salvar variantes: {e}")
+            return None, []
+    
+    SQL_BATCH_LINE = 'SELECT description_id FROM batch_lines WHERE user_id = ? AND batch_id = ? AND line = ?'
+    
+    def save_batch_description(self, user_id, batch_id, line, product_name, category, tone,
+                               keywords, size, template, description, formato, model=None):
+        """Salva a descrição de uma linha de lote; retorna o ID (ou None em caso de erro)
+        
+        A linha fica registrada em batch_lines na mesma transação: se ela já
+        tiver sido salva (queda antes de escrever o diário), devolve o ID
+        existente em vez de duplicar a descrição.
+        """
+        record = (user_id, product_name, category, tone, keywords, size,
+                  template, description, formato, None, model, None)
+        try:
+            # BEGIN IMMEDIATE: conferir e gravar sob a mesma trava de escrita
+            self.conn.commit()
+            self.cursor.execute('BEGIN IMMEDIATE')
+            self.cursor.execute(self.SQL_BATCH_LINE, (user_id, batch_id, line))
+            row = self.cursor.fetchone()
+            if row:
+                self.conn.commit()
+                return row[0]
+            
+            desc_id = self._write_descriptions([record])[0]
+            self.cursor.execute(
+                'INSERT INTO batch_lines (user_id, batch_id, line, description_id) VALUES (?, ?, ?, ?)',
+                (user_id, batch_id, line, desc_id)
+            )
+            self.conn.commit()
+            print(f"📝 Descrição salva: {product_name} (ID: {desc_id}, lote {batch_id}, linha {line})")
             return desc_id
             
         except Exception as e:
-            print(f"❌ Erro ao salvar descrição: {e}")
+            self.conn.rollback()
+            print(f"❌ Erro ao salvar descrição do lote: {e}")
             return None
     
+    def get_batch_lines(self, user_id, batch_id):
+        """Linhas do lote já salvas no banco: {linha: description_id}"""
+        self.cursor.execute(
+            'SELECT line, description_id FROM batch_lines WHERE user_id = ? AND batch_id = ?',
+            (user_id, batch_id)
+        )
+        return dict(self.cursor.fetchall())
+    
+    def select_variant(self, group_id, description_id):
+        """Marca a variante escolhida pelo usuário dentro do grupo"""
+        self.cursor.execute('''
+            UPDATE descriptions 
+            SET selected = CASE WHEN id = ? THEN 1 ELSE 0 END 
+            WHERE group_id = ?
+        ''', (description_id, group_id))
+        self.conn.commit()
+    
     def get_user_descriptions(self, user_id, limit=20):
-        """Obtém descrições de um usuário"""
+        """Obtém descrições de um usuário (linhas completas, com o texto)"""
         self.cursor.execute('''
-            SELECT * FROM descriptions 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC 
+            SELECT * FROM descriptions
+            WHERE user_id = ?
+            ORDER BY created_at DESC, id DESC
             LIMIT ?
         ''', (user_id, limit))
         return self.cursor.fetchall()
     
+    # Colunas do resumo de uma descrição: tudo menos o texto gerado
+    SUMMARY_COLUMNS = ('id', 'product_name', 'category', 'tone', 'keywords', 'size',
+                       'template', 'formato', 'model', 'created_at')
+    
+    # Primeira página e páginas seguintes (cursor created_at, id) do histórico
+    SQL_SUMMARIES_FIRST = f'''
+        SELECT {', '.join(SUMMARY_COLUMNS)} FROM descriptions
+        WHERE user_id = ?
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    '''
+    SQL_SUMMARIES_BEFORE = f'''
+        SELECT {', '.join(SUMMARY_COLUMNS)} FROM descriptions
+        WHERE user_id = ? AND (created_at, id) < (?, ?)
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    '''
+    
+    def get_description_summaries(self, user_id, limit=20, before=None):
+        """Página de resumos do histórico (sem o texto), do mais recente ao mais antigo
+    
+        Paginação por chave: `before` é o cursor (created_at, id) da última
+        linha da página anterior, obtido com `summary_cursor`; None = primeira página.
+        """
+        if before is None:
+            self.cursor.execute(self.SQL_SUMMARIES_FIRST, (user_id, limit))
+        else:
+            self.cursor.execute(self.SQL_SUMMARIES_BEFORE, (user_id, before[0], before[1], limit))
+        return self.cursor.fetchall()
+    
+    @classmethod
+    def summary_cursor(cls, summary):
+        """Cursor (created_at, id) de uma linha de resumo, para pedir a página seguinte"""
+        return (summary[cls.SUMMARY_COLUMNS.index('created_at')], summary[0])
+    
+    def get_description(self, description_id, user_id=None):
+        """Obtém uma descrição completa pelo ID (opcionalmente conferindo o dono)"""
+        if user_id is None:
+            self.cursor.execute('SELECT * FROM descriptions WHERE id = ?', (description_id,))
+        else:
+            self.cursor.execute(
+                'SELECT * FROM descriptions WHERE id = ? AND user_id = ?', (description_id, user_id)
+            )
+        return self.cursor.fetchone()
+    
+    SQL_DESCRIPTION_TEXT = 'SELECT description FROM descriptions WHERE id = ? AND user_id = ?'
+    
+    def get_description_text(self, description_id, user_id):
+        """Obtém só o texto gerado de uma descrição do usuário"""
+        self.cursor.execute(self.SQL_DESCRIPTION_TEXT, (description_id, user_id))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+    
+    # Colunas que podem ser exportadas do histórico
+    EXPORT_COLUMNS = ('id', 'product_name', 'category', 'tone', 'keywords', 'size', 'template',
+                      'description', 'formato', 'model', 'group_id', 'selected', 'created_at')
+    
+    def get_description_record(self, description_id, user_id, columns=EXPORT_COLUMNS):
+        """Uma descrição do usuário como dicionário com as colunas pedidas (ou None)"""
+        self.cursor.execute(
+            f"SELECT {', '.join(columns)} FROM descriptions WHERE id = ? AND user_id = ?",
+            (description_id, user_id)
+        )
+        row = self.cursor.fetchone()
+        return dict(zip(columns, row)) if row else None
+    
+    def iter_user_descriptions(self, user_id, columns=EXPORT_COLUMNS, chunk_size=1000):
+        """Percorre todo o histórico do usuário em blocos de linhas (do mais antigo ao mais recente)
+        
+        Usa um cursor próprio lido com fetchmany: só um bloco fica em memória
+        por vez, qualquer que seja o tamanho do histórico.
+        """
+        invalidas = set(columns) - set(self.EXPORT_COLUMNS)
+        if invalidas:
+            raise ValueError(f"Colunas inválidas: {', '.join(sorted(invalidas))}")
+    
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f'''
+                SELECT {', '.join(columns)} FROM descriptions
+                WHERE user_id = ?
+                ORDER BY created_at, id
+            ''', (user_id,))
+            while True:
+                linhas = cursor.fetchmany(chunk_size)
+                if not linhas:
+                    break
+                yield linhas
+        finally:
+            cursor.close()
+    
+    def import_descriptions(self, user_id, records, batch_size=5000):
+        """Importa descrições (dicionários com as colunas de RECORD_COLUMNS) em lotes
+        
+        Cada lote vai em uma transação com executemany; contadores de uso e
+        analytics são atualizados no mesmo commit. Descrições que já estão no
+        histórico (mesma data, nome e texto) ficam de fora, então importar de
+        novo um arquivo exportado não duplica nada.
+        Retorna (importadas, repetidas).
+        """
+        total = repetidas = 0
+        lote = []
+        colunas = self.RECORD_COLUMNS[1:]
+        for record in records:
+            lote.append((user_id,) + tuple(record.get(coluna) for coluna in colunas))
+            if len(lote) >= batch_size:
+                gravadas, iguais = self._import_batch(lote)
+                total, repetidas, lote = total + gravadas, repetidas + iguais, []
+        if lote:
+            gravadas, iguais = self._import_batch(lote)
+            total, repetidas = total + gravadas, repetidas + iguais
+    
+        print(f"📥 {total} descrição(ões) importada(s) para o usuário {user_id} ({repetidas} já existiam)")
+        return total, repetidas
+    
+    SQL_IMPORTED_DESCRIPTION = '''
+        SELECT 1 FROM descriptions 
+        WHERE user_id = ? AND created_at = ? AND product_name = ? AND description = ?
+        LIMIT 1
+    '''
+    
+    def _import_batch(self, lote):
+        """Grava um lote da importação em uma única transação; retorna (gravadas, repetidas)
+        
+        Sem data (created_at vazio = agora) não há como reconhecer a repetição,
+        então a linha é sempre gravada.
+        """
+        data, nome, texto = (self.RECORD_COLUMNS.index(coluna)
+                             for coluna in ('created_at', 'product_name', 'description'))
+        novas = []
+        vistas = set()
+        try:
+            # BEGIN IMMEDIATE: duas importações do mesmo arquivo ao mesmo tempo também não duplicam
+            self.conn.commit()
+            self.cursor.execute('BEGIN IMMEDIATE')
+            for linha in lote:
+                if linha[data] is not None:
+                    chave = (linha[0], linha[data], linha[nome], linha[texto])
+                    if chave in vistas:
+                        continue
+                    self.cursor.execute(self.SQL_IMPORTED_DESCRIPTION, chave)
+                    if self.cursor.fetchone():
+                        continue
+                    vistas.add(chave)
+                novas.append(linha)
+            if novas:
+                self._write_descriptions(novas, return_ids=False)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return len(novas), len(lote) - len(novas)
+    
+    # Marcadores do snippet: caracteres de controle, que não aparecem no texto
+    # gerado e não se confundem com o **negrito** que as descrições já usam
+    SNIPPET_START = '\x02'
+    SNIPPET_END = '\x03'
+    MARKDOWN_SPECIAL = re.compile(r'([\\`*_{}\[\]<>()#+\-.!|~])')
+    
+    @classmethod
+    def highlight_snippet(cls, snippet):
+        """Escapa o Markdown do trecho e destaca os termos encontrados com **negrito**"""
+        trecho = cls.MARKDOWN_SPECIAL.sub(r'\\\1', snippet or '')
+        return trecho.replace(cls.SNIPPET_START, '**').replace(cls.SNIPPET_END, '**')
+    
+    @staticmethod
+    def make_search_query(text):
+        """Converte o texto digitado em termos FTS5 seguros (entre aspas); lista vazia se não houver"""
+        return [f'"{termo}"' for termo in re.findall(r'\w+', text or '')]
+    
+    def search_descriptions(self, user_id, text, limit=10, offset=0):
+        """Busca textual no histórico do usuário, da mais relevante para a menos
+        
+        Retorna linhas (id, product_name, category, created_at, trecho); o
+        trecho vem em Markdown, com o texto original escapado e os termos
+        encontrados em **negrito**. Todas as
+        palavras precisam aparecer; achar no nome do produto pesa mais que
+        nas palavras-chave, e empates saem da mais recente para a mais antiga.
+        
+        A relevância é calculada só sobre as descrições do usuário (o bm25
+        do FTS5 contaria cada termo no banco inteiro a cada busca).
+        """
+        termos = self.make_search_query(text)
+        if not termos:
+            return []
+        
+        usuario = f'user_id:"{user_id}"'
+        qualquer = ' OR '.join(termos)
+        consulta = f"{usuario} AND ({' '.join(termos)})"
+        self.cursor.execute('''
+            WITH achados AS (
+                SELECT rowid AS id FROM descriptions_fts WHERE descriptions_fts MATCH ?
+            ),
+            no_nome AS (
+                SELECT rowid AS id FROM descriptions_fts WHERE descriptions_fts MATCH ?
+            ),
+            nas_palavras AS (
+                SELECT rowid AS id FROM descriptions_fts WHERE descriptions_fts MATCH ?
+            )
+            SELECT d.id, d.product_name, d.category, d.created_at
+            FROM achados 
+            JOIN descriptions d ON d.id = achados.id
+            ORDER BY 2 * (d.id IN no_nome) + (d.id IN nas_palavras) DESC, 
+                     d.created_at DESC, d.id DESC
+            LIMIT ? OFFSET ?
+        ''', (consulta, f"{usuario} AND product_name:({qualquer})",
+              f"{usuario} AND keywords:({qualquer})", limit, offset))
+        resultados = self.cursor.fetchall()
+        
+        # Trechos só para a página exibida
+        pagina = []
+        for desc_id, product_name, category, created_at in resultados:
+            self.cursor.execute('''
+                SELECT snippet(descriptions_fts, 3, ?, ?, '…', 12) 
+                FROM descriptions_fts 
+                WHERE descriptions_fts MATCH ? AND rowid = ?
+            ''', (self.SNIPPET_START, self.SNIPPET_END, consulta, desc_id))
+            trecho = self.highlight_snippet(self.cursor.fetchone()[0])
+            pagina.append((desc_id, product_name, category, created_at, trecho))
+        return pagina
+    
+    def clear_user_history(self, user_id):
+        """Apaga as descrições do usuário
+    
+        Contadores de uso e agregados de analytics são mantidos: limpar o
+        histórico não devolve cota já consumida.
+        """
+        self.cursor.execute('DELETE FROM descriptions WHERE user_id = ?', (user_id,))
+        removidas = self.cursor.rowcount
+        self.conn.commit()
+        print(f"🧹 Histórico limpo: {removidas} descrição(ões) do usuário {user_id}")
+        return removidas
+    
     def get_user_description_count(self, user_id):
-        """Conta descrições de um usuário"""
-        self.cursor.execute('SELECT COUNT(*) FROM descriptions WHERE user_id = ?', (user_id,))
-        return self.cursor.fetchone()[0]
+        """Conta descrições de um usuário (lido do contador, sem COUNT(*))"""
+        return self.get_usage(user_id)['lifetime']
     
-    # ========== MÉTODOS AUXILIARES ==========
+    SQL_USAGE = '''
+        SELECT lifetime_count,
+               CASE WHEN month = strftime('%Y-%m', 'now') THEN month_count ELSE 0 END
+        FROM usage_counters 
+        WHERE user_id = ?
+    '''
+    
+    def get_usage(self, user_id):
+        """Obtém os contadores de uso do usuário: total e mês atual"""
+        self.cursor.execute(self.SQL_USAGE, (user_id,))
+        row = self.cursor.fetchone()
+        if not row:
+            return {'lifetime': 0, 'month': 0}
+        return {'lifetime': row[0], 'month': row[1]}
+    
+    def reconcile_usage_counters(self, batch_size=500, pause=0.01):
+        """Recalcula os contadores a partir das descrições, em lotes de usuários
+        
+        Só corrige contadores abaixo do número real de descrições: os
+        contadores nunca diminuem, para que apagar descrições (ver
+        clear_user_history) não devolva cota já usada.
+        Retorna quantos usuários tiveram o contador corrigido.
+        """
+        corrigidos = 0
+        ultimo = 0
+        while True:
+            self.cursor.execute(
+                'SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?', (ultimo, batch_size)
+            )
+            ids = [row[0] for row in self.cursor.fetchall()]
+            if not ids:
+                break
+            
+            self.cursor.execute('''
+                INSERT INTO usage_counters (user_id, lifetime_count, month, month_count)
+                SELECT u.id,
+                       (SELECT COUNT(*) FROM descriptions d WHERE d.user_id = u.id),
+                       strftime('%Y-%m', 'now'),
+                       (SELECT COUNT(*) FROM descriptions d
+                        WHERE d.user_id = u.id AND d.created_at >= strftime('%Y-%m-01', 'now'))
+                FROM users u
+                WHERE u.id BETWEEN ? AND ?
+                ON CONFLICT(user_id) DO UPDATE SET
+                    lifetime_count = MAX(usage_counters.lifetime_count, excluded.lifetime_count),
+                    month_count = CASE WHEN usage_counters.month = excluded.month
+                                       THEN MAX(usage_counters.month_count, excluded.month_count)
+                                       ELSE excluded.month_count END,
+                    month = excluded.month,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE usage_counters.lifetime_count < excluded.lifetime_count
+                   OR usage_counters.month != excluded.month
+                   OR usage_counters.month_count < excluded.month_count
+            ''', (ids[0], ids[-1]))
+            corrigidos += self.cursor.rowcount
+            self.conn.commit()
+            ultimo = ids[-1]
+            time.sleep(pause)
+        
+        if corrigidos:
+            print(f"🔁 Contadores de uso corrigidos: {corrigidos} usuário(s)")
+        return corrigidos
+    
+    # ========== MÉTODOS PARA ANALYTICS ==========
+    
+    # Dimensões disponíveis nos agregados diários
+    ROLLUP_DIMENSIONS = ('day', 'category', 'template', 'tone', 'model')
+    
+    # {dimension} e {ordem} vêm de get_rollup_stats (valores fixos, nunca do usuário)
+    SQL_ROLLUP_STATS = '''
+        SELECT {dimension} AS chave, SUM(count) AS total 
+        FROM analytics_daily 
+        WHERE user_id = ? AND day >= ?
+        GROUP BY chave 
+        ORDER BY {ordem}
+    '''
+    
+    def get_user_analytics(self, user_id):
+        """Resumo do usuário: total, categoria e template mais usados e última atividade"""
+        categorias = self.get_category_stats(user_id)
+        templates = self.get_template_stats(user_id)
+        dias = self.get_daily_activity(user_id)
+        return {
+            'total': sum(total for _, total in dias),
+            'most_used_category': categorias[0][0] if categorias else None,
+            'favorite_template': templates[0][0] if templates else None,
+            'last_activity': dias[-1][0] if dias else None,
+        }
+    
+    def get_category_stats(self, user_id):
+        """Descrições por categoria, da mais usada para a menos usada"""
+        return self.get_rollup_stats(user_id, 'category')
+    
+    def get_template_stats(self, user_id):
+        """Descrições por template, do mais usado para o menos usado"""
+        return self.get_rollup_stats(user_id, 'template')
+    
+    def get_daily_activity(self, user_id, since=None):
+        """Descrições por dia (AAAA-MM-DD), em ordem cronológica"""
+        return self.get_rollup_stats(user_id, 'day', since=since)
     
-    def _update_analytics(self, user_id, category):
-        """Atualiza estatísticas do usuário"""
+    def get_rollup_stats(self, user_id, dimension, since=None):
+        """Contagem por dimensão (day, category, template, tone ou model)
+        
+        Lê os agregados diários; se a tabela ainda não existir (migrações
+        desligadas), cai para um GROUP BY direto em descriptions.
+        """
+        if dimension not in self.ROLLUP_DIMENSIONS:
+            raise ValueError(f"Dimensão inválida: {dimension}")
+        
+        ordem = 'chave' if dimension == 'day' else 'total DESC, chave'
+        if migrations.table_exists(self.conn, 'analytics_daily'):
+            sql = self.SQL_ROLLUP_STATS.format(dimension=dimension, ordem=ordem)
+        else:
+            coluna = 'date(created_at)' if dimension == 'day' else f"COALESCE({dimension}, '')"
+            sql = f'''
+                SELECT {coluna} AS chave, COUNT(*) AS total 
+                FROM descriptions 
+                WHERE user_id = ? AND created_at >= ?
+                GROUP BY chave 
+                ORDER BY {ordem}
+            '''
+        self.cursor.execute(sql, (user_id, since or ''))
+        return [(chave, total) for chave, total in self.cursor.fetchall() if chave]
+    
+    # ========== MÉTODOS PARA CACHE DE GERAÇÕES ==========
+    
+    @staticmethod
+    def make_cache_key(prompt, model, temperature):
+        """Gera a chave do cache a partir do prompt normalizado, modelo e temperatura"""
+        # Espaços e quebras de linha não mudam o pedido, então são normalizados
+        normalized = ' '.join(prompt.split())
+        payload = f"{model}\n{float(temperature):.2f}\n{normalized}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    SQL_CACHED_GENERATION = 'SELECT response, created_at, model FROM generation_cache WHERE cache_key = ?'
+    
+    def get_cached_generation(self, cache_key, with_model=False):
+        """Obtém uma resposta do cache (None se ausente ou expirada)
+        
+        Com with_model=True retorna (resposta, modelo que a gerou).
+        """
+        now = time.time()
+        self.cursor.execute(self.SQL_CACHED_GENERATION, (cache_key,))
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+        
+        response, created_at, model = row
+        if now - created_at > self.cache_ttl:
+            # Entrada expirada: remover para não ocupar espaço
+            self.cursor.execute('DELETE FROM generation_cache WHERE cache_key = ?', (cache_key,))
+            self.conn.commit()
+            return None
+        
+        # Atualizar último acesso (base da política LRU)
+        self.cursor.execute('''
+            UPDATE generation_cache 
+            SET last_access = ?, hits = hits + 1 
+            WHERE cache_key = ?
+        ''', (now, cache_key))
+        self.conn.commit()
+        return (response, model) if with_model else response
+    
+    def save_cached_generation(self, cache_key, model, temperature, response):
+        """Salva uma resposta no cache e aplica TTL/LRU (`model` = modelo que respondeu)"""
         try:
-            # Verificar se já existe registro
-            self.cursor.execute('SELECT * FROM analytics WHERE user_id = ?', (user_id,))
-            existing = self.cursor.fetchone()
+            now = time.time()
+            self.cursor.execute('''
+                INSERT OR REPLACE INTO generation_cache 
+                (cache_key, model, temperature, response, created_at, last_access, hits)
+                VALUES (?, ?, ?, ?, ?, ?, 0)
+            ''', (cache_key, model, float(temperature), response, now, now))
+            self._evict_generation_cache(now)
+            self.conn.commit()
+        except Exception as e:
+            print(f"⚠️ Erro ao salvar no cache: {e}")
+    
+    # ========== MÉTODOS PARA COTA ==========
+    
+    SQL_QUOTA_USAGE = '''
+        SELECT CASE WHEN month = ? THEN month_count ELSE 0 END, reserved
+        FROM usage_counters 
+        WHERE user_id = ?
+    '''
+    
+    def get_quota_usage(self, user_id, month):
+        """Descrições do mês e vagas reservadas (gerações em andamento) do usuário"""
+        self.cursor.execute(self.SQL_QUOTA_USAGE, (month, user_id))
+        row = self.cursor.fetchone()
+        return (row[0], row[1]) if row else (0, 0)
+    
+    def reserve_quota(self, user_id, month, amount, limit, ttl):
+        """Reserva `amount` vagas do mês se couberem no limite; retorna o ID da reserva ou None
+        
+        A verificação e a reserva são um único UPDATE condicional sobre a linha
+        do usuário em usage_counters: duas sessões concorrentes nunca passam
+        juntas do limite, e o custo não depende do tamanho do histórico.
+        Reservas vencidas (gerações que nunca terminaram) são liberadas antes.
+        """
+        agora = time.time()
+        try:
+            self.cursor.execute('''
+                INSERT INTO usage_counters (user_id, lifetime_count, month, month_count)
+                VALUES (?, 0, ?, 0)
+                ON CONFLICT(user_id) DO NOTHING
+            ''', (user_id, month))
+            self._release_expired_quota(user_id, agora)
             
-            if existing:
-                # Atualizar
-                self.cursor.execute('''
-                    UPDATE analytics 
-                    SET total_descriptions = total_descriptions + 1,
-                        most_used_category = ?,
-                        last_activity = CURRENT_TIMESTAMP
-                    WHERE user_id = ?
-                ''', (category, user_id))
-            else:
-                # Criar novo
-                self.cursor.execute('''
-                    INSERT INTO analytics (user_id, total_descriptions, most_used_category)
-                    VALUES (?, 1, ?)
-                ''', (user_id, category))
+            self.cursor.execute('''
+                UPDATE usage_counters SET reserved = reserved + ?
+                WHERE user_id = ?
+                  AND (CASE WHEN month = ? THEN month_count ELSE 0 END) + reserved + ? <= ?
+            ''', (amount, user_id, month, amount, limit))
+            if self.cursor.rowcount == 0:
+                self.conn.commit()
+                return None
             
+            self.cursor.execute(
+                'INSERT INTO quota_reservations (user_id, amount, expires_at) VALUES (?, ?, ?)',
+                (user_id, amount, agora + ttl)
+            )
+            reservation_id = self.cursor.lastrowid
             self.conn.commit()
-            
-        except Exception as e:
-            print(f"⚠️ Erro em analytics: {e}")
+            return reservation_id
+        except Exception:
+            self.conn.rollback()
+            raise
+    
+    def renew_quota(self, reservation_id, ttl):
+        """Adia o vencimento de uma reserva ainda em uso (gerações longas, como lotes)"""
+        self.cursor.execute(
+            'UPDATE quota_reservations SET expires_at = ? WHERE id = ?', (time.time() + ttl, reservation_id)
+        )
+        self.conn.commit()
+        return self.cursor.rowcount > 0
+    
+    def _release_reservation(self, reservation_id):
+        """Apaga a reserva e devolve as vagas ao usuário (não confirma a transação)"""
+        self.cursor.execute(
+            'SELECT user_id, amount FROM quota_reservations WHERE id = ?', (reservation_id,)
+        )
+        row = self.cursor.fetchone()
+        if row is None:
+            return False
+        self.cursor.execute('DELETE FROM quota_reservations WHERE id = ?', (reservation_id,))
+        if self.cursor.rowcount:
+            self.cursor.execute(
+                'UPDATE usage_counters SET reserved = MAX(0, reserved - ?) WHERE user_id = ?',
+                (row[1], row[0])
+            )
+        return True
+    
+    def release_quota(self, reservation_id):
+        """Libera uma reserva (a geração terminou ou falhou); repetir não tem efeito"""
+        try:
+            liberada = self._release_reservation(reservation_id)
+            self.conn.commit()
+            return liberada
+        except Exception:
+            self.conn.rollback()
+            raise
+    
+    # Reserva de um trabalho ainda na fila ou em andamento não vence: quem a
+    # libera é o worker ao terminar, ou requeue_stale_jobs ao desistir do trabalho
+    EXPIRED_QUOTA_WHERE = '''
+        user_id = ? AND expires_at < ? AND NOT EXISTS (
+            SELECT 1 FROM generation_jobs 
+            WHERE generation_jobs.reservation_id = quota_reservations.id 
+              AND generation_jobs.status IN ('pending', 'running')
+        )
+    '''
+    SQL_RELEASE_EXPIRED_QUOTA = f'''
+        UPDATE usage_counters 
+        SET reserved = MAX(0, reserved - (
+            SELECT COALESCE(SUM(amount), 0) FROM quota_reservations 
+            WHERE {EXPIRED_QUOTA_WHERE}
+        ))
+        WHERE user_id = ?
+    '''
+    SQL_DELETE_EXPIRED_QUOTA = f'DELETE FROM quota_reservations WHERE {EXPIRED_QUOTA_WHERE}'
+    
+    def _release_expired_quota(self, user_id, now):
+        """Devolve as vagas de reservas vencidas do usuário (não confirma a transação)"""
+        # O UPDATE vem primeiro: com a trava de escrita já tomada, a soma e o
+        # DELETE enxergam as mesmas reservas
+        self.cursor.execute(self.SQL_RELEASE_EXPIRED_QUOTA, (user_id, now, user_id))
+        self.cursor.execute(self.SQL_DELETE_EXPIRED_QUOTA, (user_id, now))
+    
+    # ========== MÉTODOS PARA PAGAMENTOS ==========
+    
+    PAYMENT_COLUMNS = ('id', 'user_id', 'plan', 'amount_cents', 'currency', 'provider', 'idempotency_key',
+                       'status', 'provider_ref', 'error', 'created_at', 'updated_at')
+    
+    def _payment_row(self, where, params):
+        """Primeiro pagamento que atende à condição, como dicionário (ou None)"""
+        self.cursor.execute(
+            f"SELECT {', '.join(self.PAYMENT_COLUMNS)} FROM payments WHERE {where}", params
+        )
+        row = self.cursor.fetchone()
+        return dict(zip(self.PAYMENT_COLUMNS, row)) if row else None
+    
+    def create_payment(self, user_id, plan, amount_cents, provider, idempotency_key, currency='BRL'):
+        """Registra um pagamento pendente e o retorna (dicionário)
+        
+        A chave de idempotência é única: repetir o pedido (clique duplo, rerun,
+        nova tentativa) devolve o pagamento já existente em vez de criar outro.
+        """
+        self.cursor.execute('''
+            INSERT INTO payments (user_id, plan, amount_cents, currency, provider, idempotency_key)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(idempotency_key) DO NOTHING
+        ''', (user_id, plan, amount_cents, currency, provider, idempotency_key))
+        self.conn.commit()
+        
+        payment = self.get_payment_by_key(idempotency_key)
+        if payment['user_id'] != user_id:
+            raise ValueError("Chave de idempotência já usada por outro usuário")
+        return payment
+    
+    def get_payment(self, payment_id):
+        """Obtém um pagamento pelo ID (dicionário ou None)"""
+        return self._payment_row('id = ?', (payment_id,))
+    
+    def get_payment_by_key(self, idempotency_key):
+        """Obtém um pagamento pela chave de idempotência (dicionário ou None)"""
+        return self._payment_row('idempotency_key = ?', (idempotency_key,))
+    
+    SQL_OPEN_PAYMENTS = f'''
+        SELECT {', '.join(PAYMENT_COLUMNS)} FROM payments
+        WHERE status IN ('pending', 'processing')
+    '''
+    
+    def get_open_payments(self):
+        """Pagamentos ainda não concluídos (para retomar após reiniciar o processo)"""
+        self.cursor.execute(self.SQL_OPEN_PAYMENTS)
+        return [dict(zip(self.PAYMENT_COLUMNS, row)) for row in self.cursor.fetchall()]
+    
+    def set_payment_status(self, payment_id, status, provider_ref=None, error=None):
+        """Muda o status de um pagamento em aberto; retorna False se ele já estava concluído"""
+        self.cursor.execute('''
+            UPDATE payments 
+            SET status = ?, provider_ref = COALESCE(?, provider_ref), error = ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status IN ('pending', 'processing')
+        ''', (status, provider_ref, error, payment_id))
+        self.conn.commit()
+        return self.cursor.rowcount > 0
+    
+    def complete_payment(self, payment_id, provider_ref):
+        """Aprova o pagamento e muda o plano do usuário na mesma transação
+        
+        Só tem efeito uma vez: se o pagamento já foi concluído, nada muda e
+        retorna False.
+        """
+        try:
+            self.cursor.execute('''
+                UPDATE payments 
+                SET status = 'approved', provider_ref = ?, error = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status IN ('pending', 'processing')
+            ''', (provider_ref, payment_id))
+            if self.cursor.rowcount == 0:
+                self.conn.rollback()
+                return False
+            self.cursor.execute('''
+                UPDATE users SET plan = (SELECT plan FROM payments WHERE id = ?)
+                WHERE id = (SELECT user_id FROM payments WHERE id = ?)
+            ''', (payment_id, payment_id))
+            self.conn.commit()
+            return True
+        except Exception:
+            self.conn.rollback()
+            raise
+    
+    # ========== MÉTODOS PARA A FILA DE GERAÇÕES ==========
+    
+    JOB_COLUMNS = ('id', 'user_id', 'status', 'params', 'reservation_id', 'result', 'error',
+                   'attempts', 'created_at', 'finished_at', 'partial')
+    
+    def _job_from_row(self, row):
+        """Converte uma linha de generation_jobs em dicionário (params e result decodificados)"""
+        job = dict(zip(self.JOB_COLUMNS, row))
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+    
+    def enqueue_job(self, user_id, params, reservation_id=None, owner=None):
+        """Coloca uma geração na fila e retorna o ID do trabalho
+        
+        `owner` é o pool que guarda a chave da API do pedido: só ele pega o
+        trabalho. Sem dono, o trabalho fica para pools que usam a chave do servidor.
+        """
+        self.cursor.execute('''
+            INSERT INTO generation_jobs (user_id, params, reservation_id, owner, heartbeat_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, json.dumps(params, ensure_ascii=False), reservation_id, owner, time.time()))
+        self.conn.commit()
+        return self.cursor.lastrowid
+    
+    SQL_NEXT_PENDING_JOB = "SELECT id FROM generation_jobs WHERE owner = ? AND status = 'pending' ORDER BY id LIMIT 1"
+    SQL_NEXT_UNOWNED_JOB = "SELECT id FROM generation_jobs WHERE owner IS NULL AND status = 'pending' ORDER BY id LIMIT 1"
+    
+    def claim_job(self, owner, unowned=False):
+        """Pega o trabalho pendente mais antigo de `owner` (ou None se não houver)
+        
+        Com `unowned`, também pega trabalhos sem dono (para quem usa a chave
+        do servidor); o trabalho pego passa a ser de `owner`. O UPDATE só vale
+        se o trabalho ainda estiver pendente: workers concorrentes (em threads
+        ou processos) nunca pegam o mesmo trabalho.
+        """
+        while True:
+            candidatos = []
+            if owner is not None:
+                self.cursor.execute(self.SQL_NEXT_PENDING_JOB, (owner,))
+                candidatos += self.cursor.fetchall()
+            if unowned:
+                self.cursor.execute(self.SQL_NEXT_UNOWNED_JOB)
+                candidatos += self.cursor.fetchall()
+            if not candidatos:
+                return None
+            job_id = min(candidatos)[0]
+            agora = time.time()
+            self.cursor.execute('''
+                UPDATE generation_jobs 
+                SET status = 'running', owner = ?, started_at = ?, heartbeat_at = ?, attempts = attempts + 1
+                WHERE id = ? AND status = 'pending'
+            ''', (owner, agora, agora, job_id))
+            self.conn.commit()
+            if self.cursor.rowcount:
+                return self.get_job(job_id)
+    
+    def finish_job(self, job_id, result):
+        """Marca o trabalho como concluído com o resultado (IDs das descrições salvas)"""
+        self.cursor.execute('''
+            UPDATE generation_jobs 
+            SET status = 'done', result = ?, error = NULL, partial = NULL, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'running'
+        ''', (json.dumps(result), job_id))
+        self.conn.commit()
+        return self.cursor.rowcount > 0
+    
+    def fail_job(self, job_id, error):
+        """Marca o trabalho como falho"""
+        self.cursor.execute('''
+            UPDATE generation_jobs 
+            SET status = 'failed', error = ?, partial = NULL, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status IN ('pending', 'running')
+        ''', (error, job_id))
+        self.conn.commit()
+        return self.cursor.rowcount > 0
+    
+    def update_job_partial(self, job_id, text):
+        """Grava o texto recebido até agora (streaming), enquanto o trabalho está em andamento"""
+        self.cursor.execute(
+            "UPDATE generation_jobs SET partial = ? WHERE id = ? AND status = 'running'", (text, job_id)
+        )
+        self.conn.commit()
+        return self.cursor.rowcount > 0
+    
+    SQL_HEARTBEAT_JOBS = '''
+        UPDATE generation_jobs SET heartbeat_at = ? 
+        WHERE owner = ? AND status IN ('pending', 'running')
+    '''
+    
+    def heartbeat_jobs(self, owner):
+        """Renova o heartbeat dos trabalhos de `owner` na fila ou em andamento (o dono continua vivo)"""
+        self.cursor.execute(self.SQL_HEARTBEAT_JOBS, (time.time(), owner))
+        self.conn.commit()
+        return self.cursor.rowcount
+    
+    SQL_STALE_JOBS = '''
+        SELECT id, attempts, reservation_id FROM generation_jobs 
+        WHERE status = ? AND heartbeat_at < ?
+    '''
+    
+    def requeue_stale_jobs(self, older_than, max_attempts):
+        """Trata os trabalhos cujo dono parou de dar sinal (o processo morreu)
+        
+        Só conta o heartbeat: trabalho lento com dono vivo não é tocado. A
+        chave da API morreu junto com o dono, então o trabalho em andamento
+        volta para a fila sem dono (só pools com a chave do servidor o pegam)
+        e o que estava na fila falha. Falham também os trabalhos que já
+        esgotaram as tentativas; trabalhos falhos liberam a reserva de cota
+        na mesma transação. Retorna (devolvidos, falhos).
+        """
+        agora = time.time()
+        limite = agora - older_than
+        devolvidos = falhos = 0
+        try:
+            # BEGIN IMMEDIATE: os trabalhos lidos são os mesmos alterados
+            self.conn.commit()
+            self.cursor.execute('BEGIN IMMEDIATE')
+            # Os da fila primeiro: quem volta para a fila agora ganha um prazo novo
+            for status in ('pending', 'running'):
+                self.cursor.execute(self.SQL_STALE_JOBS, (status, limite))
+                for job_id, attempts, reservation_id in self.cursor.fetchall():
+                    if status == 'running' and attempts < max_attempts:
+                        self.cursor.execute('''
+                            UPDATE generation_jobs 
+                            SET status = 'pending', owner = NULL, partial = NULL, heartbeat_at = ?
+                            WHERE id = ?
+                        ''', (agora, job_id))
+                        devolvidos += 1
+                        continue
+                    erro = 'Tentativas esgotadas' if status == 'running' else \
+                        'Chave da API indisponível (o servidor reiniciou). Gere novamente.'
+                    self.cursor.execute('''
+                        UPDATE generation_jobs 
+                        SET status = 'failed', error = ?, partial = NULL, finished_at = CURRENT_TIMESTAMP
+                        WHERE id = ?
+                    ''', (erro, job_id))
+                    if reservation_id is not None:
+                        self._release_reservation(reservation_id)
+                    falhos += 1
+            self.conn.commit()
+            return devolvidos, falhos
+        except Exception:
+            self.conn.rollback()
+            raise
+    
+    def get_job(self, job_id, user_id=None):
+        """Obtém um trabalho pelo ID (dicionário ou None); com user_id, só se for do usuário"""
+        self.cursor.execute(
+            f"SELECT {', '.join(self.JOB_COLUMNS)} FROM generation_jobs WHERE id = ?", (job_id,)
+        )
+        row = self.cursor.fetchone()
+        if row is None or (user_id is not None and row[1] != user_id):
+            return None
+        return self._job_from_row(row)
+    
+    SQL_ACTIVE_JOBS = f'''
+        SELECT {', '.join(JOB_COLUMNS)} FROM generation_jobs
+        WHERE user_id = ? AND status IN ('pending', 'running')
+        ORDER BY id
+    '''
+    
+    def get_active_jobs(self, user_id):
+        """Trabalhos do usuário ainda na fila ou em processamento, do mais antigo ao mais novo"""
+        self.cursor.execute(self.SQL_ACTIVE_JOBS, (user_id,))
+        return [self._job_from_row(row) for row in self.cursor.fetchall()]
+    
+    # ========== MÉTODOS PARA CHAVES DE API ==========
+    
+    API_KEY_PREFIX = 'dia_'
+    
+    @staticmethod
+    def hash_api_key(key):
+        """Hash guardado no banco (a chave em si nunca é gravada)"""
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+    
+    def create_api_key(self, user_id, name=None):
+        """Cria uma chave de acesso à API para o usuário e a retorna (só desta vez)"""
+        key = self.API_KEY_PREFIX + secrets.token_urlsafe(32)
+        self.cursor.execute(
+            'INSERT INTO api_keys (user_id, key_hash, prefix, name) VALUES (?, ?, ?, ?)',
+            (user_id, self.hash_api_key(key), key[:len(self.API_KEY_PREFIX) + 6], name)
+        )
+        self.conn.commit()
+        return key
+    
+    SQL_API_KEY_USER = '''
+        SELECT u.id, u.email, u.plan 
+        FROM api_keys k JOIN users u ON u.id = k.user_id
+        WHERE k.key_hash = ? AND k.revoked_at IS NULL
+    '''
+    
+    def get_api_key_user(self, key):
+        """Usuário dono de uma chave ativa: (user_id, email, plan) ou None"""
+        self.cursor.execute(self.SQL_API_KEY_USER, (self.hash_api_key(key),))
+        return self.cursor.fetchone()
+    
+    def list_api_keys(self, user_id):
+        """Chaves do usuário: (id, prefixo, nome, criada em, revogada em)"""
+        self.cursor.execute('''
+            SELECT id, prefix, name, created_at, revoked_at FROM api_keys 
+            WHERE user_id = ? ORDER BY id
+        ''', (user_id,))
+        return self.cursor.fetchall()
+    
+    def revoke_api_key(self, key_id, user_id):
+        """Revoga uma chave do usuário; retorna False se ela não existir ou já estiver revogada"""
+        self.cursor.execute('''
+            UPDATE api_keys SET revoked_at = CURRENT_TIMESTAMP 
+            WHERE id = ? AND user_id = ? AND revoked_at IS NULL
+        ''', (key_id, user_id))
+        self.conn.commit()
+        return self.cursor.rowcount > 0
+    
+    # ========== DIAGNÓSTICO ==========
+    
+    # Consultas executadas a cada renderização da página, pela fila e pela
+    # API: as mesmas constantes SQL que os métodos executam, com parâmetros
+    # de exemplo
+    HOT_QUERIES = {
+        'get_description_summaries': (SQL_SUMMARIES_FIRST, (1, 20)),
+        'get_description_summaries (cursor)': (SQL_SUMMARIES_BEFORE, (1, '9999-12-31', 0, 20)),
+        'get_description_text': (SQL_DESCRIPTION_TEXT, (1, 1)),
+        'get_usage': (SQL_USAGE, (1,)),
+        'get_daily_activity': (SQL_ROLLUP_STATS.format(dimension='day', ordem='chave'), (1, '')),
+        'get_cached_generation': (SQL_CACHED_GENERATION, ('x',)),
+        'get_quota_usage': (SQL_QUOTA_USAGE, ('2000-01', 1)),
+        'release_expired_quota': (SQL_RELEASE_EXPIRED_QUOTA, (1, 0, 1)),
+        'release_expired_quota (delete)': (SQL_DELETE_EXPIRED_QUOTA, (1, 0)),
+        'get_open_payments': (SQL_OPEN_PAYMENTS, ()),
+        'claim_job': (SQL_NEXT_PENDING_JOB, ('x',)),
+        'claim_job (sem dono)': (SQL_NEXT_UNOWNED_JOB, ()),
+        'heartbeat_jobs': (SQL_HEARTBEAT_JOBS, (0, 'x')),
+        'get_active_jobs': (SQL_ACTIVE_JOBS, (1,)),
+        'get_api_key_user': (SQL_API_KEY_USER, ('x',)),
+        'import_descriptions': (SQL_IMPORTED_DESCRIPTION, (1, '2000-01-01 00:00:00', 'x', 'x')),
+        'requeue_stale_jobs': (SQL_STALE_JOBS, ('running', 0)),
+    }
+    
+    def audit_query_plans(self):
+        """Executa EXPLAIN QUERY PLAN nas consultas frequentes e aponta varreduras completas"""
+        resultado = []
+        for nome, (sql, params) in self.HOT_QUERIES.items():
+            self.cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            detalhes = [row[3] for row in self.cursor.fetchall()]
+            # SCAN = varredura da tabela/índice inteiro; TEMP B-TREE = ordenação em memória
+            scan = any(d.startswith('SCAN') or 'TEMP B-TREE' in d for d in detalhes)
+            resultado.append({'query': nome, 'plan': detalhes, 'scan': scan})
+        return resultado
+    
+    # ========== MÉTODOS AUXILIARES ==========
+    
+    def _evict_generation_cache(self, now):
+        """Remove entradas expiradas e as menos usadas acima do limite"""
+        self.cursor.execute(
+            'DELETE FROM generation_cache WHERE created_at < ?',
+            (now - self.cache_ttl,)
+        )
+        self.cursor.execute('''
+            DELETE FROM generation_cache 
+            WHERE cache_key IN (
+                SELECT cache_key FROM generation_cache 
+                ORDER BY last_access DESC 
+                LIMIT -1 OFFSET ?
+            )
+        ''', (self.cache_max_entries,))
+    
+    # Colunas de um registro de descrição, na ordem usada por _write_descriptions
+    # (created_at None = agora)
+    RECORD_COLUMNS = ('user_id', 'product_name', 'category', 'tone', 'keywords', 'size',
+                      'template', 'description', 'formato', 'group_id', 'model', 'created_at')
+    # Versão do esquema em que cada coluna ou tabela de estatística passou a
+    # existir (para analytics, o índice único que o UPSERT usa)
+    SCHEMA_REQUIREMENTS = {'group_id': 3, 'analytics': 4, 'usage_counters': 5,
+                           'analytics_daily': 6, 'model': 6}
+    
+    def _schema_has(self, name, version):
+        """A coluna de descriptions ou tabela de estatística já pode ser usada
+        
+        Abaixo da versão exigida confere o próprio objeto: durante uma migração
+        online a tabela já existe antes de a versão ser registrada, e as
+        gravações desse intervalo precisam entrar nos agregados.
+        """
+        if self.SCHEMA_REQUIREMENTS.get(name, 0) <= version:
+            return True
+        if name in self.RECORD_COLUMNS:
+            return name in {row[1] for row in self.conn.execute('PRAGMA table_info(descriptions)')}
+        tipo, objeto = ('index', 'idx_analytics_user') if name == 'analytics' else ('table', name)
+        row = self.conn.execute(
+            'SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?', (tipo, objeto)
+        ).fetchone()
+        return row is not None
+    
+    def _write_descriptions(self, records, return_ids=True):
+        """Insere descrições e atualiza contadores, agregados e analytics
+        
+        Não confirma a transação: quem chama faz o commit (uma vez por
+        descrição, por grupo de variantes ou por lote do GroupCommitWriter).
+        As estatísticas são somadas por usuário/combinação antes de gravar,
+        então um lote grande custa poucos UPSERTs. Retorna os IDs na ordem
+        (com return_ids=False usa executemany e retorna None).
+        
+        Com migrações pendentes (DB_AUTO_MIGRATE=0) grava só as colunas e
+        estatísticas que o esquema já tem; as migrações que criam as tabelas
+        de estatística as preenchem a partir de descriptions. As estatísticas
+        são conferidas depois do INSERT, já com a trava de escrita, para que
+        a migração não crie a tabela entre a conferência e a gravação.
+        """
+        versao = self.schema_version()
+        existe = lambda nome: self._schema_has(nome, versao)
+        
+        manter = [i for i, coluna in enumerate(self.RECORD_COLUMNS[:-1]) if existe(coluna)]
+        linhas = records
+        if len(manter) < len(self.RECORD_COLUMNS) - 1:
+            linhas = [tuple(record[i] for i in manter) + (record[-1],) for record in records]
+        colunas = ', '.join(self.RECORD_COLUMNS[i] for i in manter)
+        sql = f'''
+            INSERT INTO descriptions ({colunas}, created_at)
+            VALUES ({', '.join('?' * len(manter))}, COALESCE(?, CURRENT_TIMESTAMP))
+        '''
+        ids = None
+        if return_ids:
+            ids = []
+            for linha in linhas:
+                self.cursor.execute(sql, linha)
+                ids.append(self.cursor.lastrowid)
+        else:
+            self.cursor.executemany(sql, linhas)
+        
+        hoje = time.strftime('%Y-%m-%d', time.gmtime())
+        uso = {}
+        agregados = {}
+        ultima_categoria = {}
+        for record in records:
+            user_id, _, category, tone, _, _, template, _, _, _, model, created_at = record
+            dia = str(created_at)[:10] if created_at else hoje
+            total, no_mes = uso.get(user_id, (0, 0))
+            uso[user_id] = (total + 1, no_mes + int(dia[:7] == hoje[:7]))
+            chave = (user_id, dia, category or '', template or '', tone or '', model or '')
+            agregados[chave] = agregados.get(chave, 0) + 1
+            ultima_categoria[user_id] = category
+        
+        if existe('usage_counters'):
+            self.cursor.executemany('''
+                INSERT INTO usage_counters (user_id, lifetime_count, month, month_count)
+                VALUES (?, ?, strftime('%Y-%m', 'now'), ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    lifetime_count = lifetime_count + excluded.lifetime_count,
+                    month_count = CASE WHEN month = excluded.month
+                                       THEN month_count + excluded.month_count
+                                       ELSE excluded.month_count END,
+                    month = excluded.month,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', [(user_id, total, no_mes) for user_id, (total, no_mes) in uso.items()])
+        
+        if existe('analytics_daily'):
+            self.cursor.executemany('''
+                INSERT INTO analytics_daily (user_id, day, category, template, tone, model, count)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, day, category, template, tone, model) 
+                DO UPDATE SET count = count + excluded.count
+            ''', [chave + (count,) for chave, count in agregados.items()])
+        
+        if existe('analytics'):
+            # Depende dos agregados acima para achar a categoria mais usada
+            mais_usada = '''(
+                SELECT category FROM analytics_daily 
+                WHERE user_id = excluded.user_id 
+                GROUP BY category 
+                ORDER BY SUM(count) DESC 
+                LIMIT 1
+            )''' if existe('analytics_daily') else 'NULL'
+            self.cursor.executemany(f'''
+                INSERT INTO analytics (user_id, total_descriptions, most_used_category)
+                VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    total_descriptions = total_descriptions + excluded.total_descriptions,
+                    most_used_category = COALESCE({mais_usada}, excluded.most_used_category),
+                    last_activity = CURRENT_TIMESTAMP
+            ''', [(user_id, total, ultima_categoria[user_id]) for user_id, (total, _) in uso.items()])
+        
+        return ids
     
     def close(self):
-        """Fecha a conexão"""
-        self.conn.close()
\ No newline at end of file
+        """Fecha as conexões do pool (as que estão em uso fecham ao fim de suas threads)"""
+        if self.writer is not None:
+            # Gravar o que ainda está na fila antes de fechar
+            self.writer.close()
+        
+        self._shutdown.set()
+        with self._pool_lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+        
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+class GroupCommitWriter:
+    """Thread única que grava descrições em lote ("group commit")
+    
+    As sessões enfileiram registros e recebem um Future. A cada volta, a
+    thread pega tudo o que se acumulou na fila (até `max_rows`) enquanto o
+    lote anterior era gravado e confirma em uma única transação, trocando
+    um fsync por descrição por um fsync por lote. Com `linger` > 0 ela
+    ainda espera até esse tempo por mais registros antes de gravar (útil
+    para quem enfileira sem esperar o resultado, como importações).
+    Se o lote falhar, cada pedido é refeito em sua própria transação,
+    para que um registro ruim não derrube os outros.
+    """
+    
+    _FECHAR = object()
+    
+    def __init__(self, db, max_rows=1000, linger=0.0):
+        self.db = db
+        self.max_rows = max_rows
+        self.linger = linger
+        self._fila = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+    
+    def submit(self, record):
+        """Enfileira uma descrição; o Future devolve o ID"""
+        futuro = Future()
+        self._fila.put(([record], futuro, True))
+        return futuro
+    
+    def submit_many(self, records):
+        """Enfileira descrições que devem ir na mesma transação; o Future devolve os IDs"""
+        futuro = Future()
+        self._fila.put((list(records), futuro, False))
+        return futuro
+    
+    def close(self, timeout=None):
+        """Grava o que está na fila e encerra a thread"""
+        self._fila.put(self._FECHAR)
+        self._thread.join(timeout)
+    
+    def _run(self):
+        """Junta os pedidos pendentes (até o tamanho máximo) e grava o lote"""
+        fechar = False
+        while not fechar:
+            pedido = self._fila.get()
+            if pedido is self._FECHAR:
+                break
+            lote = [pedido]
+            linhas = len(pedido[0])
+            prazo = time.monotonic() + self.linger
+            while linhas < self.max_rows:
+                try:
+                    restante = prazo - time.monotonic()
+                    if restante > 0:
+                        pedido = self._fila.get(timeout=restante)
+                    else:
+                        pedido = self._fila.get_nowait()
+                except queue.Empty:
+                    break
+                if pedido is self._FECHAR:
+                    fechar = True
+                    break
+                lote.append(pedido)
+                linhas += len(pedido[0])
+            self._flush(lote)
+    
+    def _flush(self, lote):
+        """Grava o lote em uma transação e resolve os Futures"""
+        db = self.db
+        try:
+            ids = db._write_descriptions([record for records, _, _ in lote for record in records])
+            db.conn.commit()
+        except Exception:
+            db.conn.rollback()
+            # Refazer um pedido por vez para isolar o registro com problema
+            for records, futuro, unico in lote:
+                try:
+                    ids = db._write_descriptions(records)
+                    db.conn.commit()
+                except Exception as e:
+                    db.conn.rollback()
+                    futuro.set_exception(e)
+                    continue
+                futuro.set_result(ids[0] if unico else ids)
+            return
+        
+        inicio = 0
+        for records, futuro, unico in lote:
+            parte = ids[inicio:inicio + len(records)]
+            inicio += len(records)
+            futuro.set_result(parte[0] if unico else parte)
+
+def start_usage_reconciler(db, interval):
+    """Inicia a thread que reconcilia os contadores de uso periodicamente"""
+    def loop():
+        # Termina assim que o banco é fechado, sem esperar o intervalo
+        while not db._shutdown.wait(interval):
+            try:
+                db.reconcile_usage_counters()
+            except Exception as e:
+                print(f"⚠️ Erro ao reconciliar contadores: {e}")
+    
+    thread = threading.Thread(target=loop, name="usage-reconciler", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,331 @@
+"""
+Pool de clientes Gemini compartilhado pelo processo
+
+Um único cliente por chave de API é reutilizado entre reruns e sessões do
+Streamlit. As chamadas rodam em um event loop asyncio próprio (em uma thread
+de fundo), onde um agendador por chave respeita os limites de requisições
+por minuto (RPM) e tokens por minuto (TPM): pedidos acima do limite esperam
+na fila em vez de receberem erro 429 da API. Falhas transitórias passam
+pela política de resiliência (repetição, fallback de modelo, hedge e
+disjuntor) definida em resilience.py.
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from resilience import ResilientCaller, PartialStreamError, cadeia_modelos
+
+# Janela usada pelos limites da API
+JANELA_SEGUNDOS = 60.0
+
+# Marca o fim de um streaming na fila entre o event loop e a thread do Streamlit
+_FIM_STREAM = object()
+
+def estimate_tokens(prompt, max_output_tokens=800, system_instruction=''):
+    """Estimativa simples de tokens (≈4 caracteres por token) de entrada + saída"""
+    return (len(prompt) + len(system_instruction or '')) // 4 + max_output_tokens
+
+class RateLimiter:
+    """Limita requisições e tokens por minuto em uma janela deslizante"""
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._events = deque()  # [instante, tokens] de cada requisição na janela
+        self._tokens = 0
+        self._lock = asyncio.Lock()  # Fila FIFO de quem espera por vaga
+        self.waiting = 0
+
+    def _purge(self, now):
+        """Remove da janela as requisições com mais de um minuto"""
+        while self._events and now - self._events[0][0] >= JANELA_SEGUNDOS:
+            _, tokens = self._events.popleft()
+            self._tokens -= tokens
+
+    def _has_room(self, tokens):
+        """Verifica se a requisição cabe nos limites atuais"""
+        if not self._events:
+            # Janela vazia: sempre liberar, mesmo que o pedido sozinho passe do TPM
+            return True
+        return len(self._events) < self.rpm and self._tokens + tokens <= self.tpm
+
+    async def acquire(self, tokens):
+        """Espera até haver orçamento e reserva a requisição na janela"""
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    self._purge(now)
+                    if self._has_room(tokens):
+                        event = [now, tokens]
+                        self._events.append(event)
+                        self._tokens += tokens
+                        return event
+                    # Dormir até a requisição mais antiga sair da janela
+                    espera = JANELA_SEGUNDOS - (now - self._events[0][0])
+                    await asyncio.sleep(max(espera, 0.05))
+        finally:
+            self.waiting -= 1
+
+    def settle(self, event, actual_tokens):
+        """Troca a estimativa de tokens pelo consumo real informado pela API"""
+        if actual_tokens is None or event not in self._events:
+            return
+        self._tokens += actual_tokens - event[1]
+        event[1] = actual_tokens
+
+class KeyScheduler:
+    """Agendador de uma chave: limite de taxa + concorrência máxima"""
+
+    def __init__(self, rpm, tpm, max_concurrency):
+        self.limiter = RateLimiter(rpm, tpm)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting_slot = 0
+        self.in_flight = 0
+
+    @property
+    def queue_depth(self):
+        """Pedidos esperando vaga (por concorrência ou por limite de taxa)"""
+        return self.waiting_slot + self.limiter.waiting
+
+    async def run(self, tokens, coro_factory):
+        """Executa a chamada quando houver vaga e orçamento"""
+        self.waiting_slot += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting_slot -= 1
+
+        try:
+            # O orçamento só é reservado no momento em que a chamada vai sair
+            event = await self.limiter.acquire(tokens)
+            self.in_flight += 1
+            try:
+                response = await coro_factory()
+            finally:
+                self.in_flight -= 1
+        finally:
+            self.semaphore.release()
+
+        usage = getattr(response, 'usage_metadata', None)
+        self.limiter.settle(event, getattr(usage, 'total_token_count', None))
+        return response
+
+class GeminiPool:
+    """Clientes e agendadores por chave, rodando em um event loop de fundo"""
+
+    def __init__(self, rpm=None, tpm=None, max_concurrency=None):
+        self.rpm = rpm or int(os.getenv("GEMINI_RPM", 60))
+        self.tpm = tpm or int(os.getenv("GEMINI_TPM", 250000))
+        self.max_concurrency = max_concurrency or int(os.getenv("GEMINI_MAX_CONCURRENCY", 8))
+        self._clients = {}
+        self._schedulers = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._closed = False
+        self.resilience = ResilientCaller()
+
+    # ========== EVENT LOOP ==========
+
+    def _schedule(self, coro):
+        """Agenda a corrotina no event loop de fundo (iniciado na primeira vez)
+
+        Feito sob o lock para que close() nunca pare o loop entre a checagem e
+        o agendamento, o que deixaria o Future sem resposta.
+        """
+        with self._lock:
+            if self._closed:
+                coro.close()
+                raise RuntimeError("Pool Gemini já foi fechado")
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="gemini-pool", daemon=True
+                )
+                self._thread.start()
+            return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def healthy(self):
+        """O pool não foi fechado e o event loop, se já foi iniciado, continua rodando"""
+        with self._lock:
+            return not self._closed and (self._thread is None or self._thread.is_alive())
+
+    def close(self, timeout=5):
+        """Para o event loop de fundo e descarta os clientes
+
+        Gerações ainda em andamento são canceladas (quem espera o Future recebe
+        CancelledError); depois de fechado, submit e stream levantam RuntimeError.
+        """
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+            self._closed = True
+            self._clients.clear()
+            self._schedulers.clear()
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop)
+            thread.join(timeout)
+            if not thread.is_alive():
+                loop.close()
+
+    async def _shutdown(self):
+        """Cancela as tarefas pendentes do loop e o para"""
+        atual = asyncio.current_task()
+        tarefas = [t for t in asyncio.all_tasks() if t is not atual]
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        asyncio.get_running_loop().stop()
+
+    # ========== CLIENTES E AGENDADORES ==========
+
+    def get_client(self, api_key):
+        """Retorna o cliente Gemini da chave, criando-o na primeira vez"""
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                http_options = {'api_version': 'v1'}
+                # Permite apontar para um servidor local (ex.: gemini_stub.py) em testes
+                if os.getenv("GEMINI_BASE_URL"):
+                    http_options['base_url'] = os.getenv("GEMINI_BASE_URL")
+                # Importado só aqui: o SDK é pesado e a tela de login não precisa dele
+                from google import genai
+                client = genai.Client(api_key=api_key, http_options=http_options)
+                self._clients[api_key] = client
+            return client
+
+    def _get_scheduler(self, api_key):
+        """Retorna o agendador da chave (deve rodar dentro do event loop)"""
+        scheduler = self._schedulers.get(api_key)
+        if scheduler is None:
+            scheduler = KeyScheduler(self.rpm, self.tpm, self.max_concurrency)
+            self._schedulers[api_key] = scheduler
+        return scheduler
+
+    def queue_depth(self, api_key=None):
+        """Quantidade de pedidos na fila (de uma chave ou de todas)"""
+        if api_key is not None:
+            scheduler = self._schedulers.get(api_key)
+            return scheduler.queue_depth if scheduler else 0
+        return sum(s.queue_depth for s in list(self._schedulers.values()))
+
+    def stats(self):
+        """Resumo por chave (fila e chamadas em andamento) e estado dos disjuntores"""
+        return {
+            'chaves': {
+                f"...{key[-4:]}": {'fila': s.queue_depth, 'em_andamento': s.in_flight}
+                for key, s in list(self._schedulers.items())
+            },
+            'modelos': {
+                modelo: breaker.state
+                for modelo, breaker in list(self.resilience.breakers.items())
+            },
+        }
+
+    # ========== GERAÇÃO ==========
+
+    async def generate_async(self, api_key, model, prompt, config=None, fallback=True):
+        """Gera conteúdo respeitando os limites da chave
+
+        Retorna (modelo, resposta da API): o modelo é o que respondeu de fato,
+        que depois de um fallback não é o pedido.
+        """
+        client = self.get_client(api_key)
+        scheduler = self._get_scheduler(api_key)
+        config = config or {}
+        tokens = estimate_tokens(prompt, config.get('max_output_tokens', 800), config.get('system_instruction'))
+
+        async def chamada(modelo):
+            return await scheduler.run(
+                tokens,
+                lambda: client.aio.models.generate_content(model=modelo, contents=prompt, config=config)
+            )
+
+        modelos = cadeia_modelos(model) if fallback else [model]
+        return await self.resilience.call(modelos, chamada)
+
+    def submit(self, api_key, model, prompt, config=None, fallback=True):
+        """Agenda a geração e retorna um concurrent.futures.Future de (modelo, resposta)"""
+        return self._schedule(self.generate_async(api_key, model, prompt, config, fallback))
+
+    def generate(self, api_key, model, prompt, config=None, timeout=None, fallback=True):
+        """Versão bloqueante de submit; retorna (texto gerado, modelo que respondeu)"""
+        modelo, response = self.submit(api_key, model, prompt, config, fallback).result(timeout)
+        return response.text, modelo
+
+    async def _stream_async(self, api_key, model, prompt, config, saida, fallback=True):
+        """Consome o streaming da API, repassando cada trecho para a fila de saída"""
+        client = self.get_client(api_key)
+        scheduler = self._get_scheduler(api_key)
+        config = config or {}
+        tokens = estimate_tokens(prompt, config.get('max_output_tokens', 800), config.get('system_instruction'))
+
+        async def chamada(modelo):
+            async def consumir():
+                ultimo = None
+                stream = await client.aio.models.generate_content_stream(
+                    model=modelo, contents=prompt, config=config
+                )
+                try:
+                    async for chunk in stream:
+                        ultimo = chunk
+                        if chunk.text:
+                            saida.put(chunk.text)
+                except Exception as e:
+                    # Depois do primeiro trecho não dá para repetir sem duplicar texto
+                    if ultimo is not None:
+                        raise PartialStreamError(e) from e
+                    raise
+                # O último trecho traz o consumo total de tokens
+                return ultimo
+
+            return await scheduler.run(tokens, consumir)
+
+        modelos = cadeia_modelos(model) if fallback else [model]
+        # Sem hedge: duas respostas em streaming misturariam os trechos na mesma fila
+        modelo, _ = await self.resilience.call(modelos, chamada, hedge=False)
+        return modelo
+
+    def stream(self, api_key, model, prompt, config=None, fallback=True):
+        """Gera o conteúdo em streaming; itere para receber os trechos conforme chegam
+
+        Ao fim da iteração, o atributo `modelo` do objeto retornado traz o
+        modelo que respondeu.
+        """
+        return Streaming(self._stream(api_key, model, prompt, config, fallback))
+
+    def _stream(self, api_key, model, prompt, config, fallback):
+        """Gerador dos trechos; retorna o modelo que respondeu"""
+        saida = queue.Queue()
+        future = self._schedule(self._stream_async(api_key, model, prompt, config, saida, fallback))
+        future.add_done_callback(lambda _: saida.put(_FIM_STREAM))
+
+        while True:
+            trecho = saida.get()
+            if trecho is _FIM_STREAM:
+                break
+            yield trecho
+
+        # Propagar erros da API para quem consome o streaming
+        return future.result()
+
+class Streaming:
+    """Trechos de uma geração em streaming; `modelo` é preenchido ao terminar"""
+
+    def __init__(self, trechos):
+        self._trechos = trechos
+        self.modelo = None
+
+    def __iter__(self):
+        self.modelo = yield from self._trechos
+
+def get_pool():
+    """Retorna o pool único do processo (mantido pelo registro de recursos)"""
+    import resources
+    return resources.get_pool()
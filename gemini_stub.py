@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Servidor local que imita a API Gemini, para testar a resiliência sem gastar cota
+
+Uso:
+    python gemini_stub.py --porta 8765 --falhas 2 --indisponivel gemini-2.5-flash
+    GEMINI_BASE_URL=http://localhost:8765 streamlit run app.py
+
+Responde a :generateContent e :streamGenerateContent (SSE) com um texto fixo.
+As N primeiras requisições (--falhas) recebem 503, os modelos listados em
+--indisponivel recebem sempre 503 e --atraso adiciona latência a cada resposta.
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TEXTO_PADRAO = (
+    "**Produto de Teste** ✨\n\n"
+    "Descrição gerada pelo servidor local de testes.\n\n"
+    "* Benefício 1\n* Benefício 2\n\n#teste #stub"
+)
+
+ROTA = re.compile(r'^/v1(?:beta)?/models/(?P<modelo>[^:/]+):(?P<metodo>generateContent|streamGenerateContent)')
+
+class StubState:
+    """Configuração e contadores compartilhados entre as requisições"""
+
+    def __init__(self, falhas=0, indisponiveis=(), atraso=0.0, status_falha=503, texto=TEXTO_PADRAO):
+        self.falhas_restantes = falhas
+        self.indisponiveis = set(indisponiveis)
+        self.atraso = atraso
+        self.status_falha = status_falha
+        self.texto = texto
+        self.requisicoes = []
+        self.lock = threading.Lock()
+
+    def decidir(self, modelo):
+        """Registra a requisição e retorna o código de erro a simular (ou None)"""
+        with self.lock:
+            self.requisicoes.append(modelo)
+            if modelo in self.indisponiveis:
+                return self.status_falha
+            if self.falhas_restantes > 0:
+                self.falhas_restantes -= 1
+                return self.status_falha
+        return None
+
+def _resposta(texto, modelo, prompt_tokens=50):
+    """Corpo no formato de GenerateContentResponse"""
+    saida_tokens = max(1, len(texto) // 4)
+    return {
+        'candidates': [{
+            'content': {'role': 'model', 'parts': [{'text': texto}]},
+            'finishReason': 'STOP',
+            'index': 0,
+        }],
+        'usageMetadata': {
+            'promptTokenCount': prompt_tokens,
+            'candidatesTokenCount': saida_tokens,
+            'totalTokenCount': prompt_tokens + saida_tokens,
+        },
+        'modelVersion': modelo,
+    }
+
+def make_handler(state):
+    """Cria a classe de handler ligada ao estado do servidor"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, formato, *args):
+            print(f"🧪 stub: {formato % args}")
+
+        def _json(self, status, corpo):
+            dados = json.dumps(corpo).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def do_POST(self):
+            tamanho = int(self.headers.get('Content-Length', 0))
+            corpo = json.loads(self.rfile.read(tamanho) or b'{}')
+
+            rota = ROTA.match(self.path)
+            if not rota:
+                self._json(404, {'error': {'code': 404, 'message': 'Rota não encontrada', 'status': 'NOT_FOUND'}})
+                return
+
+            modelo = rota.group('modelo')
+            prompt = json.dumps(corpo.get('contents', ''))
+            if state.atraso:
+                time.sleep(state.atraso)
+
+            erro = state.decidir(modelo)
+            if erro:
+                self._json(erro, {'error': {
+                    'code': erro,
+                    'message': f'{modelo} indisponível (simulado)',
+                    'status': 'UNAVAILABLE' if erro == 503 else 'RESOURCE_EXHAUSTED',
+                }})
+                return
+
+            if rota.group('metodo') == 'generateContent':
+                self._json(200, _resposta(state.texto, modelo, len(prompt) // 4))
+                return
+
+            # Streaming (alt=sse): um evento por palavra
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.end_headers()
+            palavras = state.texto.split(' ')
+            for i, palavra in enumerate(palavras):
+                trecho = palavra + (' ' if i < len(palavras) - 1 else '')
+                evento = json.dumps(_resposta(trecho, modelo, len(prompt) // 4))
+                self.wfile.write(f"data: {evento}\r\n\r\n".encode('utf-8'))
+                self.wfile.flush()
+
+    return Handler
+
+def start_stub(porta=0, **opcoes):
+    """Inicia o servidor em uma thread; retorna (servidor, estado, base_url)"""
+    state = StubState(**opcoes)
+    servidor = ThreadingHTTPServer(('127.0.0.1', porta), make_handler(state))
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, state, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+def main():
+    """Ponto de entrada da linha de comando"""
+    parser = argparse.ArgumentParser(description="Servidor local que imita a API Gemini")
+    parser.add_argument('--porta', type=int, default=8765)
+    parser.add_argument('--falhas', type=int, default=0, help="Quantas requisições iniciais falham")
+    parser.add_argument('--status', type=int, default=503, help="Código HTTP das falhas simuladas")
+    parser.add_argument('--indisponivel', action='append', default=[], help="Modelo que sempre falha")
+    parser.add_argument('--atraso', type=float, default=0.0, help="Segundos de latência por resposta")
+    args = parser.parse_args()
+
+    servidor, _, base_url = start_stub(
+        args.porta, falhas=args.falhas, indisponiveis=args.indisponivel,
+        atraso=args.atraso, status_falha=args.status
+    )
+    print(f"🧪 Stub Gemini ouvindo em {base_url}")
+    print(f"💡 Use: GEMINI_BASE_URL={base_url} streamlit run app.py")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+if __name__ == '__main__':
+    main()
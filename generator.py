@@ -0,0 +1,201 @@
+"""
+Núcleo de geração de descrições: montagem do prompt e chamada à API Gemini
+
+Usado pelo app, pela geração em lote, pela fila de gerações e pela API HTTP.
+"""
+
+import asyncio
+
+import templates as temp
+from gemini_pool import get_pool
+from renderer import markdown_to_html
+
+def formatar_descricao(texto, formato):
+    """Formata a descrição no formato selecionado"""
+    if formato == "Texto simples":
+        return texto
+    elif formato == "HTML":
+        return f"<div class='produto-descricao'>{markdown_to_html(texto)}</div>"
+    else:  # Markdown
+        return texto
+
+def calcular_palavras(tamanho):
+    """Calcula o limite de palavras baseado no tamanho selecionado"""
+    if tamanho == "Curta (50 palavras)":
+        return 50
+    elif tamanho == "Média (150 palavras)":
+        return 150
+    else:  # Longa
+        return 300
+
+def criar_prompt(nome_produto, categoria, tom, palavras_chave, tamanho, incluir_hashtags, template_selecionado, incluir_especificacoes):
+    """Cria o prompt para a IA baseado nas configurações
+    
+    Retorna um templates.Prompt: o prefixo estático do template (compilado
+    uma vez) vai como system_instruction e só os dados do produto mudam.
+    """
+    return temp.get_compiled_template(template_selecionado).render(
+        nome_produto, categoria, tom, palavras_chave, tamanho, calcular_palavras(tamanho),
+        incluir_hashtags, incluir_especificacoes
+    )
+
+def configuracao(prompt, temperatura):
+    """Configuração da chamada à API com o prefixo estático como instrução de sistema"""
+    return {'temperature': temperatura, 'system_instruction': prompt.system}
+
+# Linha que separa as variantes pedidas em uma única chamada
+SEPARADOR_VARIANTES = "=== VARIANTE ==="
+
+def criar_prompt_variantes(prompt, quantidade):
+    """Acrescenta ao prompt o pedido de várias versões separadas por marcador"""
+    return prompt.com_texto(
+        f"\n\n**VARIANTES:** Escreva {quantidade} versões DIFERENTES da descrição acima\n"
+        f"(títulos, ganchos e abordagens distintos, seguindo as mesmas diretrizes).\n"
+        f"Comece cada versão com uma linha contendo apenas: {SEPARADOR_VARIANTES}"
+    )
+
+def separar_variantes(texto, quantidade):
+    """Divide a resposta da IA nas variantes pedidas
+    
+    O texto antes do primeiro marcador ("Aqui estão as versões:") é
+    descartado. Se a IA devolver menos variantes que o pedido, avisa e
+    retorna as que vieram.
+    """
+    antes, *depois = [parte.strip() for parte in texto.split(SEPARADOR_VARIANTES)]
+    partes = [parte for parte in depois if parte]
+    if not partes:
+        # Marcador ausente (ou só no fim): a resposta inteira vira uma única variante
+        partes = [antes] if antes else [texto.replace(SEPARADOR_VARIANTES, '').strip()]
+    if len(partes) < quantidade:
+        print(f"⚠️ A IA devolveu {len(partes)} de {quantidade} variantes pedidas")
+    return partes[:quantidade]
+
+def consultar_cache(db, prompt, modelo, temperatura, forcar_nova_versao=False):
+    """Chave do cache do prompt e a resposta guardada, se houver
+    
+    Retorna (cache_key, (texto, modelo que respondeu) ou None). Com
+    `forcar_nova_versao` o cache não é lido (a nova resposta o substitui).
+    """
+    cache_key = db.make_cache_key(prompt.completo(), modelo, temperatura)
+    if forcar_nova_versao:
+        return cache_key, None
+    cached = db.get_cached_generation(cache_key, with_model=True)
+    if cached is None:
+        return cache_key, None
+    descricao, modelo_usado = cached
+    return cache_key, (descricao, modelo_usado or modelo)
+
+def gerar_descricao(db, api_key, modelo, prompt, temperatura, forcar_nova_versao=False,
+                    ao_receber=None):
+    """Gera a descrição reutilizando o cache quando possível
+    
+    Se `ao_receber` for informado, a resposta é pedida em streaming e a função
+    é chamada com o texto parcial acumulado a cada trecho recebido.
+    Retorna uma tupla (texto, veio_do_cache, modelo que respondeu).
+    """
+    # Consultar o cache antes de chamar a API
+    cache_key, cached = consultar_cache(db, prompt, modelo, temperatura, forcar_nova_versao)
+    if cached is not None:
+        return cached[0], True, cached[1]
+    
+    # Chamar a API pelo pool compartilhado (respeita os limites da chave)
+    config = configuracao(prompt, temperatura)
+    if ao_receber is None:
+        descricao, modelo_usado = get_pool().generate(api_key, modelo, prompt.texto, config)
+    else:
+        trechos = []
+        streaming = get_pool().stream(api_key, modelo, prompt.texto, config)
+        for trecho in streaming:
+            trechos.append(trecho)
+            ao_receber(''.join(trechos))
+        descricao, modelo_usado = ''.join(trechos), streaming.modelo
+    
+    db.save_cached_generation(cache_key, modelo_usado, temperatura, descricao)
+    return descricao, False, modelo_usado
+
+# ========== PEDIDOS COMPLETOS (FILA E API) ==========
+
+# Parâmetros de um pedido de geração além dos dados do produto
+PEDIDO_PADRAO = {
+    'modelo': 'gemini-2.5-flash',
+    'temperatura': 0.7,
+    'formato': 'Texto simples',
+    'variantes': 1,
+    'forcar_nova_versao': False,
+}
+
+def prompt_do_pedido(pedido):
+    """Prompt de um pedido completo (com o pedido de variantes, se houver)"""
+    prompt = criar_prompt(
+        pedido['nome_produto'], pedido['categoria'], pedido['tom'], pedido['palavras_chave'],
+        pedido['tamanho'], pedido['incluir_hashtags'], pedido['template'], pedido['incluir_especificacoes']
+    )
+    if pedido['variantes'] > 1:
+        prompt = criar_prompt_variantes(prompt, pedido['variantes'])
+    return prompt
+
+def salvar_geracao(db, user_id, pedido, textos, modelo=None):
+    """Salva as descrições geradas para o pedido; retorna (group_id, ids)
+    
+    group_id só existe quando o pedido foi de variantes. `modelo` é o que
+    respondeu (depois de um fallback, diferente do pedido).
+    """
+    registro = dict(
+        user_id=user_id, product_name=pedido['nome_produto'], category=pedido['categoria'],
+        tone=pedido['tom'], keywords=pedido['palavras_chave'], size=pedido['tamanho'],
+        template=pedido['template'], formato=pedido['formato'], model=modelo or pedido['modelo']
+    )
+    if pedido['variantes'] > 1:
+        group_id, ids = db.save_description_group(descriptions=textos, **registro)
+        if not ids:
+            raise RuntimeError("Não foi possível salvar as variantes")
+        return group_id, ids
+    
+    desc_id = db.save_description(description=textos[0], **registro)
+    if desc_id is None:
+        raise RuntimeError("Não foi possível salvar a descrição")
+    return None, [desc_id]
+
+def gerar_e_salvar(db, user_id, pedido, api_key, ao_receber=None):
+    """Gera e salva as descrições de um pedido completo
+    
+    `ao_receber` recebe o texto parcial em streaming (só em pedidos de uma
+    descrição; variantes vêm em uma resposta única).
+    Retorna {'ids', 'group_id', 'cache', 'modelo', 'textos'}.
+    """
+    texto, veio_do_cache, modelo = gerar_descricao(
+        db, api_key, pedido['modelo'], prompt_do_pedido(pedido), pedido['temperatura'],
+        pedido['forcar_nova_versao'], ao_receber if pedido['variantes'] == 1 else None
+    )
+    textos = separar_variantes(texto, pedido['variantes']) if pedido['variantes'] > 1 else [texto]
+    group_id, ids = salvar_geracao(db, user_id, pedido, textos, modelo)
+    return {'ids': ids, 'group_id': group_id, 'cache': veio_do_cache, 'modelo': modelo, 'textos': textos}
+
+async def gerar_e_salvar_async(db, user_id, pedido, api_key, executor=None):
+    """Versão de gerar_e_salvar para servidores assíncronos
+    
+    A resposta da API é aguardada direto no pool de clientes (nenhuma thread
+    fica parada esperando a IA); cache e banco rodam no `executor`.
+    """
+    loop = asyncio.get_running_loop()
+    prompt = prompt_do_pedido(pedido)
+    modelo, temperatura = pedido['modelo'], pedido['temperatura']
+    
+    cache_key, cached = await loop.run_in_executor(executor, consultar_cache, db, prompt, modelo,
+                                                   temperatura, pedido['forcar_nova_versao'])
+    veio_do_cache = cached is not None
+    if veio_do_cache:
+        texto, modelo_usado = cached
+    else:
+        modelo_usado, resposta = await asyncio.wrap_future(
+            get_pool().submit(api_key, modelo, prompt.texto, configuracao(prompt, temperatura))
+        )
+        texto = resposta.text
+        await loop.run_in_executor(executor, db.save_cached_generation, cache_key, modelo_usado,
+                                   temperatura, texto)
+    
+    textos = separar_variantes(texto, pedido['variantes']) if pedido['variantes'] > 1 else [texto]
+    group_id, ids = await loop.run_in_executor(executor, salvar_geracao, db, user_id, pedido, textos,
+                                               modelo_usado)
+    return {'ids': ids, 'group_id': group_id, 'cache': veio_do_cache, 'modelo': modelo_usado,
+            'textos': textos}
@@ -1,52 +1,130 @@
 #!/usr/bin/env python3
 """
-Script para inicializar e testar o banco de dados
+Script para inicializar, migrar e verificar o banco de dados
+
+Uso:
+    python3 init_database.py            # aplica migrações e mostra as tabelas
+    python3 init_database.py status     # versão atual e migrações pendentes
+    python3 init_database.py migrate    # aplica as migrações pendentes
+    python3 init_database.py migrate --to 3
+    python3 init_database.py verify     # confere esquema, índices e integridade
 """
 
+import argparse
 import sys
 import os
+import sqlite3
 
 # Adicionar o diretório atual ao path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-print("=" * 50)
-print("INICIALIZAÇÃO DO BANCO DE DADOS")
-print("=" * 50)
+import migrations
+
+def conectar(db_name):
+    """Abre o banco sem aplicar migrações automaticamente"""
+    os.makedirs(os.path.dirname(db_name), exist_ok=True)
+    conn = sqlite3.connect(db_name)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA busy_timeout = 5000')
+    return conn
+
+def cmd_status(conn, args):
+    """Mostra a versão do esquema e as migrações pendentes"""
+    versao = migrations.current_version(conn)
+    print(f"📌 Versão do esquema: {versao} (mais recente: {migrations.latest_version()})")
+
+    for version, description, applied_at, duration in conn.execute(
+        'SELECT version, description, applied_at, duration_ms FROM schema_version ORDER BY version'
+    ):
+        print(f"   ✅ {version}: {description} ({applied_at}, {duration} ms)")
+
+    for version, description, _ in migrations.pending_migrations(conn):
+        print(f"   ⏳ {version}: {description}")
+    return 0
+
+def cmd_migrate(conn, args):
+    """Aplica as migrações pendentes"""
+    aplicadas = migrations.migrate(conn, target=args.to)
+    if aplicadas:
+        print(f"\n🎉 {len(aplicadas)} migração(ões) aplicada(s)")
+    else:
+        print("✅ Nenhuma migração pendente")
+    return 0
+
+def cmd_verify(conn, args):
+    """Confere se o banco está na versão mais recente e íntegro"""
+    problemas = migrations.verify(conn)
+    if problemas:
+        print("❌ Problemas encontrados:")
+        for problema in problemas:
+            print(f"   • {problema}")
+        return 1
+    print(f"✅ Esquema na versão {migrations.current_version(conn)}, índices e integridade OK")
+    return 0
+
+def cmd_init(conn, args):
+    """Comportamento padrão: migra, lista as tabelas e cria um usuário de teste"""
+    migrations.migrate(conn)
 
-try:
-    from database import Database
-    
-    # Criar instância do banco
-    db = Database('data/descricoes.db')
-    
     # Verificar tabelas criadas
-    db.cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-    tables = db.cursor.fetchall()
-    
+    tables = conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+
     print(f"\n✅ Banco inicializado com sucesso!")
-    print(f"📍 Local: {os.path.abspath('data/descricoes.db')}")
+    print(f"📍 Local: {os.path.abspath(args.db)}")
     print(f"📋 Tabelas encontradas ({len(tables)}):")
-    
+
     for table in tables:
-        db.cursor.execute(f"SELECT COUNT(*) FROM {table[0]}")
-        count = db.cursor.fetchone()[0]
+        count = conn.execute(f"SELECT COUNT(*) FROM {table[0]}").fetchone()[0]
         print(f"   • {table[0]}: {count} registros")
-    
+
     # Testar inserção de usuário de exemplo
     import hashlib
     test_hash = hashlib.sha256("senha_teste".encode()).hexdigest()
-    user_id = db.add_user("teste@exemplo.com", test_hash)
-    
-    if user_id:
-        print(f"\n👤 Usuário teste criado (ID: {user_id})")
-    
-    db.close()
+    try:
+        cursor = conn.execute(
+            'INSERT INTO users (email, password_hash, plan) VALUES (?, ?, ?)',
+            ("teste@exemplo.com", test_hash, 'free')
+        )
+        conn.commit()
+        print(f"\n👤 Usuário teste criado (ID: {cursor.lastrowid})")
+    except sqlite3.IntegrityError:
+        pass  # Usuário de teste já existe
+
     print("\n🎉 Todos os testes passaram! O banco está pronto.")
     print("\n💡 Agora execute: streamlit run app.py")
-    
-except Exception as e:
-    print(f"\n❌ ERRO: {e}")
-    print("\n🔧 Soluções:")
-    print("1. Verifique permissões na pasta: chmod 755 data")
-    print("2. Execute com: python3 init_database.py")
-    print("3. Verifique se o SQLite está instalado")
\ No newline at end of file
+    return 0
+
+def main(argv=None):
+    """Ponto de entrada da linha de comando"""
+    parser = argparse.ArgumentParser(description="Inicialização e migrações do banco de dados")
+    parser.add_argument('--db', default='data/descricoes.db', help="Caminho do arquivo SQLite")
+    sub = parser.add_subparsers(dest='comando')
+    sub.add_parser('status', help="Mostra a versão do esquema")
+    migrate = sub.add_parser('migrate', help="Aplica as migrações pendentes")
+    migrate.add_argument('--to', type=int, help="Parar nesta versão")
+    sub.add_parser('verify', help="Confere esquema, índices e integridade")
+    args = parser.parse_args(argv)
+
+    comandos = {'status': cmd_status, 'migrate': cmd_migrate, 'verify': cmd_verify}
+
+    print("=" * 50)
+    print("INICIALIZAÇÃO DO BANCO DE DADOS")
+    print("=" * 50)
+
+    try:
+        conn = conectar(args.db)
+        try:
+            return comandos.get(args.comando, cmd_init)(conn, args)
+        finally:
+            conn.close()
+
+    except Exception as e:
+        print(f"\n❌ ERRO: {e}")
+        print("\n🔧 Soluções:")
+        print("1. Verifique permissões na pasta: chmod 755 data")
+        print("2. Execute com: python3 init_database.py")
+        print("3. Verifique se o SQLite está instalado")
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Fila de gerações em segundo plano
+
+O botão de gerar só coloca o pedido na tabela generation_jobs e volta na
+hora; um pool de workers pega os trabalhos em ordem de chegada, chama a IA
+e salva as descrições. A página acompanha o trabalho pelo ID, então reruns,
+abas fechadas e páginas recarregadas não cancelam nem perdem a geração.
+
+Os workers rodam dentro do processo do app (GENERATION_WORKERS threads) e
+também podem rodar em processos separados, apontando para o mesmo banco:
+    GENERATION_SERVER_KEY_FALLBACK=1 python jobs.py --workers 8
+
+A chave da API digitada na sessão fica só na memória do pool que recebeu o
+pedido (nunca no banco), então o trabalho é gravado com esse pool como dono
+e só ele o pega: outros processos nunca pegam trabalhos que não conseguem
+executar. Trabalhos sem dono (pedidos sem chave, pools sem workers, ou
+trabalhos cujo dono morreu) só são pegos por pools com
+GENERATION_SERVER_KEY_FALLBACK=1, que usam a GEMINI_API_KEY do servidor
+(cobrada do operador). Por isso workers em processos separados
+(python jobs.py) precisam dessa opção.
+
+O dono renova o heartbeat dos seus trabalhos (na fila e em andamento); um
+trabalho sem heartbeat há GENERATION_JOB_TIMEOUT segundos é de um dono que
+morreu: se estava em andamento volta para a fila sem dono, se estava na
+fila falha pedindo uma nova geração. A reserva de cota do trabalho não vence
+enquanto ele estiver na fila ou em andamento.
+"""
+
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from generator import gerar_e_salvar
+
+class JobWorkerPool:
+    """Workers que consomem a fila de gerações do banco"""
+
+    def __init__(self, db, workers=None, poll_interval=0.5, stale_after=None, max_attempts=2,
+                 handler=None, server_key_fallback=None):
+        self.db = db
+        self.workers = workers if workers is not None else int(os.getenv("GENERATION_WORKERS", 4))
+        self.poll_interval = poll_interval
+        # Trabalho sem heartbeat há mais tempo que isso é de um dono que morreu
+        self.stale_after = stale_after if stale_after is not None else \
+            float(os.getenv("GENERATION_JOB_TIMEOUT", 300))
+        self.heartbeat_interval = self.stale_after / 3
+        self.max_attempts = max_attempts
+        self.handler = handler or executar_geracao
+        # Usar a chave do servidor (cobrada do operador) só quando configurado
+        if server_key_fallback is None:
+            server_key_fallback = os.getenv("GENERATION_SERVER_KEY_FALLBACK", "0") == "1"
+        self.server_key_fallback = server_key_fallback
+        # Dono dos trabalhos cujas chaves este pool guarda (único por pool e processo)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._api_keys = {}
+        self._lock = threading.Lock()
+        self._novo_trabalho = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        self._requeued_at = float('-inf')
+
+    def start(self):
+        """Inicia os workers, devolvendo à fila o que ficou preso de execuções anteriores"""
+        self._requeue_stale()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"generation-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="generation-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def submit(self, user_id, params, api_key=None, reservation_id=None):
+        """Coloca a geração na fila e retorna o ID do trabalho, sem esperar
+
+        Com a chave da API e workers neste pool, o trabalho é deste pool;
+        sem isso, fica sem dono (para pools que usam a chave do servidor).
+        """
+        proprio = bool(api_key) and self.workers > 0
+        with self._lock:
+            job_id = self.db.enqueue_job(user_id, params, reservation_id, self.owner if proprio else None)
+            if proprio:
+                self._api_keys[job_id] = api_key
+        with self._novo_trabalho:
+            self._novo_trabalho.notify()
+        return job_id
+
+    def status(self, job_id, user_id=None):
+        """Estado atual do trabalho (consulta rápida, para a página acompanhar)"""
+        return self.db.get_job(job_id, user_id)
+
+    def _requeue_stale(self):
+        """Devolve à fila os trabalhos presos (no máximo uma vez a cada stale_after/2)"""
+        with self._lock:
+            agora = time.monotonic()
+            if agora - self._requeued_at < self.stale_after / 2:
+                return
+            self._requeued_at = agora
+        devolvidos, falhos = self.db.requeue_stale_jobs(self.stale_after, self.max_attempts)
+        if devolvidos or falhos:
+            print(f"♻️ Fila de gerações: {devolvidos} trabalho(s) devolvido(s), {falhos} falho(s)")
+
+    def _heartbeat(self):
+        """Renova o heartbeat dos trabalhos deste pool (na fila e em andamento)"""
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self.db.heartbeat_jobs(self.owner)
+            except Exception as e:
+                print(f"❌ Erro ao renovar o heartbeat da fila de gerações: {e}")
+
+    def _runs_unowned(self):
+        """Este pool pode executar trabalhos sem dono (tem a chave do servidor e a opção ligada)"""
+        return self.server_key_fallback and bool(os.getenv("GEMINI_API_KEY"))
+
+    def _run(self):
+        """Laço de um worker: pega o próximo trabalho ou espera um novo chegar"""
+        while not self._stop.is_set():
+            try:
+                self._requeue_stale()
+                job = self.db.claim_job(self.owner, unowned=self._runs_unowned())
+            except Exception as e:
+                print(f"❌ Erro ao ler a fila de gerações: {e}")
+                job = None
+            if job is None:
+                # Acordado por submit(); o intervalo cobre trabalhos de outros processos
+                with self._novo_trabalho:
+                    self._novo_trabalho.wait(self.poll_interval)
+                continue
+            self._process(job)
+
+    def _process(self, job):
+        """Executa um trabalho e grava o resultado; a reserva de cota é sempre liberada"""
+        job_id = job['id']
+        with self._lock:
+            api_key = self._api_keys.pop(job_id, None)
+        if not api_key and self.server_key_fallback:
+            api_key = os.getenv("GEMINI_API_KEY")
+        try:
+            if not api_key:
+                self.db.fail_job(job_id, "Chave da API indisponível (o servidor reiniciou). Gere novamente.")
+                return
+            self.db.finish_job(job_id, self.handler(self.db, job, api_key))
+        except Exception as e:
+            print(f"❌ Erro no trabalho de geração {job_id}: {e}")
+            self.db.fail_job(job_id, str(e))
+        finally:
+            if job['reservation_id'] is not None:
+                self.db.release_quota(job['reservation_id'])
+
+    def healthy(self):
+        """Os workers continuam rodando"""
+        return not self._stop.is_set() and all(thread.is_alive() for thread in self._threads)
+
+    def close(self, timeout=5):
+        """Para os workers (o trabalho em andamento termina; o resto fica na fila)"""
+        self._stop.set()
+        with self._novo_trabalho:
+            self._novo_trabalho.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+# Intervalo mínimo entre gravações do texto parcial (a página consulta a cada segundo)
+PARTIAL_INTERVAL = 0.5
+
+def executar_geracao(db, job, api_key):
+    """Gera e salva as descrições de um trabalho; retorna {'ids', 'group_id', 'cache', 'modelo'}
+
+    O texto que chega em streaming vai para a coluna partial do trabalho (no
+    máximo a cada PARTIAL_INTERVAL segundos), de onde a página o mostra.
+    """
+    gravado_em = float('-inf')
+
+    def ao_receber(texto_parcial):
+        nonlocal gravado_em
+        agora = time.monotonic()
+        if agora - gravado_em >= PARTIAL_INTERVAL:
+            gravado_em = agora
+            db.update_job_partial(job['id'], texto_parcial)
+
+    resultado = gerar_e_salvar(db, job['user_id'], job['params'], api_key, ao_receber)
+    # Os textos já estão em descriptions; o trabalho guarda só os IDs
+    del resultado['textos']
+    return resultado
+
+def main(argv=None):
+    """Roda workers da fila em um processo separado do app"""
+    from dotenv import load_dotenv
+    from database import Database
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Processa a fila de gerações em segundo plano")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--db', default='data/descricoes.db')
+    args = parser.parse_args(argv)
+
+    # Este processo não recebe pedidos: só executa trabalhos sem dono, com a chave do servidor
+    if os.getenv("GENERATION_SERVER_KEY_FALLBACK", "0") != "1" or not os.getenv("GEMINI_API_KEY"):
+        print("❌ Workers separados usam a chave do servidor: defina GENERATION_SERVER_KEY_FALLBACK=1 "
+              "e GEMINI_API_KEY")
+        return 1
+
+    db = Database(args.db)
+    pool = JobWorkerPool(db, workers=args.workers, server_key_fallback=True).start()
+    print(f"👷 {args.workers} worker(s) processando a fila de gerações (Ctrl+C para parar)")
+
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+    try:
+        while not parar.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    pool.close()
+    db.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
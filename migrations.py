@@ -0,0 +1,662 @@
+"""
+Migrações versionadas do banco de dados
+
+Cada migração tem um número de versão e roda uma única vez; a versão
+aplicada fica registrada na tabela `schema_version`. Para não travar um
+banco grande em produção:
+
+- cada migração roda em sua própria transação curta;
+- índices são criados por `create_index_online`, uma transação por índice
+  (no modo WAL os leitores continuam atendidos durante a criação);
+- preenchimentos de dados usam `backfill_in_batches`, que confirma a cada
+  lote e cede a vez a outros escritores entre os lotes. Como os lotes são
+  idempotentes, uma migração interrompida pode simplesmente ser executada
+  de novo.
+
+Vários processos podem abrir o mesmo banco ao mesmo tempo (workers do
+Streamlit/uvicorn, python jobs.py). Só um deles aplica as migrações: quem
+toma a trava em `schema_lock` (dentro de BEGIN IMMEDIATE, relendo o que
+ainda está pendente); os outros esperam a trava ser solta. A trava tem
+prazo (MIGRATION_LOCK_LEASE segundos), renovado a cada migração e a cada
+lote, para que um processo que morreu no meio não prenda os demais.
+
+Para criar uma nova migração, adicione uma função no fim deste arquivo com
+o decorador `@migration(<próxima versão>, "descrição")`.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+MIGRATIONS = []
+
+def migration(version, description):
+    """Registra uma função como migração da versão indicada"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+# ========== ESTADO DAS MIGRAÇÕES ==========
+
+def ensure_version_table(conn):
+    """Cria a tabela de controle de versões"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            duration_ms INTEGER
+        )
+    ''')
+    # Uma linha só: quem está aplicando migrações e até quando vale a trava
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_lock (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    conn.commit()
+
+def current_version(conn):
+    """Última versão aplicada (0 para banco novo)"""
+    ensure_version_table(conn)
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+def latest_version():
+    """Versão mais recente conhecida pelo código"""
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+def pending_migrations(conn):
+    """Migrações ainda não aplicadas, em ordem"""
+    aplicadas = {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+    return [m for m in MIGRATIONS if m[0] not in aplicadas]
+
+# Trava de migração da thread atual (renovada pelos lotes das migrações)
+_trava = threading.local()
+
+LOCK_LEASE = float(os.getenv("MIGRATION_LOCK_LEASE", 120))
+
+def _take_lock(conn, owner, target):
+    """Relê as pendentes em BEGIN IMMEDIATE e, se houver alguma, toma a trava
+
+    Retorna as migrações pendentes (lista vazia: nada a fazer) ou None se
+    outro processo tem a trava.
+    """
+    conn.commit()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+    except sqlite3.OperationalError as e:
+        # Outro processo segurando a escrita além do busy_timeout (ex.: criando um índice)
+        if 'locked' in str(e):
+            return None
+        raise
+    try:
+        pendentes = [m for m in pending_migrations(conn) if target is None or m[0] <= target]
+        if pendentes:
+            agora = time.time()
+            row = conn.execute('SELECT owner, expires_at FROM schema_lock WHERE id = 1').fetchone()
+            if row and row[0] != owner and row[1] > agora:
+                pendentes = None
+            else:
+                conn.execute(
+                    'INSERT OR REPLACE INTO schema_lock (id, owner, expires_at) VALUES (1, ?, ?)',
+                    (owner, agora + LOCK_LEASE)
+                )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return pendentes
+
+def renew_lock(conn):
+    """Estende o prazo da trava durante uma migração longa (entra na transação do lote)"""
+    owner = getattr(_trava, 'owner', None)
+    if owner:
+        conn.execute(
+            'UPDATE schema_lock SET expires_at = ? WHERE id = 1 AND owner = ?',
+            (time.time() + LOCK_LEASE, owner)
+        )
+
+def migrate(conn, target=None, log=print, wait=0.2):
+    """Aplica as migrações pendentes (até `target`, se informado)
+
+    Seguro com vários processos no mesmo banco: cada migração é aplicada por
+    quem tem a trava; os demais esperam e terminam quando nada mais estiver
+    pendente. Retorna as versões aplicadas por esta chamada.
+    """
+    ensure_version_table(conn)
+    dono = uuid.uuid4().hex
+    aplicadas = []
+    avisado = False
+    com_trava = False
+    try:
+        while True:
+            pendentes = _take_lock(conn, dono, target)
+            if pendentes is None:
+                # Outro processo está migrando
+                if not avisado:
+                    log("⏳ Aguardando migrações de outro processo...")
+                    avisado = True
+                time.sleep(wait)
+                continue
+            if not pendentes:
+                break
+            com_trava = True
+
+            version, description, func = pendentes[0]
+            log(f"⏳ Migração {version}: {description}")
+            inicio = time.perf_counter()
+            _trava.owner = dono
+            try:
+                func(conn)
+                duracao = int((time.perf_counter() - inicio) * 1000)
+                # OR IGNORE: se a versão já foi registrada (trava vencida e
+                # retomada por outro processo), a migração idempotente já valeu
+                conn.execute(
+                    'INSERT OR IGNORE INTO schema_version (version, description, duration_ms) VALUES (?, ?, ?)',
+                    (version, description, duracao)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                _trava.owner = None
+
+            log(f"✅ Migração {version} aplicada em {duracao} ms")
+            aplicadas.append(version)
+    finally:
+        if com_trava:
+            conn.execute('DELETE FROM schema_lock WHERE owner = ?', (dono,))
+            conn.commit()
+    return aplicadas
+
+def verify(conn):
+    """Confere versão, objetos esperados e integridade; retorna lista de problemas"""
+    problemas = []
+
+    pendentes = pending_migrations(conn) if table_exists(conn, 'schema_version') else MIGRATIONS
+    for version, description, _ in pendentes:
+        problemas.append(f"Migração {version} pendente: {description}")
+
+    for tipo, nome in EXPECTED_OBJECTS:
+        row = conn.execute(
+            'SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?', (tipo, nome)
+        ).fetchone()
+        if not row:
+            problemas.append(f"{tipo} ausente: {nome}")
+
+    resultado = conn.execute('PRAGMA quick_check').fetchone()[0]
+    if resultado != 'ok':
+        problemas.append(f"quick_check: {resultado}")
+
+    return problemas
+
+# ========== FERRAMENTAS PARA MIGRAÇÕES ==========
+
+def table_exists(conn, table):
+    """Indica se a tabela existe"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    return row is not None
+
+def add_column_if_missing(conn, table, column, definition):
+    """Adiciona uma coluna a uma tabela existente, se ainda não existir"""
+    colunas = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in colunas:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def create_index_online(conn, name, table, columns, unique=False):
+    """Cria um índice em transação própria, sem prender outras migrações junto"""
+    renew_lock(conn)
+    conn.commit()
+    conn.execute(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+    )
+    conn.commit()
+
+def backfill_in_batches(conn, table, set_clause, where, params=(), set_params=(),
+                        batch_size=2000, pause=0.005):
+    """Atualiza linhas em lotes por faixa de rowid, confirmando a cada lote
+
+    `where` deve deixar de selecionar a linha depois de atualizada (ex.:
+    "coluna IS NULL"), para que a operação possa ser retomada se cair.
+    Retorna o número de linhas atualizadas.
+    """
+    conn.commit()
+    total = 0
+    ultimo = 0
+    while True:
+        ids = [row[0] for row in conn.execute(
+            f'SELECT rowid FROM {table} WHERE rowid > ? AND ({where}) ORDER BY rowid LIMIT ?',
+            (ultimo, *params, batch_size)
+        )]
+        if not ids:
+            break
+        conn.execute(
+            f'UPDATE {table} SET {set_clause} WHERE rowid BETWEEN ? AND ? AND ({where})',
+            (*set_params, ids[0], ids[-1], *params)
+        )
+        renew_lock(conn)
+        conn.commit()
+        total += len(ids)
+        ultimo = ids[-1]
+        # Dar espaço para os escritores da aplicação entre um lote e outro
+        time.sleep(pause)
+    return total
+
+# Objetos que devem existir após todas as migrações (conferidos por verify)
+EXPECTED_OBJECTS = [
+    ('table', 'users'),
+    ('table', 'descriptions'),
+    ('table', 'analytics'),
+    ('table', 'generation_cache'),
+    ('table', 'usage_counters'),
+    ('table', 'analytics_daily'),
+    ('table', 'descriptions_fts'),
+    ('trigger', 'descriptions_fts_insert'),
+    ('trigger', 'descriptions_fts_delete'),
+    ('trigger', 'descriptions_fts_update'),
+    ('index', 'idx_descriptions_user_created_id'),
+    ('index', 'idx_analytics_user'),
+    ('index', 'idx_generation_cache_last_access'),
+    ('table', 'payments'),
+    ('index', 'idx_payments_user_created'),
+    ('index', 'idx_payments_open'),
+    ('table', 'quota_reservations'),
+    ('index', 'idx_quota_reservations_user_expires'),
+    ('table', 'generation_jobs'),
+    ('index', 'idx_generation_jobs_owner'),
+    ('index', 'idx_generation_jobs_heartbeat'),
+    ('index', 'idx_generation_jobs_user'),
+    ('index', 'idx_generation_jobs_reservation'),
+    ('table', 'api_keys'),
+    ('index', 'idx_api_keys_user'),
+    ('table', 'batch_lines'),
+]
+
+# ========== MIGRAÇÕES ==========
+# As primeiras versões usam IF NOT EXISTS / verificação de colunas para
+# também adotar bancos criados antes do controle de versões.
+
+@migration(1, "Tabelas iniciais: usuários, descrições e analytics")
+def _create_initial_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            plan TEXT DEFAULT 'free',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS descriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            category TEXT NOT NULL,
+            tone TEXT NOT NULL,
+            keywords TEXT,
+            size TEXT,
+            template TEXT,
+            description TEXT NOT NULL,
+            formato TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analytics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            total_descriptions INTEGER DEFAULT 0,
+            most_used_category TEXT,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+@migration(2, "Cache de respostas da IA")
+def _create_generation_cache(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS generation_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            temperature REAL NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL,
+            hits INTEGER DEFAULT 0
+        )
+    ''')
+    create_index_online(conn, 'idx_generation_cache_last_access', 'generation_cache', 'last_access')
+
+@migration(3, "Variantes: colunas group_id e selected em descriptions")
+def _add_variant_columns(conn):
+    add_column_if_missing(conn, 'descriptions', 'group_id', 'TEXT')
+    add_column_if_missing(conn, 'descriptions', 'selected', 'INTEGER DEFAULT 0')
+
+@migration(4, "Índices de histórico e analytics por usuário")
+def _add_user_indexes(conn):
+    create_index_online(conn, 'idx_descriptions_user_created', 'descriptions', 'user_id, created_at DESC')
+    # Um registro de analytics por usuário: remover duplicatas antes do índice único
+    conn.execute('''
+        DELETE FROM analytics
+        WHERE id NOT IN (SELECT MIN(id) FROM analytics GROUP BY user_id)
+    ''')
+    create_index_online(conn, 'idx_analytics_user', 'analytics', 'user_id', unique=True)
+
+@migration(5, "Contadores de uso por usuário (mensal e total)")
+def _create_usage_counters(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS usage_counters (
+            user_id INTEGER PRIMARY KEY,
+            lifetime_count INTEGER NOT NULL DEFAULT 0,
+            month TEXT NOT NULL,
+            month_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    conn.commit()
+    
+    # Preencher a partir das descrições existentes, alguns usuários por vez
+    ultimo = 0
+    while True:
+        ids = [row[0] for row in conn.execute(
+            'SELECT id FROM users WHERE id > ? ORDER BY id LIMIT 500', (ultimo,)
+        )]
+        if not ids:
+            break
+        # A tabela já foi gravada (commit acima) e a aplicação passa a contar
+        # nela: a linha pode existir com só as gerações novas. A contagem
+        # completa, na mesma transação, já inclui essas gerações, então fica
+        # a maior das duas (como em reconcile_usage_counters)
+        conn.execute('''
+            INSERT INTO usage_counters (user_id, lifetime_count, month, month_count)
+            SELECT u.id,
+                   (SELECT COUNT(*) FROM descriptions d WHERE d.user_id = u.id),
+                   strftime('%Y-%m', 'now'),
+                   (SELECT COUNT(*) FROM descriptions d
+                    WHERE d.user_id = u.id AND d.created_at >= strftime('%Y-%m-01', 'now'))
+            FROM users u
+            WHERE u.id BETWEEN ? AND ?
+            ON CONFLICT(user_id) DO UPDATE SET
+                lifetime_count = MAX(usage_counters.lifetime_count, excluded.lifetime_count),
+                month_count = CASE WHEN usage_counters.month = excluded.month
+                                   THEN MAX(usage_counters.month_count, excluded.month_count)
+                                   ELSE excluded.month_count END,
+                month = excluded.month
+        ''', (ids[0], ids[-1]))
+        renew_lock(conn)
+        conn.commit()
+        ultimo = ids[-1]
+        time.sleep(0.005)
+
+@migration(6, "Agregados diários de analytics e coluna model em descriptions")
+def _create_analytics_daily(conn):
+    add_column_if_missing(conn, 'descriptions', 'model', 'TEXT')
+    # Uma linha por usuário/dia/combinação; colunas vazias em vez de NULL
+    # para que o UPSERT encontre a linha existente
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_daily (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            category TEXT NOT NULL DEFAULT '',
+            template TEXT NOT NULL DEFAULT '',
+            tone TEXT NOT NULL DEFAULT '',
+            model TEXT NOT NULL DEFAULT '',
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, category, template, tone, model)
+        ) WITHOUT ROWID
+    ''')
+    conn.commit()
+    
+    # Preencher a partir das descrições existentes, alguns usuários por vez
+    ultimo = 0
+    while True:
+        ids = [row[0] for row in conn.execute(
+            'SELECT id FROM users WHERE id > ? ORDER BY id LIMIT 200', (ultimo,)
+        )]
+        if not ids:
+            break
+        # A aplicação já grava em analytics_daily enquanto a migração roda: a
+        # linha pode existir com só as gravações novas. A contagem completa,
+        # feita na mesma transação, já inclui essas gravações, então fica a
+        # maior das duas (e rodar de novo não soma em dobro)
+        conn.execute('''
+            INSERT INTO analytics_daily (user_id, day, category, template, tone, model, count)
+            SELECT user_id, date(created_at), COALESCE(category, ''), COALESCE(template, ''),
+                   COALESCE(tone, ''), COALESCE(model, ''), COUNT(*)
+            FROM descriptions
+            WHERE user_id BETWEEN ? AND ?
+            GROUP BY 1, 2, 3, 4, 5, 6
+            ON CONFLICT(user_id, day, category, template, tone, model) 
+            DO UPDATE SET count = MAX(analytics_daily.count, excluded.count)
+        ''', (ids[0], ids[-1]))
+        renew_lock(conn)
+        conn.commit()
+        ultimo = ids[-1]
+        time.sleep(0.005)
+
+@migration(7, "Índice (user_id, created_at, id) para paginação do histórico")
+def _add_history_keyset_index(conn):
+    # Substitui idx_descriptions_user_created: com o id no índice a ordenação
+    # (created_at DESC, id DESC) sai pronta, sem ordenar em memória
+    create_index_online(conn, 'idx_descriptions_user_created_id', 'descriptions', 'user_id, created_at, id')
+    conn.execute('DROP INDEX IF EXISTS idx_descriptions_user_created')
+
+@migration(8, "Busca textual (FTS5) em nome, palavras-chave e texto das descrições")
+def _create_descriptions_fts(conn):
+    # Índice externo: o texto continua só em descriptions, o FTS guarda os termos.
+    # user_id também é indexado para a busca percorrer só as linhas do usuário.
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS descriptions_fts USING fts5(
+            user_id, product_name, keywords, description,
+            content='descriptions', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS descriptions_fts_insert AFTER INSERT ON descriptions BEGIN
+            INSERT INTO descriptions_fts (rowid, user_id, product_name, keywords, description)
+            VALUES (new.id, new.user_id, new.product_name, new.keywords, new.description);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS descriptions_fts_delete AFTER DELETE ON descriptions BEGIN
+            INSERT INTO descriptions_fts (descriptions_fts, rowid, user_id, product_name, keywords, description)
+            VALUES ('delete', old.id, old.user_id, old.product_name, old.keywords, old.description);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS descriptions_fts_update 
+        AFTER UPDATE OF user_id, product_name, keywords, description ON descriptions BEGIN
+            INSERT INTO descriptions_fts (descriptions_fts, rowid, user_id, product_name, keywords, description)
+            VALUES ('delete', old.id, old.user_id, old.product_name, old.keywords, old.description);
+            INSERT INTO descriptions_fts (rowid, user_id, product_name, keywords, description)
+            VALUES (new.id, new.user_id, new.product_name, new.keywords, new.description);
+        END
+    ''')
+    conn.commit()
+    
+    # Indexar as descrições existentes em lotes por faixa de id. Recomeçar do
+    # zero torna a migração segura para rodar de novo se for interrompida;
+    # linhas acima de `limite` já entram pelos gatilhos.
+    conn.execute("INSERT INTO descriptions_fts (descriptions_fts) VALUES ('delete-all')")
+    limite = conn.execute('SELECT COALESCE(MAX(id), 0) FROM descriptions').fetchone()[0]
+    conn.commit()
+    ultimo = 0
+    while ultimo < limite:
+        proximo = min(ultimo + 5000, limite)
+        conn.execute('''
+            INSERT INTO descriptions_fts (rowid, user_id, product_name, keywords, description)
+            SELECT id, user_id, product_name, keywords, description FROM descriptions
+            WHERE id > ? AND id <= ?
+        ''', (ultimo, proximo))
+        renew_lock(conn)
+        conn.commit()
+        ultimo = proximo
+        time.sleep(0.005)
+
+@migration(9, "Pagamentos com chave de idempotência")
+def _create_payments(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            plan TEXT NOT NULL,
+            amount_cents INTEGER NOT NULL,
+            currency TEXT NOT NULL DEFAULT 'BRL',
+            provider TEXT NOT NULL,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            provider_ref TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_user_created ON payments (user_id, created_at)')
+    # Só os pagamentos em aberto (retomados quando o processo reinicia)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_open ON payments (status) 
+        WHERE status IN ('pending', 'processing')
+    ''')
+    conn.commit()
+
+@migration(10, "Reservas de cota: coluna reserved em usage_counters e tabela quota_reservations")
+def _create_quota_reservations(conn):
+    add_column_if_missing(conn, 'usage_counters', 'reserved', 'INTEGER NOT NULL DEFAULT 0')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS quota_reservations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_quota_reservations_user_expires 
+        ON quota_reservations (user_id, expires_at)
+    ''')
+    conn.commit()
+
+@migration(11, "Fila de gerações em segundo plano")
+def _create_generation_jobs(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS generation_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            params TEXT NOT NULL,
+            reservation_id INTEGER,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            started_at REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    # Próximo trabalho da fila, em ordem de chegada
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_generation_jobs_pending ON generation_jobs (status, id) 
+        WHERE status = 'pending'
+    ''')
+    # Trabalhos presos em 'running' (worker que morreu no meio)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_generation_jobs_running ON generation_jobs (status, started_at) 
+        WHERE status = 'running'
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_generation_jobs_user ON generation_jobs (user_id, id)')
+    conn.commit()
+
+@migration(12, "Chaves de acesso à API HTTP")
+def _create_api_keys(conn):
+    # Só o hash da chave é guardado; o prefixo ajuda o usuário a reconhecê-la
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS api_keys (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            key_hash TEXT NOT NULL UNIQUE,
+            prefix TEXT NOT NULL,
+            name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            revoked_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_api_keys_user ON api_keys (user_id)')
+    conn.commit()
+
+@migration(13, "Linhas de lotes já salvas (retomada sem duplicar descrições)")
+def _create_batch_lines(conn):
+    # Gravada na mesma transação da descrição: ao retomar um lote, a linha
+    # que caiu entre o banco e o diário de saída não é gerada nem salva de novo
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS batch_lines (
+            user_id INTEGER NOT NULL,
+            batch_id TEXT NOT NULL,
+            line INTEGER NOT NULL,
+            description_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, batch_id, line)
+        ) WITHOUT ROWID
+    ''')
+    conn.commit()
+
+@migration(14, "Heartbeat dos trabalhos da fila e reservas de cota por trabalho")
+def _add_job_heartbeat(conn):
+    # O worker renova heartbeat_at enquanto processa: trabalho lento não é
+    # confundido com trabalho de um worker que morreu
+    add_column_if_missing(conn, 'generation_jobs', 'heartbeat_at', 'REAL')
+    conn.execute("UPDATE generation_jobs SET heartbeat_at = started_at WHERE status = 'running'")
+    conn.execute('DROP INDEX IF EXISTS idx_generation_jobs_running')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_generation_jobs_running ON generation_jobs (status, heartbeat_at) 
+        WHERE status = 'running'
+    ''')
+    # Reservas de trabalhos na fila ou em andamento não vencem
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_generation_jobs_reservation ON generation_jobs (reservation_id) 
+        WHERE reservation_id IS NOT NULL
+    ''')
+    conn.commit()
+
+@migration(15, "Texto parcial dos trabalhos da fila (streaming)")
+def _add_job_partial(conn):
+    # O worker grava aqui o texto que a IA já mandou; a página mostra enquanto gera
+    add_column_if_missing(conn, 'generation_jobs', 'partial', 'TEXT')
+    conn.commit()
+
+@migration(16, "Dono dos trabalhos da fila (o pool que guarda a chave da API)")
+def _add_job_owner(conn):
+    # A chave da API só existe na memória do pool que recebeu o pedido: só
+    # ele pega o trabalho. Sem dono, só pools com a chave do servidor pegam
+    add_column_if_missing(conn, 'generation_jobs', 'owner', 'TEXT')
+    # Trabalhos na fila também têm heartbeat (o do dono); os de antes desta
+    # versão ficam sem dono e ganham um prazo a partir de agora
+    conn.execute(
+        "UPDATE generation_jobs SET heartbeat_at = ? WHERE status = 'pending'", (time.time(),)
+    )
+    conn.execute('DROP INDEX IF EXISTS idx_generation_jobs_pending')
+    conn.execute('DROP INDEX IF EXISTS idx_generation_jobs_running')
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_generation_jobs_owner ON generation_jobs (owner, status)'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_generation_jobs_heartbeat ON generation_jobs (status, heartbeat_at)'
+    )
+    conn.commit()
@@ -0,0 +1,190 @@
+"""
+Pagamentos de upgrade de plano
+
+O clique em "Upgrade" só registra o pagamento (status 'pending') e volta na
+hora: a cobrança roda em um pool pequeno de threads próprio, separado das
+threads que atendem as sessões e das gerações, então um pico de upgrades
+durante uma promoção não segura ninguém esperando. A página acompanha o
+status consultando o banco.
+
+Cada pagamento tem uma chave de idempotência: repetir o pedido (clique
+duplo, rerun, processo reiniciado no meio da cobrança) nunca cobra duas
+vezes. A aprovação grava o pagamento e o novo plano na mesma transação.
+
+Provedores implementam PaymentProvider.charge e são escolhidos por
+PAYMENT_PROVIDER (padrão: 'fake', que simula a cobrança localmente).
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Preço mensal de cada plano pago, em centavos
+PLAN_PRICES_CENTS = {'pro': 2990}
+
+class PaymentError(Exception):
+    """Falha temporária ao falar com o provedor (a cobrança pode ser repetida)"""
+
+class ChargeResult:
+    """Resposta do provedor: 'approved' ou 'declined', com a referência da transação"""
+
+    __slots__ = ('status', 'reference', 'message')
+
+    def __init__(self, status, reference=None, message=None):
+        self.status = status
+        self.reference = reference
+        self.message = message
+
+class PaymentProvider:
+    """Interface dos provedores de pagamento"""
+
+    name = None
+
+    def charge(self, idempotency_key, amount_cents, currency, description):
+        """Cobra o valor e retorna um ChargeResult; levanta PaymentError em falhas temporárias
+
+        Deve ser idempotente pela chave: a mesma chave devolve o mesmo
+        resultado sem cobrar de novo.
+        """
+        raise NotImplementedError
+
+class FakeProvider(PaymentProvider):
+    """Provedor local para desenvolvimento e testes
+
+    Espera `latency` segundos (na thread do processador, nunca na da sessão),
+    falha temporariamente nas `fail_times` primeiras chamadas e recusa os
+    valores em `decline_amounts`.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency=None, fail_times=0, decline_amounts=()):
+        self.latency = latency if latency is not None else float(os.getenv("FAKE_PAYMENT_LATENCY", 2))
+        self.fail_times = fail_times
+        self.decline_amounts = set(decline_amounts)
+        self.charges = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def charge(self, idempotency_key, amount_cents, currency, description):
+        with self._lock:
+            self.calls += 1
+            if idempotency_key in self.charges:
+                return self.charges[idempotency_key]
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                raise PaymentError("Provedor indisponível (simulado)")
+
+        time.sleep(self.latency)
+        if amount_cents in self.decline_amounts:
+            result = ChargeResult('declined', message="Cartão recusado (simulado)")
+        else:
+            result = ChargeResult('approved', reference=f"fake_{uuid.uuid4().hex[:16]}")
+        with self._lock:
+            # Outra chamada com a mesma chave pode ter terminado antes
+            return self.charges.setdefault(idempotency_key, result)
+
+PROVIDERS = {'fake': FakeProvider}
+
+def register_provider(name, factory):
+    """Registra um provedor (factory sem argumentos que retorna um PaymentProvider)"""
+    PROVIDERS[name] = factory
+
+def create_provider(name=None):
+    """Cria o provedor configurado em PAYMENT_PROVIDER"""
+    name = name or os.getenv("PAYMENT_PROVIDER", "fake")
+    if name not in PROVIDERS:
+        raise ValueError(f"Provedor de pagamento desconhecido: {name}")
+    return PROVIDERS[name]()
+
+def new_idempotency_key():
+    """Chave de idempotência para uma nova tentativa de pagamento"""
+    return uuid.uuid4().hex
+
+class PaymentProcessor:
+    """Processa as cobranças em segundo plano e registra o resultado no banco"""
+
+    def __init__(self, db, provider, max_workers=None, max_attempts=3, retry_delay=1.0):
+        self.db = db
+        self.provider = provider
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._executor = ThreadPoolExecutor(
+            max_workers or int(os.getenv("PAYMENT_WORKERS", 2)), thread_name_prefix="payments"
+        )
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def start(self, user_id, plan, idempotency_key):
+        """Registra o pagamento do plano e agenda a cobrança; retorna o pagamento sem esperar"""
+        if plan not in PLAN_PRICES_CENTS:
+            raise ValueError(f"Plano sem preço definido: {plan}")
+        payment = self.db.create_payment(
+            user_id, plan, PLAN_PRICES_CENTS[plan], self.provider.name, idempotency_key
+        )
+        self._schedule(payment)
+        return payment
+
+    def status(self, payment_id):
+        """Estado atual do pagamento (consulta rápida, para a página acompanhar)"""
+        return self.db.get_payment(payment_id)
+
+    def resume_open_payments(self):
+        """Reagenda pagamentos que ficaram em aberto (ex.: processo reiniciado)"""
+        abertos = self.db.get_open_payments()
+        for payment in abertos:
+            self._schedule(payment)
+        return len(abertos)
+
+    def _schedule(self, payment):
+        """Agenda a cobrança, uma única vez por pagamento em aberto"""
+        if payment['status'] not in ('pending', 'processing'):
+            return
+        with self._lock:
+            if self._closed or payment['id'] in self._in_flight:
+                return
+            self._in_flight.add(payment['id'])
+        self._executor.submit(self._process, payment)
+
+    def _process(self, payment):
+        """Cobra no provedor (com novas tentativas) e grava o resultado"""
+        payment_id = payment['id']
+        try:
+            self.db.set_payment_status(payment_id, 'processing')
+            for tentativa in range(1, self.max_attempts + 1):
+                try:
+                    result = self.provider.charge(
+                        payment['idempotency_key'], payment['amount_cents'], payment['currency'],
+                        f"DescriçõesIA Pro - plano {payment['plan']}"
+                    )
+                    break
+                except PaymentError as e:
+                    if tentativa == self.max_attempts:
+                        self.db.set_payment_status(payment_id, 'failed', error=str(e))
+                        return
+                    time.sleep(self.retry_delay * tentativa)
+
+            if result.status == 'approved':
+                self.db.complete_payment(payment_id, result.reference)
+                print(f"💳 Pagamento {payment_id} aprovado: plano {payment['plan']} para o usuário {payment['user_id']}")
+            else:
+                self.db.set_payment_status(payment_id, 'declined', result.reference, result.message)
+        except Exception as e:
+            print(f"❌ Erro ao processar pagamento {payment_id}: {e}")
+            self.db.set_payment_status(payment_id, 'failed', error=str(e))
+        finally:
+            with self._lock:
+                self._in_flight.discard(payment_id)
+
+    def healthy(self):
+        """O processador ainda aceita pagamentos"""
+        return not self._closed
+
+    def close(self, wait=True):
+        """Para de aceitar pagamentos e espera (por padrão) os que estão em andamento"""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=wait)
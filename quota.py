@@ -0,0 +1,94 @@
+"""
+Limites dos planos e reserva de cota para gerações
+
+Antes de chamar a IA, a sessão reserva no banco as vagas que vai usar
+(Database.reserve_quota, um UPDATE condicional atômico). Depois de salvar as
+descrições (que passam a contar em usage_counters) ou se a geração falhar, a
+reserva é liberada. Assim duas abas do mesmo usuário nunca passam juntas do
+limite do mês, e uma sessão que morre no meio libera a vaga quando a
+reserva vence (QUOTA_RESERVATION_TTL). Reservas de trabalhos da fila de
+gerações não vencem enquanto o trabalho estiver na fila ou em andamento.
+
+Uso:
+    with quota.reserve(db, user_id, plan, quantidade):
+        ...gerar e salvar...
+"""
+
+import os
+import time
+
+# Descrições por mês de cada plano (None = ilimitado)
+PLAN_LIMITS = {
+    'free': 5,
+    'pro': None,
+    'enterprise': None,
+}
+
+RESERVATION_TTL = int(os.getenv("QUOTA_RESERVATION_TTL", 600))
+
+class QuotaExceeded(Exception):
+    """O plano não tem vagas suficientes neste mês"""
+
+    def __init__(self, plan, limit, remaining):
+        self.plan = plan
+        self.limit = limit
+        self.remaining = remaining
+        super().__init__(f"Limite do plano {plan} atingido: restam {remaining} de {limit} descrições neste mês")
+
+def monthly_limit(plan):
+    """Descrições por mês do plano (None = ilimitado; planos desconhecidos usam o grátis)"""
+    return PLAN_LIMITS.get(plan, PLAN_LIMITS['free'])
+
+def current_month():
+    """Mês corrente (UTC), no mesmo formato de usage_counters.month"""
+    return time.strftime('%Y-%m', time.gmtime())
+
+def remaining(db, user_id, plan):
+    """Vagas disponíveis no mês, descontando gerações em andamento (None = ilimitado)"""
+    limit = monthly_limit(plan)
+    if limit is None:
+        return None
+    usadas, reservadas = db.get_quota_usage(user_id, current_month())
+    return max(0, limit - usadas - reservadas)
+
+class Reservation:
+    """Vagas reservadas para uma geração; liberadas ao sair do bloco `with`"""
+
+    def __init__(self, db, reservation_id, amount):
+        self.db = db
+        self.id = reservation_id
+        self.amount = amount
+
+    def renew(self, ttl=None):
+        """Adia o vencimento da reserva (o trabalho continua vivo)"""
+        if self.id is not None:
+            self.db.renew_quota(self.id, ttl if ttl is not None else RESERVATION_TTL)
+
+    def release(self):
+        """Libera a reserva (as descrições salvas já contam no uso do mês)"""
+        if self.id is not None:
+            self.db.release_quota(self.id)
+            self.id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+def reserve(db, user_id, plan, amount=1, ttl=None):
+    """Reserva `amount` vagas do mês; levanta QuotaExceeded se não couberem
+
+    Planos ilimitados não tocam no banco.
+    """
+    limit = monthly_limit(plan)
+    if limit is None:
+        return Reservation(db, None, amount)
+
+    reservation_id = db.reserve_quota(
+        user_id, current_month(), amount, limit, ttl if ttl is not None else RESERVATION_TTL
+    )
+    if reservation_id is None:
+        raise QuotaExceeded(plan, limit, remaining(db, user_id, plan))
+    return Reservation(db, reservation_id, amount)
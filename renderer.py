@@ -0,0 +1,122 @@
+"""
+Conversão do Markdown gerado pela IA para HTML
+
+As descrições usam um subconjunto pequeno de Markdown: títulos (#), listas
+(-, * ou •), listas numeradas (1. ou 1)), **negrito**, *itálico* (também
+dentro do negrito) e #hashtags. O texto é percorrido uma única vez com
+expressões compiladas no carregamento do módulo, e todo conteúdo é escapado
+antes de entrar no HTML.
+
+O resultado fica em cache pelo hash do texto: mostrar de novo uma descrição
+já renderizada (reruns do Streamlit, histórico, exportação) não custa nada.
+"""
+
+import hashlib
+import html
+import re
+import threading
+from collections import OrderedDict
+
+TITULO = re.compile(r'(#{1,6})\s+(.+?)\s*#*\s*$')
+ITEM_LISTA = re.compile(r'\s*(?:[-*•]|(?P<numero>\d+)[.)])\s+(?P<texto>.*)')
+# Negrito e itálico juntos, negrito, itálico ou hashtag, o que aparecer
+# primeiro na linha. Todas as alternativas começam por um caractere literal
+# (o lookbehind vem depois do #), o que deixa o re pular direto para os
+# candidatos em vez de testar cada posição. O itálico não aceita * dentro nem
+# espaço junto aos marcadores ("5 * 3 * 2" continua texto)
+INLINE = re.compile(
+    r'\*\*\*(?P<ambos>[^*]+?)\*\*\*'
+    r'|\*\*(?P<negrito>.+?)\*\*'
+    r'|\*(?P<italico>[^\s*](?:[^*]*[^\s*])?)\*'
+    r'|#(?<![\w&#]#)(?P<hashtag>\w+)'
+)
+
+CACHE_MAX_ENTRIES = 1024
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _substituir(achado):
+    """Troca negrito, itálico ou hashtag pela marcação HTML"""
+    ambos, negrito, italico = achado.group('ambos', 'negrito', 'italico')
+    if ambos is not None:
+        return f"<strong><em>{_inline(ambos)}</em></strong>"
+    if negrito is not None:
+        # O negrito pode conter itálico e hashtags
+        return f"<strong>{_inline(negrito)}</strong>"
+    if italico is not None:
+        return f"<em>{_inline(italico)}</em>"
+    return f"<span class='hashtag'>#{achado.group('hashtag')}</span>"
+
+def _inline(texto):
+    """Converte negrito, itálico e hashtags de uma linha já escapada"""
+    return INLINE.sub(_substituir, texto)
+
+def _render(texto):
+    """Converte o Markdown em HTML percorrendo as linhas uma vez"""
+    saida = []
+    paragrafo = []
+    lista = None  # 'ul', 'ol' ou None
+
+    def fechar_paragrafo():
+        if paragrafo:
+            saida.append(f"<p>{'<br>'.join(paragrafo)}</p>")
+            paragrafo.clear()
+
+    # Escapar o texto inteiro de uma vez; os marcadores (#, *, -) não são afetados
+    for linha in html.escape(texto, quote=False).splitlines():
+        item = ITEM_LISTA.match(linha)
+        if item:
+            fechar_paragrafo()
+            numero = item.group('numero')
+            tipo = 'ol' if numero is not None else 'ul'
+            if lista != tipo:
+                if lista:
+                    saida.append(f'</{lista}>')
+                # Lista numerada que não começa em 1 mantém a numeração original
+                inicio = f' start="{int(numero)}"' if numero is not None and int(numero) != 1 else ''
+                saida.append(f'<{tipo}{inicio}>')
+                lista = tipo
+            saida.append(f"<li>{_inline(item.group('texto'))}</li>")
+            continue
+
+        if lista:
+            saida.append(f'</{lista}>')
+            lista = None
+
+        titulo = TITULO.match(linha)
+        if titulo:
+            fechar_paragrafo()
+            nivel = len(titulo.group(1))
+            saida.append(f"<h{nivel}>{_inline(titulo.group(2))}</h{nivel}>")
+        elif linha.strip():
+            paragrafo.append(_inline(linha.strip()))
+        else:
+            fechar_paragrafo()
+
+    if lista:
+        saida.append(f'</{lista}>')
+    fechar_paragrafo()
+    return '\n'.join(saida)
+
+def markdown_to_html(texto):
+    """Converte a descrição em HTML (memorizado pelo hash do conteúdo)"""
+    texto = texto or ''
+    chave = hashlib.blake2b(texto.encode('utf-8'), digest_size=16).digest()
+    with _cache_lock:
+        resultado = _cache.get(chave)
+        if resultado is not None:
+            _cache.move_to_end(chave)
+            return resultado
+
+    resultado = _render(texto)
+    with _cache_lock:
+        _cache[chave] = resultado
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return resultado
+
+def clear_cache():
+    """Esvazia o cache de renderizações (usado nos benchmarks)"""
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,231 @@
+"""
+Política de resiliência para chamadas ao Gemini
+
+- Repetição com backoff exponencial e jitter para erros transitórios (429/5xx)
+- Troca automática de modelo seguindo a lista da barra lateral, também
+  quando o modelo recusa o pedido (404 modelo inexistente, 400 parâmetro
+  não suportado)
+- Requisição duplicada ("hedge") opcional quando a primeira demora demais
+- Disjuntor (circuit breaker) por modelo, para parar de insistir em um
+  modelo que está falhando seguidamente; meio-aberto, deixa passar uma
+  única chamada de teste por vez
+"""
+
+import asyncio
+import os
+import random
+import re
+import time
+
+# Ordem de fallback entre os modelos oferecidos na barra lateral
+MODELOS_FALLBACK = ["gemini-2.5-flash", "gemini-2.0-flash", "gemini-2.5-flash-lite"]
+
+# Códigos HTTP que valem uma nova tentativa
+STATUS_TRANSITORIOS = {408, 429, 500, 502, 503, 504}
+
+# Códigos HTTP de um pedido que este modelo não atende, mas outro pode atender
+STATUS_DO_MODELO = {400, 404}
+
+class CircuitOpenError(Exception):
+    """Todos os modelos da cadeia estão com o disjuntor aberto"""
+
+class PartialStreamError(Exception):
+    """O streaming falhou depois de já ter entregue parte do texto"""
+
+    def __init__(self, original):
+        super().__init__(str(original))
+        self.original = original
+
+def cadeia_modelos(modelo):
+    """Modelo escolhido seguido dos demais modelos de fallback"""
+    return [modelo] + [m for m in MODELOS_FALLBACK if m != modelo]
+
+def status_code(exc):
+    """Extrai o código HTTP de um erro da API (None se não houver)"""
+    for attr in ('code', 'status_code'):
+        valor = getattr(exc, attr, None)
+        if isinstance(valor, int):
+            return valor
+    match = re.search(r'\b(4\d\d|5\d\d)\b', str(exc))
+    return int(match.group(1)) if match else None
+
+def is_retryable(exc):
+    """Indica se vale a pena repetir a chamada após este erro"""
+    if isinstance(exc, PartialStreamError):
+        return False
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    # Erros de rede do httpx (usado pelo SDK) sem depender do pacote aqui
+    nome = type(exc).__name__
+    if nome.endswith(('TimeoutException', 'ConnectError', 'ReadError', 'RemoteProtocolError')):
+        return True
+    return status_code(exc) in STATUS_TRANSITORIOS
+
+def is_model_error(exc):
+    """Indica se o erro é do modelo (não adianta repetir, mas vale tentar o próximo)"""
+    if isinstance(exc, PartialStreamError):
+        return False
+    return status_code(exc) in STATUS_DO_MODELO
+
+class RetryPolicy:
+    """Parâmetros de repetição, hedge e disjuntor"""
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0, hedge_after=None,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_after = hedge_after
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    @classmethod
+    def from_env(cls):
+        """Lê a política das variáveis de ambiente (GEMINI_RETRY_*, GEMINI_HEDGE_AFTER...)"""
+        hedge = float(os.getenv("GEMINI_HEDGE_AFTER", 0))
+        return cls(
+            max_attempts=int(os.getenv("GEMINI_RETRY_ATTEMPTS", 3)),
+            base_delay=float(os.getenv("GEMINI_RETRY_BASE_DELAY", 0.5)),
+            max_delay=float(os.getenv("GEMINI_RETRY_MAX_DELAY", 8.0)),
+            hedge_after=hedge or None,
+            failure_threshold=int(os.getenv("GEMINI_BREAKER_THRESHOLD", 5)),
+            reset_timeout=float(os.getenv("GEMINI_BREAKER_RESET", 30.0)),
+        )
+
+    def backoff(self, tentativa):
+        """Espera antes da próxima tentativa ("full jitter")"""
+        teto = min(self.max_delay, self.base_delay * (2 ** tentativa))
+        return random.uniform(0, teto)
+
+class CircuitBreaker:
+    """Disjuntor de um modelo: fechado → aberto após falhas → meio-aberto após o tempo de espera"""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self):
+        """Estado atual: 'fechado', 'aberto' ou 'meio-aberto'"""
+        if self.opened_at is None:
+            return 'fechado'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'meio-aberto'
+        return 'aberto'
+
+    def allow(self):
+        """Indica se o modelo pode receber esta chamada agora
+
+        Meio-aberto, só a primeira chamada passa (a de teste); as demais são
+        recusadas até ela terminar com record_success, record_failure ou
+        cancel_probe.
+        """
+        estado = self.state
+        if estado == 'fechado':
+            return True
+        if estado == 'aberto' or self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def cancel_probe(self):
+        """A chamada de teste terminou sem dizer se o modelo se recuperou"""
+        self.probing = False
+
+    def record_success(self):
+        """Fecha o disjuntor após uma chamada bem-sucedida"""
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        """Conta uma falha e abre o disjuntor ao atingir o limite"""
+        self.probing = False
+        self.failures += 1
+        if self.state == 'meio-aberto' or self.failures >= self.failure_threshold:
+            # Meio-aberto: uma falha na chamada de teste reabre o disjuntor
+            self.opened_at = time.monotonic()
+
+class ResilientCaller:
+    """Aplica a política de resiliência a uma chamada assíncrona por modelo
+
+    Deve ser usado sempre a partir do mesmo event loop (o do pool de clientes),
+    por isso o estado dos disjuntores não precisa de trava.
+    """
+
+    def __init__(self, policy=None):
+        self.policy = policy or RetryPolicy.from_env()
+        self.breakers = {}
+
+    def breaker(self, modelo):
+        """Disjuntor do modelo (criado na primeira vez)"""
+        breaker = self.breakers.get(modelo)
+        if breaker is None:
+            breaker = CircuitBreaker(self.policy.failure_threshold, self.policy.reset_timeout)
+            self.breakers[modelo] = breaker
+        return breaker
+
+    async def call(self, modelos, chamada, hedge=True):
+        """Executa `chamada(modelo)` com repetição e fallback; retorna (modelo, resultado)
+
+        O modelo retornado é o que de fato respondeu, que pode não ser o
+        primeiro da lista.
+        """
+        ultimo_erro = None
+        for modelo in modelos:
+            breaker = self.breaker(modelo)
+            for tentativa in range(self.policy.max_attempts):
+                if not breaker.allow():
+                    break
+                try:
+                    if hedge:
+                        resultado = await self._hedged(lambda: chamada(modelo))
+                    else:
+                        resultado = await chamada(modelo)
+                except Exception as e:
+                    ultimo_erro = e
+                    if is_retryable(e):
+                        breaker.record_failure()
+                        if tentativa + 1 < self.policy.max_attempts:
+                            await asyncio.sleep(self.policy.backoff(tentativa))
+                        continue
+                    breaker.cancel_probe()
+                    if is_model_error(e):
+                        # Repetir não adianta, mas o próximo modelo pode atender
+                        break
+                    raise
+                except BaseException:
+                    # Cancelada (ex.: pool fechado): não diz nada sobre o modelo
+                    breaker.cancel_probe()
+                    raise
+                breaker.record_success()
+                return modelo, resultado
+
+        if ultimo_erro is None:
+            raise CircuitOpenError("Nenhum modelo disponível no momento (disjuntores abertos)")
+        raise ultimo_erro
+
+    async def _hedged(self, fabrica):
+        """Dispara uma cópia da chamada se a primeira passar de `hedge_after` segundos"""
+        if not self.policy.hedge_after:
+            return await fabrica()
+
+        primeira = asyncio.ensure_future(fabrica())
+        prontas, _ = await asyncio.wait({primeira}, timeout=self.policy.hedge_after)
+        if prontas:
+            return primeira.result()
+
+        pendentes = {primeira, asyncio.ensure_future(fabrica())}
+        erro = None
+        while pendentes:
+            prontas, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+            for tarefa in prontas:
+                if tarefa.exception() is None:
+                    for outra in pendentes:
+                        outra.cancel()
+                    return tarefa.result()
+                erro = tarefa.exception()
+        raise erro
@@ -0,0 +1,168 @@
+"""
+Recursos compartilhados pelo processo (um por worker do Streamlit)
+
+O banco de dados, o pool de clientes Gemini, o processador de pagamentos e
+os workers da fila de gerações são criados uma única vez, no primeiro uso,
+e servem a todas as sessões: abrir uma sessão nova não abre conexão, não
+roda migrações e não cria clientes. Cada recurso pode ter uma verificação
+de saúde (refeita no máximo a cada RESOURCE_HEALTH_INTERVAL segundos; se
+falhar, o recurso é recriado) e uma função de encerramento, chamada na
+ordem inversa da criação quando o processo termina.
+
+Uso:
+    import resources
+    db = resources.get_database()
+    python resources.py            # verifica a saúde dos recursos
+"""
+
+import atexit
+import os
+import sys
+import threading
+import time
+
+class ResourceRegistry:
+    """Registro de recursos do processo, criados sob demanda"""
+
+    def __init__(self, health_interval=None):
+        self.health_interval = health_interval if health_interval is not None else \
+            float(os.getenv("RESOURCE_HEALTH_INTERVAL", 30))
+        self._factories = {}
+        self._instances = {}
+        self._checked_at = {}
+        self._order = []
+        self._lock = threading.RLock()
+
+    def register(self, name, factory, health=None, close=None):
+        """Registra um recurso: factory() cria, health(r) valida, close(r) encerra"""
+        with self._lock:
+            self._factories[name] = (factory, health, close)
+
+    def get(self, name):
+        """Retorna o recurso, criando-o (ou recriando-o, se não estiver saudável)"""
+        instance = self._instances.get(name)
+        if instance is not None and \
+                time.monotonic() - self._checked_at.get(name, float('-inf')) < self.health_interval:
+            return instance
+
+        with self._lock:
+            factory, health, close = self._factories[name]
+            instance = self._instances.get(name)
+            if instance is not None:
+                if self._healthy(name, instance, health):
+                    self._checked_at[name] = time.monotonic()
+                    return instance
+                print(f"⚠️ Recurso {name} falhou na verificação de saúde; recriando")
+                self._close(name, instance, close)
+
+            instance = factory()
+            self._instances[name] = instance
+            self._checked_at[name] = time.monotonic()
+            self._order.append(name)
+            return instance
+
+    def _healthy(self, name, instance, health):
+        """Executa a verificação de saúde sem deixar escapar exceções"""
+        if health is None:
+            return True
+        try:
+            return bool(health(instance))
+        except Exception as e:
+            print(f"⚠️ Verificação de saúde de {name}: {e}")
+            return False
+
+    def _close(self, name, instance, close):
+        """Encerra um recurso e o remove do registro"""
+        self._instances.pop(name, None)
+        self._checked_at.pop(name, None)
+        if name in self._order:
+            self._order.remove(name)
+        if close is not None:
+            try:
+                close(instance)
+            except Exception as e:
+                print(f"⚠️ Erro ao encerrar {name}: {e}")
+
+    def health(self):
+        """Estado dos recursos já criados: {nome: True/False}"""
+        with self._lock:
+            return {
+                name: self._healthy(name, self._instances[name], self._factories[name][1])
+                for name in self._order
+            }
+
+    def shutdown(self):
+        """Encerra todos os recursos, do mais recente ao mais antigo"""
+        with self._lock:
+            for name in reversed(list(self._order)):
+                self._close(name, self._instances[name], self._factories[name][2])
+
+registry = ResourceRegistry()
+atexit.register(registry.shutdown)
+
+# ========== RECURSOS DO APP ==========
+
+def _create_database():
+    """Banco único do processo, com a reconciliação periódica dos contadores"""
+    from database import Database, start_usage_reconciler
+
+    database = Database('data/descricoes.db')
+    interval = int(os.getenv("USAGE_RECONCILE_INTERVAL", 3600))
+    if interval > 0:
+        start_usage_reconciler(database, interval)
+    return database
+
+def _database_healthy(database):
+    """O banco responde a uma consulta trivial"""
+    return database.conn.execute('SELECT 1').fetchone() == (1,)
+
+def _create_pool():
+    """Pool de clientes Gemini (os clientes são criados por chave, no primeiro uso)"""
+    from gemini_pool import GeminiPool
+    return GeminiPool()
+
+def _create_payments():
+    """Processador de pagamentos, retomando os que ficaram em aberto"""
+    from payments import PaymentProcessor, create_provider
+
+    processor = PaymentProcessor(get_database(), create_provider())
+    retomados = processor.resume_open_payments()
+    if retomados:
+        print(f"💳 {retomados} pagamento(s) em aberto retomado(s)")
+    return processor
+
+def _create_jobs():
+    """Workers da fila de gerações (GENERATION_WORKERS=0 deixa a fila para processos externos)"""
+    from jobs import JobWorkerPool
+    return JobWorkerPool(get_database()).start()
+
+registry.register('database', _create_database, health=_database_healthy, close=lambda db: db.close())
+registry.register('gemini_pool', _create_pool, health=lambda pool: pool.healthy(),
+                  close=lambda pool: pool.close())
+registry.register('payments', _create_payments, health=lambda processor: processor.healthy(),
+                  close=lambda processor: processor.close())
+registry.register('jobs', _create_jobs, health=lambda pool: pool.healthy(), close=lambda pool: pool.close())
+
+def get_database():
+    """Banco de dados compartilhado por todas as sessões"""
+    return registry.get('database')
+
+def get_pool():
+    """Pool de clientes Gemini compartilhado por todas as sessões"""
+    return registry.get('gemini_pool')
+
+def get_payments():
+    """Processador de pagamentos do processo"""
+    return registry.get('payments')
+
+def get_jobs():
+    """Fila de gerações em segundo plano do processo"""
+    return registry.get('jobs')
+
+if __name__ == '__main__':
+    get_database()
+    get_pool()
+    estados = registry.health()
+    for nome, saudavel in estados.items():
+        print(f"{'✅' if saudavel else '❌'} {nome}")
+    sys.exit(0 if all(estados.values()) else 1)
@@ -1,7 +1,14 @@
 """
 Módulo de templates para diferentes tipos de descrições de e-commerce
+
+Cada template é compilado uma única vez (ao importar o módulo) em um
+PromptTemplate: um prefixo estático, igual em todas as chamadas daquele
+template (papel do redator, diretrizes e instruções do template), enviado
+como system_instruction, e um sufixo curto com os dados do produto.
 """
 
+import textwrap
+
 TEMPLATES = {
     "shopee_mercado_livre": {
         "name": "Shopee/Mercado Livre",
@@ -98,4 +105,103 @@ def get_all_templates():
 
 def get_template_name(template_key):
     """Retorna o nome amigável de um template"""
-    return TEMPLATES.get(template_key, {}).get("name", "Padrão")
\ No newline at end of file
+    return TEMPLATES.get(template_key, {}).get("name", "Padrão")
+
+# ========== PROMPTS COMPILADOS ==========
+
+# Parte fixa do prompt: não depende do produto nem das opções do formulário
+PREFIXO_ESTATICO = """Você é um redator especialista em e-commerce, SEO e copywriting.
+Sua tarefa é criar descrições de venda PERSUASIVAS para os produtos informados.
+
+**DIRETRIZES ESTRITAS:**
+1. ESTRUTURA:
+   - Título chamativo (use 1-2 emojis relevantes)
+   - Introdução breve (1-2 frases)
+   - 4-6 bullet points com características e BENEFÍCIOS
+   - Chamada para ação forte no final
+
+2. ESTILO:
+   - Use o tom pedido para o produto
+   - Foco em benefícios (não só características)
+   - Use palavras de poder: exclusivo, premium, garantido, etc.
+   - Linguagem persuasiva que gere urgência
+
+3. SEO:
+   - Use palavras-chave naturalmente
+   - Estrutura otimizada para motores de busca
+   - Meta-descrição implícita
+
+4. FORMATAÇÃO:
+   - Use negrito (**) para destaques
+   - Use emojis moderadamente (3-5 no total)
+   - Bullet points claros
+"""
+
+SAIDA = "**SAÍDA:** Apenas a descrição formatada em Markdown, sem comentários adicionais."
+
+# Parte variável: só os dados do produto e as opções escolhidas
+SUFIXO_PRODUTO = """Crie a descrição para o seguinte produto:
+
+**INFORMAÇÕES DO PRODUTO:**
+- Nome: {nome_produto}
+- Categoria: {categoria}
+- Tom desejado: {tom}
+- Palavras-chave: {palavras_chave}
+- Tamanho: {tamanho} (máximo {limite_palavras} palavras)
+{extras}"""
+
+EXTRA_ESPECIFICACOES = '- Inclua a seção "Especificações Técnicas" (se aplicável)'
+EXTRA_HASHTAGS = "- Inclua 3-5 hashtags relevantes no final"
+
+class Prompt:
+    """Prompt pronto para a API: instrução de sistema (estática) + texto do pedido"""
+
+    __slots__ = ('system', 'texto')
+
+    def __init__(self, system, texto):
+        self.system = system
+        self.texto = texto
+
+    def completo(self):
+        """Prompt inteiro em um texto só (chave do cache e estimativa de tokens)"""
+        return f"{self.system}\n\n{self.texto}"
+
+    def com_texto(self, extra):
+        """Mesmo prefixo, com texto acrescentado ao pedido"""
+        return Prompt(self.system, self.texto + extra)
+
+class PromptTemplate:
+    """Template compilado: prefixo estático montado uma vez, sufixo formatado por produto"""
+
+    def __init__(self, key, instructions):
+        self.key = key
+        partes = [PREFIXO_ESTATICO]
+        if instructions.strip():
+            partes.append(f"5. TEMPLATE ESPECÍFICO:\n{textwrap.dedent(instructions).strip()}\n")
+        partes.append(SAIDA)
+        self.system = '\n'.join(partes)
+
+    def render(self, nome_produto, categoria, tom, palavras_chave, tamanho, limite_palavras,
+               incluir_hashtags, incluir_especificacoes):
+        """Monta o Prompt de um produto (só o sufixo é formatado)"""
+        extras = [EXTRA_ESPECIFICACOES] if incluir_especificacoes else []
+        if incluir_hashtags:
+            extras.append(EXTRA_HASHTAGS)
+        texto = SUFIXO_PRODUTO.format(
+            nome_produto=nome_produto, categoria=categoria, tom=tom,
+            palavras_chave=palavras_chave or "Não especificadas",
+            tamanho=tamanho, limite_palavras=limite_palavras,
+            extras='\n'.join(extras)
+        )
+        return Prompt(self.system, texto.rstrip())
+
+# Compilados uma vez por processo; chaves desconhecidas usam o template padrão
+COMPILED_TEMPLATES = {
+    key: PromptTemplate(key, info.get("instructions", ""))
+    for key, info in TEMPLATES.items()
+}
+COMPILED_TEMPLATES["default"] = PromptTemplate("default", "")
+
+def get_compiled_template(template_key):
+    """Retorna o template compilado (o padrão, se a chave não existir)"""
+    return COMPILED_TEMPLATES.get(template_key) or COMPILED_TEMPLATES["default"]
@@ -1,18 +1,18 @@
 # test_db.py
 import sqlite3
 import os
+import shutil
+import tempfile
 
 print("🔍 Testando configuração do SQLite...")
 
-# 1. Verificar se a pasta data existe
-if not os.path.exists('data'):
-    print("❌ Pasta 'data' não encontrada. Criando...")
-    os.makedirs('data')
-    print("✅ Pasta 'data' criada")
+# 1. Pasta temporária para o banco de teste (não toca em data/descricoes.db)
+pasta_teste = tempfile.mkdtemp(prefix='descricoes-teste-')
+print(f"✅ Pasta de teste: {pasta_teste}")
 
 # 2. Tentar criar/conectar ao banco
 try:
-    conn = sqlite3.connect('data/descricoes.db')
+    conn = sqlite3.connect(os.path.join(pasta_teste, 'descricoes.db'))
     cursor = conn.cursor()
     
     # Criar tabela de teste
@@ -40,4 +40,1153 @@ try:
     
 except Exception as e:
     print(f"❌ Erro ao configurar banco de dados: {e}")
-    print("💡 Verifique permissões de escrita na pasta")
\ No newline at end of file
+    print("💡 Verifique permissões de escrita na pasta")
+finally:
+    shutil.rmtree(pasta_teste, ignore_errors=True)
+
+def test_consultas_frequentes_usam_indices():
+    """As consultas de cada renderização não podem varrer a tabela inteira"""
+    from database import Database
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        db = Database(os.path.join(pasta, 'planos.db'))
+        try:
+            planos = db.audit_query_plans()
+        finally:
+            db.close()
+    
+    for plano in planos:
+        print(f"{'❌' if plano['scan'] else '✅'} {plano['query']}: {' | '.join(plano['plan'])}")
+    
+    assert not [p['query'] for p in planos if p['scan']]
+
+def test_paginacao_do_historico_sem_repetir_nem_pular_com_datas_iguais():
+    """Páginas por cursor (created_at, id) cobrem o histórico exatamente uma vez"""
+    from database import Database
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        db = Database(os.path.join(pasta, 'paginas.db'))
+        try:
+            dono = db.add_user('paginas@exemplo.com', 'x')
+            outro = db.add_user('outro@exemplo.com', 'x')
+            # Várias descrições no mesmo segundo, gravadas fora de ordem de data
+            datas = ['2025-01-02 10:00:00', '2025-01-01 10:00:00', '2025-01-03 10:00:00']
+            registros = [
+                (user_id, f"Produto {i}", 'Casa', 'Casual', '', 'Curta (50 palavras)', 'default',
+                 'texto', 'Texto simples', None, None, datas[i % len(datas)])
+                for i in range(23) for user_id in (dono, outro)
+            ]
+            db._write_descriptions(registros)
+            db.conn.commit()
+            
+            esperado = [row[0] for row in db.cursor.execute(
+                'SELECT id FROM descriptions WHERE user_id = ? ORDER BY created_at DESC, id DESC', (dono,)
+            )]
+            assert len(esperado) == 23
+            
+            vistos, cursor = [], None
+            while True:
+                pagina = db.get_description_summaries(dono, limit=5, before=cursor)
+                if not pagina:
+                    break
+                assert len(pagina) <= 5
+                vistos += [linha[0] for linha in pagina]
+                cursor = Database.summary_cursor(pagina[-1])
+            assert vistos == esperado
+            
+            # Lista completa segue a mesma ordem
+            assert [linha[0] for linha in db.get_user_descriptions(dono, limit=8)] == esperado[:8]
+        finally:
+            db.close()
+
+def test_exportacao_e_importacao_ida_e_volta_sem_duplicar():
+    """CSV e JSONL exportados voltam iguais; importar de novo o mesmo arquivo não duplica"""
+    import io
+    import bulk
+    from database import Database
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        db = Database(os.path.join(pasta, 'exportacao.db'))
+        try:
+            dono = db.add_user('exporta@exemplo.com', 'x')
+            for i in range(7):
+                db.save_description(dono, f"Produto {i}, \"especial\"", 'Casa', 'Casual', 'a, b',
+                                    'Curta (50 palavras)', 'default', f"Linha 1\nLinha 2 — ç {i}", 'Markdown')
+            colunas = ('product_name', 'category', 'tone', 'keywords', 'description', 'created_at')
+            original = [linha for bloco in db.iter_user_descriptions(dono, colunas) for linha in bloco]
+            
+            for formato in ('csv', 'jsonl'):
+                arquivo = b''.join(bulk.exportar(db, dono, formato, chunk_size=3))
+                destino = db.add_user(f"importa-{formato}@exemplo.com", 'x')
+                
+                assert bulk.importar(db, destino, io.BytesIO(arquivo), formato, batch_size=4) == (7, 0, 0)
+                copia = [linha for bloco in db.iter_user_descriptions(destino, colunas) for linha in bloco]
+                assert copia == original
+                
+                # De novo: nada entra e o uso não conta duas vezes
+                assert bulk.importar(db, destino, io.BytesIO(arquivo), formato, batch_size=4) == (0, 0, 7)
+                assert db.get_usage(destino)['lifetime'] == 7
+            
+            # Mesmo arquivo no histórico de origem (pelo temporário da interface): tudo já existe
+            with bulk.exportar_arquivo(db, dono, 'jsonl') as arquivo:
+                assert bulk.importar(db, dono, arquivo, 'jsonl') == (0, 0, 7)
+            try:
+                bulk.exportar_arquivo(db, dono, 'csv', limite=100)
+                assert False, "deveria recusar a exportação acima do limite"
+            except ValueError:
+                pass
+        finally:
+            db.close()
+
+def test_pagamento_idempotente_muda_plano_uma_vez():
+    """Repetir o pedido com a mesma chave não cobra de novo; a aprovação muda o plano"""
+    import time
+    from database import Database
+    from payments import FakeProvider, PaymentProcessor
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        db = Database(os.path.join(pasta, 'pagamentos.db'))
+        provedor = FakeProvider(latency=0.05, fail_times=1)
+        processador = PaymentProcessor(db, provedor, retry_delay=0.01)
+        try:
+            user_id = db.add_user('pagamento@exemplo.com', 'x')
+            pedidos = [processador.start(user_id, 'pro', 'chave-1') for _ in range(3)]
+            assert len({p['id'] for p in pedidos}) == 1
+            
+            limite = time.monotonic() + 5
+            while processador.status(pedidos[0]['id'])['status'] in ('pending', 'processing'):
+                assert time.monotonic() < limite
+                time.sleep(0.01)
+            
+            pagamento = processador.status(pedidos[0]['id'])
+            assert pagamento['status'] == 'approved'
+            assert db.get_user_by_id(user_id)[3] == 'pro'
+            assert len(provedor.charges) == 1
+            # Aprovar de novo não tem efeito
+            assert not db.complete_payment(pagamento['id'], 'outra')
+        finally:
+            processador.close()
+            db.close()
+
+def test_reserva_de_cota_concorrente_respeita_limite():
+    """Várias sessões reservando ao mesmo tempo nunca passam do limite do plano"""
+    import threading
+    import quota
+    from database import Database
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        db = Database(os.path.join(pasta, 'cota.db'))
+        try:
+            user_id = db.add_user('cota@exemplo.com', 'x')
+            reservas = []
+            barreira = threading.Barrier(20)
+            
+            def tentar():
+                barreira.wait()
+                try:
+                    reservas.append(quota.reserve(db, user_id, 'free'))
+                except quota.QuotaExceeded:
+                    pass
+            
+            threads = [threading.Thread(target=tentar) for _ in range(20)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            
+            assert len(reservas) == quota.monthly_limit('free')
+            assert quota.remaining(db, user_id, 'free') == 0
+            
+            # Gerações salvas passam a contar no uso; liberar a reserva não devolve a vaga
+            db.save_description(user_id, 'Produto', 'Geral', 'Casual', '', 'Médio', 'default', 'texto', 'txt')
+            for reserva in reservas:
+                reserva.release()
+            assert quota.remaining(db, user_id, 'free') == quota.monthly_limit('free') - 1
+            
+            # Reservas vencidas (sessão que morreu no meio) liberam a vaga sozinhas
+            quota.reserve(db, user_id, 'free', amount=4, ttl=-1)
+            assert quota.remaining(db, user_id, 'free') == 0
+            quota.reserve(db, user_id, 'free', amount=4).release()
+            assert quota.reserve(db, user_id, 'pro', amount=100).id is None
+            
+            # Reserva renovada (lote ainda rodando) não vence
+            reserva = quota.reserve(db, user_id, 'free', amount=4, ttl=-1)
+            reserva.renew()
+            try:
+                quota.reserve(db, user_id, 'free')
+                assert False, "a reserva renovada deveria continuar ocupando as vagas"
+            except quota.QuotaExceeded:
+                pass
+            reserva.release()
+        finally:
+            db.close()
+
+def test_fila_de_geracoes_processa_cada_trabalho_uma_vez():
+    """Cada trabalho da fila é executado por um único worker e libera a reserva de cota"""
+    import time
+    import quota
+    from database import Database
+    from jobs import JobWorkerPool
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        db = Database(os.path.join(pasta, 'fila.db'))
+        executados = []
+        
+        def gerar(db, job, api_key):
+            executados.append(job['id'])
+            desc_id = db.save_description(job['user_id'], job['params']['nome_produto'], 'Geral', 'Casual',
+                                          '', 'Médio', 'default', f"texto de {api_key}", 'txt')
+            return {'ids': [desc_id], 'group_id': None, 'cache': False}
+        
+        pool = JobWorkerPool(db, workers=4, poll_interval=0.01, handler=gerar).start()
+        try:
+            user_id = db.add_user('fila@exemplo.com', 'x')
+            reserva = quota.reserve(db, user_id, 'free', amount=3)
+            trabalhos = [
+                pool.submit(user_id, {'nome_produto': f"Produto {i}"}, 'chave',
+                            reserva.id if i == 0 else None)
+                for i in range(20)
+            ]
+            
+            limite = time.monotonic() + 5
+            while db.get_active_jobs(user_id):
+                assert time.monotonic() < limite
+                time.sleep(0.01)
+            
+            assert sorted(executados) == sorted(trabalhos)
+            for job_id in trabalhos:
+                trabalho = pool.status(job_id, user_id)
+                assert trabalho['status'] == 'done'
+                assert db.get_description_text(trabalho['result']['ids'][0], user_id) == "texto de chave"
+            assert pool.status(trabalhos[0], user_id + 1) is None
+            assert db.get_quota_usage(user_id, quota.current_month())[1] == 0
+            
+            # Sem a chave da sessão o trabalho fica sem dono: sem a opção da chave do
+            # servidor ninguém o pega, e ele falha quando o prazo vence
+            sem_chave = pool.submit(user_id, {'nome_produto': 'Sem chave'})
+            time.sleep(0.1)
+            assert pool.status(sem_chave)['status'] == 'pending'
+            assert db.requeue_stale_jobs(-1, max_attempts=2) == (0, 1)
+            assert pool.status(sem_chave)['status'] == 'failed'
+            assert sem_chave not in executados
+            
+            # Trabalho lento com worker vivo mantém o heartbeat e não volta para a fila
+            pool.close()
+            
+            def lento(db, job, api_key):
+                time.sleep(1)
+                return gerar(db, job, api_key)
+            
+            pool = JobWorkerPool(db, workers=1, poll_interval=0.01, stale_after=0.3, handler=lento).start()
+            job_id = pool.submit(user_id, {'nome_produto': 'Lento'}, 'chave')
+            while db.get_active_jobs(user_id):
+                assert db.requeue_stale_jobs(0.3, max_attempts=1) == (0, 0)
+                time.sleep(0.05)
+            assert pool.status(job_id)['status'] == 'done'
+            assert pool.status(job_id)['attempts'] == 1
+            pool.close()
+            
+            # Trabalho preso em 'running' (dono que morreu) volta para a fila sem dono, e
+            # a reserva dele não vence enquanto isso; ao desistir, a reserva é liberada
+            outro = db.add_user('preso@exemplo.com', 'x')
+            reserva = quota.reserve(db, outro, 'free', amount=1, ttl=-1)
+            job_id = db.enqueue_job(outro, {'nome_produto': 'Preso'}, reserva.id, owner='morto')
+            assert db.claim_job('vivo') is None
+            assert db.claim_job('morto')['id'] == job_id
+            assert db.requeue_stale_jobs(60, max_attempts=2) == (0, 0)
+            assert db.requeue_stale_jobs(-1, max_attempts=2) == (1, 0)
+            quota.reserve(db, outro, 'free', amount=1).release()
+            assert db.get_quota_usage(outro, quota.current_month())[1] == 1
+            assert db.claim_job('morto') is None
+            assert db.claim_job('servidor', unowned=True)['attempts'] == 2
+            assert db.requeue_stale_jobs(-1, max_attempts=2) == (0, 1)
+            assert db.get_job(job_id)['status'] == 'failed'
+            assert db.get_quota_usage(outro, quota.current_month())[1] == 0
+        finally:
+            pool.close()
+            db.close()
+
+def test_fila_com_varios_processos_so_pega_trabalhos_que_consegue_executar():
+    """Cada pool só pega os trabalhos cuja chave guarda; sem dono, só quem usa a chave do servidor"""
+    import time
+    from database import Database
+    from jobs import JobWorkerPool
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        # Um banco por pool, como em processos separados
+        dbs = [Database(os.path.join(pasta, 'fila.db')) for _ in range(3)]
+        executados = {}
+        pools = []
+        chave_anterior = os.environ.get('GEMINI_API_KEY')
+        
+        def criar_pool(db, nome, server_key_fallback=False):
+            def gerar(db, job, api_key):
+                executados.setdefault(job['id'], []).append((nome, api_key))
+                return {'ids': [], 'group_id': None, 'cache': False}
+            pool = JobWorkerPool(db, workers=2, poll_interval=0.01, handler=gerar,
+                                 server_key_fallback=server_key_fallback).start()
+            pools.append(pool)
+            return pool
+        
+        def esperar(*trabalhos):
+            limite = time.monotonic() + 5
+            while any(dbs[0].get_job(job_id)['status'] in ('pending', 'running') for job_id in trabalhos):
+                assert time.monotonic() < limite
+                time.sleep(0.01)
+        
+        try:
+            os.environ['GEMINI_API_KEY'] = 'chave-do-servidor'
+            a, b = criar_pool(dbs[0], 'a'), criar_pool(dbs[1], 'b')
+            user_id = dbs[0].add_user('processos@exemplo.com', 'x')
+            de_a = [a.submit(user_id, {'nome_produto': f"A{i}"}, 'chave-a') for i in range(10)]
+            de_b = [b.submit(user_id, {'nome_produto': f"B{i}"}, 'chave-b') for i in range(10)]
+            sem_dono = a.submit(user_id, {'nome_produto': 'Sem chave'})
+            esperar(*de_a, *de_b)
+            
+            assert executados == {**{job_id: [('a', 'chave-a')] for job_id in de_a},
+                                  **{job_id: [('b', 'chave-b')] for job_id in de_b}}
+            assert all(dbs[0].get_job(job_id)['status'] == 'done' for job_id in de_a + de_b)
+            time.sleep(0.05)
+            assert dbs[0].get_job(sem_dono)['status'] == 'pending'
+            
+            # Worker externo com a chave do servidor pega o trabalho sem dono
+            criar_pool(dbs[2], 'externo', server_key_fallback=True)
+            esperar(sem_dono)
+            assert executados[sem_dono] == [('externo', 'chave-do-servidor')]
+        finally:
+            if chave_anterior is None:
+                os.environ.pop('GEMINI_API_KEY', None)
+            else:
+                os.environ['GEMINI_API_KEY'] = chave_anterior
+            for pool in pools:
+                pool.close()
+            for db in dbs:
+                db.close()
+
+def test_busca_acompanha_insercao_edicao_e_remocao():
+    """Busca textual: gatilhos do FTS, isolamento por usuário e destaque sem confundir com **"""
+    from database import Database
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        db = Database(os.path.join(pasta, 'busca.db'))
+        try:
+            dono = db.add_user('busca@exemplo.com', 'x')
+            outro = db.add_user('outro@exemplo.com', 'x')
+            salvar = lambda user_id, nome, palavras, texto: db.save_description(
+                user_id, nome, 'Casa', 'Casual', palavras, 'Curta (50 palavras)', 'default', texto, 'Markdown'
+            )
+            termica = salvar(dono, 'Caneca Térmica', 'café, inox', 'Mantém o **café** quente por horas.')
+            garrafa = salvar(dono, 'Garrafa', 'caneca, squeeze', 'Garrafa de aço para a academia.')
+            salvar(outro, 'Caneca Azul', 'cerâmica', 'Caneca de cerâmica azul.')
+            ids = lambda user_id, texto: [linha[0] for linha in db.search_descriptions(user_id, texto)]
+            
+            # Inserção: nome pesa mais que palavras-chave; cada usuário vê só as suas
+            assert ids(dono, 'caneca') == [termica, garrafa]
+            assert len(ids(outro, 'caneca')) == 1
+            assert ids(dono, 'garrafa academia') == [garrafa]
+            assert ids(dono, 'caneca "OR" user_id') == []
+            
+            # Acentos ignorados; ** do texto original escapado, termo destacado com **
+            trecho = db.search_descriptions(dono, 'cafe')[0][4]
+            assert '\\*\\***café**\\*\\*' in trecho
+            assert Database.SNIPPET_START not in trecho and Database.SNIPPET_END not in trecho
+            
+            # Edição: o índice troca os termos antigos pelos novos
+            db.cursor.execute("UPDATE descriptions SET product_name = 'Copo Térmico' WHERE id = ?", (termica,))
+            db.conn.commit()
+            assert ids(dono, 'caneca') == [garrafa]
+            assert ids(dono, 'copo') == [termica]
+            
+            # Remoção: some da busca (a descrição e o histórico inteiro)
+            db.cursor.execute('DELETE FROM descriptions WHERE id = ?', (garrafa,))
+            db.conn.commit()
+            assert ids(dono, 'caneca') == [] and ids(dono, 'squeeze') == []
+            db.clear_user_history(dono)
+            assert ids(dono, 'copo') == []
+            assert len(ids(outro, 'caneca')) == 1
+        finally:
+            db.close()
+
+def test_gravacao_em_grupo_mantem_estatisticas_e_grava_ao_fechar():
+    """Descrições gravadas por várias threads em lote batem com contadores e analytics"""
+    import threading
+    from database import Database
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, 'grupo.db')
+        anterior = {nome: os.environ.get(nome) for nome in ('DB_GROUP_COMMIT', 'DB_GROUP_COMMIT_LINGER_MS')}
+        os.environ.update(DB_GROUP_COMMIT='1', DB_GROUP_COMMIT_LINGER_MS='200')
+        try:
+            db = Database(caminho)
+        finally:
+            for nome, valor in anterior.items():
+                if valor is None:
+                    os.environ.pop(nome, None)
+                else:
+                    os.environ[nome] = valor
+        try:
+            assert db.writer is not None
+            usuarios = [db.add_user(f"grupo{i}@exemplo.com", 'x') for i in range(3)]
+            futuros, grupos = [], []
+            
+            def sessao(numero):
+                user_id = usuarios[numero % len(usuarios)]
+                for i in range(20):
+                    futuros.append(db.save_description_async(
+                        user_id, f"Produto {numero}-{i}", ('Casa', 'Moda')[i % 2], 'Casual', '',
+                        'Curta (50 palavras)', 'default', 'texto', 'Texto simples', 'gemini-2.5-flash'
+                    ))
+                grupos.append(db.save_description_group(
+                    user_id, f"Variantes {numero}", 'Casa', 'Casual', '', 'Curta (50 palavras)',
+                    'default', ['a', 'b', 'c'], 'Texto simples', 'gemini-2.5-flash'
+                ))
+            
+            threads = [threading.Thread(target=sessao, args=(n,)) for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            
+            # Fechar grava o que ainda espera na fila (a thread aguardaria 200 ms por mais)
+            futuros += [db.save_description_async(usuarios[0], f"Último {i}", 'Casa', 'Casual', '',
+                                                   'Curta (50 palavras)', 'default', 'texto', 'Texto simples')
+                        for i in range(5)]
+            assert not futuros[-1].done()
+            db.close()
+            assert all(futuro.done() for futuro in futuros)
+            ids = [futuro.result() for futuro in futuros] + [i for _, lista in grupos for i in lista]
+            assert len(ids) == len(set(ids)) == 8 * 23 + 5
+        finally:
+            db.close()
+        
+        db = Database(caminho)
+        try:
+            for user_id in usuarios:
+                descricoes = db.cursor.execute('SELECT COUNT(*) FROM descriptions WHERE user_id = ?',
+                                               (user_id,)).fetchone()[0]
+                contadores = db.cursor.execute('SELECT lifetime_count, month_count FROM usage_counters '
+                                               'WHERE user_id = ?', (user_id,)).fetchone()
+                total = db.cursor.execute('SELECT total_descriptions FROM analytics WHERE user_id = ?',
+                                          (user_id,)).fetchone()[0]
+                diarios = db.cursor.execute('SELECT SUM(count) FROM analytics_daily WHERE user_id = ?',
+                                            (user_id,)).fetchone()[0]
+                assert descricoes > 0
+                assert contadores == (descricoes, descricoes)
+                assert total == diarios == descricoes
+        finally:
+            db.close()
+
+def test_migracoes_concorrentes_aplicam_cada_versao_uma_vez():
+    """Vários processos abrindo um banco novo ao mesmo tempo não repetem migrações"""
+    import multiprocessing
+    import sqlite3
+    import migrations
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, 'migracoes.db')
+        contexto = multiprocessing.get_context('spawn')
+        processos = [contexto.Process(target=_abrir_banco, args=(caminho,)) for _ in range(4)]
+        for processo in processos:
+            processo.start()
+        for processo in processos:
+            processo.join(60)
+        
+        assert [p.exitcode for p in processos] == [0] * 4
+        conn = sqlite3.connect(caminho)
+        try:
+            versoes = [row[0] for row in conn.execute('SELECT version FROM schema_version ORDER BY version')]
+            assert versoes == [m[0] for m in migrations.MIGRATIONS]
+            assert conn.execute('SELECT COUNT(*) FROM schema_lock').fetchone()[0] == 0
+            assert migrations.verify(conn) == []
+        finally:
+            conn.close()
+
+def test_migracao_de_contadores_conta_geracoes_feitas_durante_o_preenchimento():
+    """Geração gravada entre a criação de usage_counters e o preenchimento não some da contagem"""
+    import sqlite3
+    import migrations
+    
+    class _ConexaoComGeracao(sqlite3.Connection):
+        """Grava uma geração por outra conexão logo que a tabela fica visível"""
+        gerou = False
+        
+        def commit(self):
+            super().commit()
+            if _ConexaoComGeracao.gerou or not migrations.table_exists(self, 'usage_counters'):
+                return
+            _ConexaoComGeracao.gerou = True
+            outra = sqlite3.connect(caminho)
+            try:
+                # O que a aplicação grava ao ver a tabela nova
+                outra.execute("INSERT INTO descriptions (user_id, product_name, category, tone, description) "
+                              "VALUES (1, 'Nova', 'Outros', 'Casual', 'texto')")
+                outra.execute('''
+                    INSERT INTO usage_counters (user_id, lifetime_count, month, month_count)
+                    VALUES (1, 1, strftime('%Y-%m', 'now'), 1)
+                    ON CONFLICT(user_id) DO UPDATE SET lifetime_count = lifetime_count + 1,
+                                                       month_count = month_count + 1
+                ''')
+                outra.commit()
+            finally:
+                outra.close()
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, 'contadores.db')
+        conn = sqlite3.connect(caminho, factory=_ConexaoComGeracao)
+        try:
+            _ConexaoComGeracao.gerou = True
+            migrations.migrate(conn, target=4, log=lambda *_: None)
+            conn.execute("INSERT INTO users (email, password_hash) VALUES ('contador@exemplo.com', 'x')")
+            conn.executemany("INSERT INTO descriptions (user_id, product_name, category, tone, description) "
+                             "VALUES (1, ?, 'Outros', 'Casual', 'texto')", [(f"Produto {i}",) for i in range(3)])
+            conn.commit()
+            
+            _ConexaoComGeracao.gerou = False
+            migrations.migrate(conn, target=5, log=lambda *_: None)
+            assert _ConexaoComGeracao.gerou
+            assert conn.execute('SELECT lifetime_count, month_count FROM usage_counters WHERE user_id = 1').fetchone() == (4, 4)
+        finally:
+            conn.close()
+
+def test_lote_retomado_nao_duplica_descricoes():
+    """Linha salva no banco antes de chegar ao diário não é gerada nem salva de novo"""
+    import batch
+    import quota
+    from database import Database
+    from generator import criar_prompt
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        db = Database(os.path.join(pasta, 'lote.db'))
+        caminho_saida = os.path.join(pasta, 'lote.resultados.jsonl')
+        try:
+            user_id = db.add_user('lote@exemplo.com', 'x')
+            produtos = [(linha, batch.normalizar_produto({'nome': f"Produto {linha}"})) for linha in (1, 2)]
+            
+            # Queda entre o banco e o diário na linha 1
+            lote_id = batch.identificador_lote(caminho_saida)
+            salva = db.save_batch_description(user_id, lote_id, 1, 'Produto 1', 'Outros', 'Persuasivo/Vendedor',
+                                              '', 'Média (150 palavras)', 'default', 'texto 1', 'Texto simples')
+            assert db.save_batch_description(user_id, lote_id, 1, 'Produto 1', 'Outros', 'Persuasivo/Vendedor',
+                                             '', 'Média (150 palavras)', 'default', 'outro', 'Texto simples') == salva
+            
+            # A linha 2 sai do cache, sem chamar a IA
+            produto = produtos[1][1]
+            prompt = criar_prompt(produto['nome_produto'], produto['categoria'], produto['tom'],
+                                  produto['palavras_chave'], produto['tamanho'], produto['incluir_hashtags'],
+                                  produto['template'], produto['incluir_especificacoes'])
+            db.save_cached_generation(db.make_cache_key(prompt.completo(), 'gemini-2.5-flash', 0.7),
+                                      'gemini-2.5-flash', 0.7, 'texto 2')
+            
+            # Reserva já vencida: o lote a renova a cada linha concluída (TTL zero no teste)
+            ttl_anterior = quota.RESERVATION_TTL
+            quota.RESERVATION_TTL = 0
+            try:
+                reserva = quota.reserve(db, user_id, 'free', amount=3, ttl=-1)
+                renovacoes = []
+                renovar = reserva.renew
+                reserva.renew = lambda ttl=None: (renovacoes.append(ttl), renovar(60))
+                resumo = batch.processar_lote(db, user_id, produtos, caminho_saida, 'chave', 'gemini-2.5-flash',
+                                              reserva=reserva)
+            finally:
+                quota.RESERVATION_TTL = ttl_anterior
+            assert (resumo['pulados'], resumo['processados'], resumo['cache']) == (1, 1, 1)
+            assert batch.carregar_concluidas(caminho_saida) == {1, 2}
+            assert db.get_usage(user_id)['lifetime'] == 2
+            assert renovacoes
+            try:
+                quota.reserve(db, user_id, 'free')
+                assert False, "a reserva renovada pelo lote deveria continuar ocupando as vagas"
+            except quota.QuotaExceeded:
+                pass
+            reserva.release()
+            
+            resumo = batch.processar_lote(db, user_id, produtos, caminho_saida, 'chave', 'gemini-2.5-flash')
+            assert (resumo['pulados'], resumo['processados']) == (2, 0)
+            assert sorted(db.get_batch_lines(user_id, lote_id)) == [1, 2]
+            assert db.get_usage(user_id)['lifetime'] == 2
+        finally:
+            db.close()
+
+def test_limites_de_taxa_esperam_a_janela_com_relogio_falso():
+    """RateLimiter e KeyScheduler esperam só o necessário para caber no RPM/TPM"""
+    import asyncio
+    from types import SimpleNamespace
+    import gemini_pool
+    
+    relogio = _RelogioFalso()
+    time_anterior, asyncio_anterior = gemini_pool.time, gemini_pool.asyncio
+    gemini_pool.time = SimpleNamespace(monotonic=relogio.monotonic)
+    gemini_pool.asyncio = SimpleNamespace(Lock=asyncio.Lock, Semaphore=asyncio.Semaphore, sleep=relogio.sleep)
+    
+    async def cenario():
+        # RPM: a quarta requisição espera a primeira sair da janela de 60 s
+        limitador = gemini_pool.RateLimiter(rpm=3, tpm=10 ** 6)
+        for _ in range(3):
+            await limitador.acquire(10)
+            relogio.agora += 10
+        assert relogio.esperas == []
+        await limitador.acquire(10)
+        assert relogio.esperas == [30.0]
+        
+        # TPM: o consumo real (settle) libera orçamento; acima dele, espera
+        relogio.esperas.clear()
+        limitador = gemini_pool.RateLimiter(rpm=100, tpm=1000)
+        primeira = await limitador.acquire(600)
+        relogio.agora += 5
+        await limitador.acquire(300)
+        relogio.agora += 5
+        limitador.settle(primeira, 100)
+        await limitador.acquire(500)
+        assert relogio.esperas == []
+        await limitador.acquire(200)
+        assert relogio.esperas == [50.0]
+        
+        # Janela vazia: um pedido maior que o TPM sozinho passa sem esperar
+        relogio.agora += 60
+        await limitador.acquire(5000)
+        assert relogio.esperas == [50.0]
+        
+        # Agendador: uma chamada por vez e a terceira espera o RPM
+        relogio.esperas.clear()
+        agendador = gemini_pool.KeyScheduler(rpm=2, tpm=10 ** 6, max_concurrency=1)
+        ativas, maximo = 0, 0
+        
+        async def chamada():
+            nonlocal ativas, maximo
+            ativas += 1
+            maximo = max(maximo, ativas)
+            await asyncio.sleep(0)
+            ativas -= 1
+            return SimpleNamespace(usage_metadata=SimpleNamespace(total_token_count=5))
+        
+        await asyncio.gather(*(agendador.run(100, chamada) for _ in range(3)))
+        assert maximo == 1 and relogio.esperas == [60.0]
+        assert agendador.queue_depth == 0 and agendador.limiter._tokens == 5
+    
+    try:
+        asyncio.run(cenario())
+    finally:
+        gemini_pool.time, gemini_pool.asyncio = time_anterior, asyncio_anterior
+
+def test_resiliencia_repete_troca_de_modelo_e_abre_disjuntor():
+    """Falha transitória é repetida, modelo indisponível cai no próximo e o disjuntor abre"""
+    from gemini_pool import GeminiPool
+    from gemini_stub import start_stub
+    from resilience import CircuitBreaker, CircuitOpenError, ResilientCaller, RetryPolicy
+    
+    politica = RetryPolicy(max_attempts=2, base_delay=0.01, max_delay=0.01,
+                           failure_threshold=2, reset_timeout=60)
+    base_url_anterior = os.environ.get('GEMINI_BASE_URL')
+    servidor, estado, base_url = start_stub(falhas=1, indisponiveis=['gemini-2.5-flash'])
+    servidor_404, estado_404, base_url_404 = start_stub(indisponiveis=['gemini-2.5-flash'], status_falha=404)
+    pools = []
+    
+    def criar_pool(url):
+        os.environ['GEMINI_BASE_URL'] = url
+        pool = GeminiPool(rpm=1000, tpm=10 ** 7, max_concurrency=4)
+        pool.resilience = ResilientCaller(politica)
+        pool.get_client('chave')
+        pools.append(pool)
+        return pool
+    
+    try:
+        pool = criar_pool(base_url)
+        # 503 duas vezes no modelo pedido (abre o disjuntor); no fallback, uma falha e um acerto
+        texto, modelo = pool.generate('chave', 'gemini-2.5-flash', 'Olá', timeout=30)
+        assert texto and modelo == 'gemini-2.0-flash'
+        assert estado.requisicoes == ['gemini-2.5-flash'] * 2 + ['gemini-2.0-flash'] * 2
+        assert pool.stats()['modelos']['gemini-2.5-flash'] == 'aberto'
+        
+        # Disjuntor aberto: nem tenta o modelo pedido
+        estado.requisicoes.clear()
+        assert pool.generate('chave', 'gemini-2.5-flash', 'Olá', timeout=30)[1] == 'gemini-2.0-flash'
+        assert estado.requisicoes == ['gemini-2.0-flash']
+        try:
+            pool.generate('chave', 'gemini-2.5-flash', 'Olá', timeout=30, fallback=False)
+            assert False, "deveria recusar com o disjuntor aberto"
+        except CircuitOpenError:
+            pass
+        
+        # 404 (modelo inexistente) não é repetido, mas passa para o próximo modelo
+        pool = criar_pool(base_url_404)
+        assert pool.generate('chave', 'gemini-2.5-flash', 'Olá', timeout=30)[1] == 'gemini-2.0-flash'
+        assert estado_404.requisicoes == ['gemini-2.5-flash', 'gemini-2.0-flash']
+        assert pool.stats()['modelos']['gemini-2.5-flash'] == 'fechado'
+        
+        # Meio-aberto: uma única chamada de teste por vez
+        disjuntor = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        disjuntor.record_failure()
+        assert disjuntor.allow() and not disjuntor.allow()
+        disjuntor.record_success()
+        assert disjuntor.allow() and disjuntor.allow()
+    finally:
+        for pool in pools:
+            pool.close()
+        servidor.shutdown()
+        servidor_404.shutdown()
+        if base_url_anterior is None:
+            os.environ.pop('GEMINI_BASE_URL', None)
+        else:
+            os.environ['GEMINI_BASE_URL'] = base_url_anterior
+
+def test_cache_de_geracoes_normaliza_expira_e_descarta_as_menos_usadas():
+    """Cache das gerações nos caminhos síncrono e assíncrono: espaços, TTL, limite LRU e nova versão"""
+    import asyncio
+    import time
+    import batch
+    import resources
+    from database import Database
+    from gemini_pool import GeminiPool
+    from gemini_stub import TEXTO_PADRAO, start_stub
+    from generator import PEDIDO_PADRAO, gerar_descricao, gerar_e_salvar_async, prompt_do_pedido
+    
+    base_url_anterior = os.environ.get('GEMINI_BASE_URL')
+    servidor, estado, base_url = start_stub()
+    os.environ['GEMINI_BASE_URL'] = base_url
+    registro_anterior = resources.registry
+    resources.registry = resources.ResourceRegistry()
+    resources.registry.register('gemini_pool', GeminiPool, close=lambda pool: pool.close())
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        db = Database(os.path.join(pasta, 'cache.db'))
+        try:
+            user_id = db.add_user('cache@exemplo.com', 'x')
+            pedido = {**batch.normalizar_produto({'nome_produto': 'Caneca'}), **PEDIDO_PADRAO}
+            prompt = prompt_do_pedido(pedido)
+            gerar = lambda p, **opcoes: gerar_descricao(db, 'chave', pedido['modelo'], p,
+                                                         pedido['temperatura'], **opcoes)
+            
+            # Espaços e quebras de linha diferentes caem na mesma entrada
+            assert gerar(prompt) == (TEXTO_PADRAO, False, pedido['modelo'])
+            assert gerar(prompt.com_texto("\n\n   ")) == (TEXTO_PADRAO, True, pedido['modelo'])
+            assert asyncio.run(gerar_e_salvar_async(db, user_id, pedido, 'chave'))['cache']
+            assert len(estado.requisicoes) == 1
+            
+            # Nova versão forçada não lê o cache, nos dois caminhos
+            assert not gerar(prompt, forcar_nova_versao=True)[1]
+            novo = {**pedido, 'forcar_nova_versao': True}
+            assert not asyncio.run(gerar_e_salvar_async(db, user_id, novo, 'chave'))['cache']
+            assert len(estado.requisicoes) == 3
+            
+            # Entrada vencida não é usada e sai do banco
+            db.cache_ttl = -1
+            assert not gerar(prompt)[1]
+            assert db.cursor.execute('SELECT COUNT(*) FROM generation_cache').fetchone()[0] == 0
+            db.cache_ttl = 3600
+            
+            # Acima do limite sai a entrada acessada há mais tempo
+            db.cache_max_entries = 2
+            prompts = [prompt.com_texto(f" {i}") for i in range(3)]
+            for p in (prompts[0], prompts[1], prompts[0], prompts[2]):
+                gerar(p)
+                time.sleep(0.01)
+            assert db.cursor.execute('SELECT COUNT(*) FROM generation_cache').fetchone()[0] == 2
+            assert gerar(prompts[0])[1] and gerar(prompts[2])[1]
+            assert not gerar(prompts[1])[1]
+        finally:
+            db.close()
+            resources.registry.shutdown()
+            resources.registry = registro_anterior
+            servidor.shutdown()
+            if base_url_anterior is None:
+                os.environ.pop('GEMINI_BASE_URL', None)
+            else:
+                os.environ['GEMINI_BASE_URL'] = base_url_anterior
+
+def test_fila_grava_texto_parcial_do_streaming():
+    """O worker grava no trabalho o texto que chega em streaming; ao terminar, o parcial é limpo"""
+    import time
+    import batch
+    import jobs
+    import resources
+    from database import Database
+    from gemini_pool import GeminiPool
+    from gemini_stub import TEXTO_PADRAO, start_stub
+    from generator import PEDIDO_PADRAO
+    
+    base_url_anterior = os.environ.get('GEMINI_BASE_URL')
+    servidor, estado, base_url = start_stub()
+    os.environ['GEMINI_BASE_URL'] = base_url
+    registro_anterior, intervalo_anterior = resources.registry, jobs.PARTIAL_INTERVAL
+    resources.registry = resources.ResourceRegistry()
+    resources.registry.register('gemini_pool', GeminiPool, close=lambda pool: pool.close())
+    jobs.PARTIAL_INTERVAL = 0
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        db = Database(os.path.join(pasta, 'parcial.db'))
+        parciais = []
+        gravar_parcial = db.update_job_partial
+        
+        def registrar_parcial(job_id, texto):
+            gravado = gravar_parcial(job_id, texto)
+            parciais.append((texto, db.get_job(job_id)['partial']))
+            return gravado
+        
+        db.update_job_partial = registrar_parcial
+        pool = jobs.JobWorkerPool(db, workers=1, poll_interval=0.01).start()
+        try:
+            user_id = db.add_user('parcial@exemplo.com', 'x')
+            pedido = {**batch.normalizar_produto({'nome_produto': 'Caneca'}), **PEDIDO_PADRAO}
+            job_id = pool.submit(user_id, pedido, 'chave')
+            
+            limite = time.monotonic() + 30
+            while db.get_active_jobs(user_id):
+                assert time.monotonic() < limite
+                time.sleep(0.01)
+            
+            trabalho = pool.status(job_id)
+            assert trabalho['status'] == 'done', trabalho['error']
+            assert trabalho['partial'] is None
+            assert len(parciais) == len(TEXTO_PADRAO.split(' '))
+            assert all(texto == lido and TEXTO_PADRAO.startswith(texto) for texto, lido in parciais)
+            assert db.get_description_text(trabalho['result']['ids'][0], user_id)
+        finally:
+            pool.close()
+            db.close()
+            resources.registry.shutdown()
+            resources.registry, jobs.PARTIAL_INTERVAL = registro_anterior, intervalo_anterior
+            servidor.shutdown()
+            if base_url_anterior is None:
+                os.environ.pop('GEMINI_BASE_URL', None)
+            else:
+                os.environ['GEMINI_BASE_URL'] = base_url_anterior
+
+def test_api_autentica_gera_pagina_e_busca():
+    """Rotas da API: autenticação, geração, lote, páginas do histórico e busca"""
+    import resources
+    from database import Database
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        db = Database(os.path.join(pasta, 'api.db'))
+        pool = _PoolFalso()
+        registro_anterior = resources.registry
+        resources.registry = resources.ResourceRegistry()
+        resources.registry.register('database', lambda: db)
+        resources.registry.register('gemini_pool', lambda: pool)
+        chave_anterior = os.environ.get('GEMINI_API_KEY')
+        try:
+            gratis = db.add_user('gratis@exemplo.com', 'x')
+            empresa = db.add_user('empresa@exemplo.com', 'x', plan='enterprise')
+            outra = db.add_user('outra@exemplo.com', 'x', plan='enterprise')
+            bearer = {'authorization': f"Bearer {db.create_api_key(empresa)}"}
+            autenticado = {**bearer, 'x-gemini-api-key': 'chave-gemini'}
+            
+            # Autenticação: sem chave, chave inválida e plano sem API
+            assert _chamar_api('GET', '/v1/history')[0] == 401
+            assert _chamar_api('GET', '/v1/history', cabecalhos={'authorization': 'Bearer dia_x'})[0] == 401
+            assert _chamar_api('GET', '/v1/history',
+                               cabecalhos={'authorization': f"Bearer {db.create_api_key(gratis)}"})[0] == 403
+            
+            # Sem X-Gemini-Api-Key a chave do servidor não é usada (sem opt-in)
+            os.environ['GEMINI_API_KEY'] = 'chave-do-servidor'
+            assert _chamar_api('POST', '/v1/generate', {'nome_produto': 'Caneca'}, bearer)[0] == 400
+            assert pool.chamadas == []
+            
+            status, corpo = _chamar_api('POST', '/v1/generate', {'nome_produto': 'Caneca azul'}, autenticado)
+            assert status == 200 and len(corpo['ids']) == 1 and not corpo['cache']
+            assert corpo['modelo'] == 'gemini-2.5-flash' and corpo['descricoes'][0]
+            assert pool.chamadas == ['chave-gemini']
+            
+            # Lote: produto inválido recusa a requisição inteira; depois, um resultado por produto
+            lote = {'produtos': [{'nome_produto': 'Mochila escolar'}, {'nome_produto': 'Garrafa'}, {}]}
+            assert _chamar_api('POST', '/v1/generate/batch', lote, autenticado)[0] == 400
+            lote['produtos'][2] = {'nome': 'Luminária'}
+            status, corpo = _chamar_api('POST', '/v1/generate/batch', lote, autenticado)
+            assert status == 200 and corpo['resumo'] == {'processados': 3, 'cache': 0, 'erros': 0}
+            assert [item['nome_produto'] for item in corpo['resultados']] == ['Mochila escolar', 'Garrafa', 'Luminária']
+            
+            # Histórico: 4 descrições em páginas de 2; a última página não tem cursor
+            vistos = []
+            cursor = None
+            for _ in range(2):
+                status, corpo = _chamar_api('GET', '/v1/history', cabecalhos=bearer,
+                                            query={'limit': 2, **({'cursor': cursor} if cursor else {})})
+                assert status == 200 and len(corpo['descricoes']) == 2
+                vistos += [item['id'] for item in corpo['descricoes']]
+                cursor = corpo['proximo_cursor']
+            assert cursor is None
+            assert len(set(vistos)) == 4 and vistos == sorted(vistos, reverse=True)
+            assert _chamar_api('GET', '/v1/history', cabecalhos=bearer, query={'limit': 4})[1]['proximo_cursor'] is None
+            assert _chamar_api('GET', '/v1/history', cabecalhos=bearer, query={'limit': 3})[1]['proximo_cursor']
+            assert _chamar_api('GET', '/v1/history', cabecalhos=bearer, query={'cursor': 'x'})[0] == 400
+            outra_bearer = {'authorization': f"Bearer {db.create_api_key(outra)}"}
+            assert _chamar_api('GET', '/v1/history', cabecalhos=outra_bearer)[1] == \
+                {'descricoes': [], 'proximo_cursor': None}
+            
+            # Descrição completa só para o dono
+            assert _chamar_api('GET', f"/v1/descriptions/{vistos[0]}", cabecalhos=bearer)[0] == 200
+            assert _chamar_api('GET', f"/v1/descriptions/{vistos[0]}", cabecalhos=outra_bearer)[0] == 404
+            
+            # Busca
+            status, corpo = _chamar_api('GET', '/v1/search', cabecalhos=bearer, query={'q': 'mochila'})
+            assert status == 200 and [item['product_name'] for item in corpo['resultados']] == ['Mochila escolar']
+            assert _chamar_api('GET', '/v1/search', cabecalhos=outra_bearer, query={'q': 'mochila'})[1] == \
+                {'resultados': []}
+            assert _chamar_api('GET', '/v1/search', cabecalhos=bearer)[0] == 400
+        finally:
+            if chave_anterior is None:
+                os.environ.pop('GEMINI_API_KEY', None)
+            else:
+                os.environ['GEMINI_API_KEY'] = chave_anterior
+            resources.registry = registro_anterior
+            db.close()
+
+def test_login_refaz_hash_e_limita_tentativas():
+    """Hash antigo ou de custo desatualizado é refeito no login; limites de tentativas e cache"""
+    import hashlib
+    import time
+    from contextlib import contextmanager
+    import credentials
+    from credentials import LoginLimiter, TooManyAttempts, VerificationCache
+    from database import Database
+    
+    class LimiterEspiao(LoginLimiter):
+        """Marca quando o código roda dentro de uma vaga do limitador"""
+        dentro = False
+        
+        @contextmanager
+        def attempt(self, email):
+            with super().attempt(email):
+                self.dentro = True
+                try:
+                    yield
+                finally:
+                    self.dentro = False
+    
+    kdf_anterior, params_anterior = credentials.KDF, credentials.KDF_PARAMS
+    hash_original = credentials.hash_password
+    limiter = LimiterEspiao(max_per_minute=100, max_concurrent=2, max_failures=3, failure_window=60)
+    rehash_dentro = []
+    
+    def hash_espiao(*args, **kwargs):
+        rehash_dentro.append(limiter.dentro)
+        return hash_original(*args, **kwargs)
+    
+    # Custo baixo para o teste ser rápido
+    credentials.KDF = 'pbkdf2_sha256'
+    credentials.KDF_PARAMS = {**params_anterior, 'pbkdf2_sha256': (1000,)}
+    credentials.hash_password = hash_espiao
+    with tempfile.TemporaryDirectory() as pasta:
+        db = Database(os.path.join(pasta, 'login.db'))
+        try:
+            # SHA-256 sem sal (legado) vira o KDF atual no primeiro login, dentro da vaga
+            user_id = db.add_user('legado@exemplo.com', hashlib.sha256(b'segredo').hexdigest())
+            
+            def entrar(senha):
+                return credentials.authenticate(db, 'legado@exemplo.com', senha, limiter, VerificationCache(ttl=0))
+            
+            assert entrar('segredo')['id'] == user_id
+            novo = db.get_credentials('legado@exemplo.com')[2]
+            assert novo.startswith('pbkdf2_sha256$1000$') and not credentials.needs_rehash(novo)
+            assert credentials.verify_password('segredo', novo) and not credentials.verify_password('outra', novo)
+            assert rehash_dentro == [True]
+            
+            # Custo alterado: o hash precisa ser refeito e é trocado no próximo login
+            credentials.KDF_PARAMS = {**credentials.KDF_PARAMS, 'pbkdf2_sha256': (2000,)}
+            assert credentials.needs_rehash(novo)
+            assert entrar('segredo')['id'] == user_id
+            assert db.get_credentials('legado@exemplo.com')[2].startswith('pbkdf2_sha256$2000$')
+            assert rehash_dentro == [True, True]
+            assert not credentials.needs_rehash(credentials.hash_password('x', 'pbkdf2_sha256'))
+            assert credentials.needs_rehash(credentials.hash_password('x', 'scrypt', (2 ** 10, 8, 1)))
+            
+            # Falhas seguidas bloqueiam o email (e só ele), mesmo com a senha certa
+            for _ in range(3):
+                assert entrar('errada') is None
+            try:
+                entrar('segredo')
+                assert False, "deveria bloquear após 3 falhas"
+            except TooManyAttempts as e:
+                assert 1 <= e.retry_after <= 60
+            with limiter.attempt('outro@exemplo.com'):
+                pass
+            
+            # Orçamento global de verificações por minuto, para todos os emails
+            limite_global = LoginLimiter(max_per_minute=2, max_concurrent=2, max_failures=5, failure_window=60)
+            for email in ('a@exemplo.com', 'b@exemplo.com'):
+                with limite_global.attempt(email):
+                    pass
+            try:
+                with limite_global.attempt('c@exemplo.com'):
+                    pass
+                assert False, "deveria recusar acima do limite por minuto"
+            except TooManyAttempts:
+                pass
+            
+            # Cache de verificações vence após o TTL
+            cache = VerificationCache(ttl=0.05)
+            cache.add(novo, 'segredo')
+            assert cache.hit(novo, 'segredo') and not cache.hit(novo, 'outra')
+            time.sleep(0.06)
+            assert not cache.hit(novo, 'segredo')
+            desligado = VerificationCache(ttl=0)
+            desligado.add(novo, 'segredo')
+            assert not desligado.hit(novo, 'segredo')
+        finally:
+            credentials.KDF, credentials.KDF_PARAMS = kdf_anterior, params_anterior
+            credentials.hash_password = hash_original
+            db.close()
+
+def test_separar_variantes_descarta_preambulo_e_avisa_quando_faltam():
+    """A resposta das variantes é dividida pelo marcador, sem o texto antes do primeiro"""
+    import contextlib
+    import io
+    from generator import SEPARADOR_VARIANTES as SEP, separar_variantes
+    
+    def separar(texto, quantidade):
+        saida = io.StringIO()
+        with contextlib.redirect_stdout(saida):
+            partes = separar_variantes(texto, quantidade)
+        return partes, saida.getvalue()
+    
+    # Preâmbulo antes do primeiro marcador
+    assert separar(f"Aqui estão as versões:\n{SEP}\nA\n{SEP}\nB", 2) == (['A', 'B'], '')
+    
+    # Marcador ausente: uma variante só, com aviso
+    partes, aviso = separar("Texto único", 3)
+    assert partes == ['Texto único'] and '1 de 3' in aviso
+    
+    # Marcador só no fim: o texto antes dele é a variante
+    partes, aviso = separar(f"A\n{SEP}\n", 2)
+    assert partes == ['A'] and '1 de 2' in aviso
+    
+    # Mais partes que o pedido: ficam as primeiras
+    assert separar(f"{SEP}\nA\n{SEP}\nB\n{SEP}\nC", 2) == (['A', 'B'], '')
+
+def test_renderizador_escapa_html_e_reaproveita_o_cache():
+    """Markdown para HTML: escape, listas mistas, negrito com itálico e cache LRU"""
+    import renderer
+    from renderer import markdown_to_html
+    
+    # HTML do texto vira texto (tags e atributos), inclusive dentro de negrito e listas
+    assert markdown_to_html('<script>alert(1)</script> **<b>oi</b>**') == (
+        '<p>&lt;script&gt;alert(1)&lt;/script&gt; <strong>&lt;b&gt;oi&lt;/b&gt;</strong></p>'
+    )
+    html = markdown_to_html('- <img src=x onerror="alert(1)"> #promo"><script>')
+    assert '<img' not in html and '<script' not in html
+    assert "<span class='hashtag'>#promo</span>\"&gt;&lt;script&gt;" in html
+    
+    # Troca de lista com ou sem número fecha a anterior; numeração preservada
+    assert markdown_to_html('- a\n* b\n3. c\n4) d\n• e\nfim') == (
+        '<ul>\n<li>a</li>\n<li>b</li>\n</ul>\n<ol start="3">\n<li>c</li>\n<li>d</li>\n</ol>\n'
+        '<ul>\n<li>e</li>\n</ul>\n<p>fim</p>'
+    )
+    
+    # Itálico dentro do negrito, os dois juntos e marcadores soltos
+    assert markdown_to_html('**muito *bom* mesmo**') == '<p><strong>muito <em>bom</em> mesmo</strong></p>'
+    assert markdown_to_html('***tudo***') == '<p><strong><em>tudo</em></strong></p>'
+    assert markdown_to_html('*leve* e **ab') == '<p><em>leve</em> e **ab</p>'
+    assert markdown_to_html('5 * 3 * 2') == '<p>5 * 3 * 2</p>'
+    
+    # Cache: repetir devolve o mesmo resultado; acima do limite sai o menos usado
+    limite_anterior = renderer.CACHE_MAX_ENTRIES
+    renderer.CACHE_MAX_ENTRIES = 2
+    renderer.clear_cache()
+    try:
+        primeiro, segundo = markdown_to_html('**a**'), markdown_to_html('**b**')
+        assert markdown_to_html('**a**') is primeiro
+        markdown_to_html('**c**')
+        assert len(renderer._cache) == 2
+        assert markdown_to_html('**a**') is primeiro
+        assert markdown_to_html('**b**') is not segundo and markdown_to_html('**b**') == segundo
+    finally:
+        renderer.CACHE_MAX_ENTRIES = limite_anterior
+        renderer.clear_cache()
+
+def _abrir_banco(caminho):
+    from database import Database
+    Database(caminho).close()
+
+class _RelogioFalso:
+    """Relógio de teste: dormir avança o tempo na hora e registra a espera"""
+    
+    def __init__(self):
+        self.agora = 1000.0
+        self.esperas = []
+    
+    def monotonic(self):
+        return self.agora
+    
+    async def sleep(self, segundos):
+        import asyncio
+        self.esperas.append(segundos)
+        self.agora += segundos
+        await asyncio.sleep(0)
+
+class _PoolFalso:
+    """Pool Gemini de teste: responde na hora, sem rede"""
+    
+    def __init__(self):
+        self.chamadas = []
+    
+    def submit(self, api_key, modelo, prompt, config=None, **opcoes):
+        from concurrent.futures import Future
+        from types import SimpleNamespace
+        self.chamadas.append(api_key)
+        futuro = Future()
+        futuro.set_result((modelo, SimpleNamespace(text=f"Descrição {len(self.chamadas)} de teste")))
+        return futuro
+
+def _chamar_api(metodo, caminho, corpo=None, cabecalhos=None, query=None):
+    """Faz uma requisição à aplicação ASGI da API; retorna (status, corpo JSON)"""
+    import asyncio
+    import json
+    from urllib.parse import urlencode
+    import api
+    
+    dados = json.dumps(corpo).encode('utf-8') if corpo is not None else b''
+    scope = {
+        'type': 'http', 'method': metodo, 'path': caminho,
+        'query_string': urlencode(query or {}).encode('utf-8'),
+        'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in (cabecalhos or {}).items()],
+    }
+    enviados = []
+    
+    async def receive():
+        return {'type': 'http.request', 'body': dados, 'more_body': False}
+    
+    async def send(mensagem):
+        enviados.append(mensagem)
+    
+    asyncio.run(api.app(scope, receive, send))
+    return enviados[0]['status'], json.loads(enviados[1]['body'])
+
+if __name__ == '__main__':
+    print("\n🔍 Auditando planos de consulta...")
+    test_consultas_frequentes_usam_indices()
+    print("\n📄 Testando a paginação do histórico...")
+    test_paginacao_do_historico_sem_repetir_nem_pular_com_datas_iguais()
+    print("\n📦 Testando exportação e importação do histórico...")
+    test_exportacao_e_importacao_ida_e_volta_sem_duplicar()
+    print("\n💳 Testando pagamentos...")
+    test_pagamento_idempotente_muda_plano_uma_vez()
+    print("\n🎟️ Testando reserva de cota...")
+    test_reserva_de_cota_concorrente_respeita_limite()
+    print("\n👷 Testando a fila de gerações...")
+    test_fila_de_geracoes_processa_cada_trabalho_uma_vez()
+    test_fila_com_varios_processos_so_pega_trabalhos_que_consegue_executar()
+    print("\n🔎 Testando a busca no histórico...")
+    test_busca_acompanha_insercao_edicao_e_remocao()
+    print("\n✍️ Testando a gravação em grupo...")
+    test_gravacao_em_grupo_mantem_estatisticas_e_grava_ao_fechar()
+    print("\n🗂️ Testando migrações concorrentes...")
+    test_migracoes_concorrentes_aplicam_cada_versao_uma_vez()
+    test_migracao_de_contadores_conta_geracoes_feitas_durante_o_preenchimento()
+    print("\n📦 Testando retomada de lote...")
+    test_lote_retomado_nao_duplica_descricoes()
+    print("\n⏱️ Testando limites de taxa...")
+    test_limites_de_taxa_esperam_a_janela_com_relogio_falso()
+    print("\n🧪 Testando resiliência com o servidor local...")
+    test_resiliencia_repete_troca_de_modelo_e_abre_disjuntor()
+    print("\n🗃️ Testando o cache de gerações...")
+    test_cache_de_geracoes_normaliza_expira_e_descarta_as_menos_usadas()
+    print("\n📝 Testando streaming pela fila de gerações...")
+    test_fila_grava_texto_parcial_do_streaming()
+    print("\n🔌 Testando as rotas da API...")
+    test_api_autentica_gera_pagina_e_busca()
+    print("\n🔐 Testando senhas e limites de login...")
+    test_login_refaz_hash_e_limita_tentativas()
+    print("\n✂️ Testando a divisão das variantes...")
+    test_separar_variantes_descarta_preambulo_e_avisa_quando_faltam()
+    print("\n🖼️ Testando a renderização em HTML...")
+    test_renderizador_escapa_html_e_reaproveita_o_cache()
@@ -1,9 +1,17 @@
 import streamlit as st
 from datetime import datetime
 
-def show_upgrade_page(user_id, user_plan, db):
+import payments
+import quota
+import resources
+
+def show_upgrade_page(user_id, user_plan, db, descricoes_usadas=None):
     """Exibe página de upgrade de plano"""
     
+    # Reaproveitar o uso já lido no rerun, quando informado
+    if descricoes_usadas is None:
+        descricoes_usadas = db.get_user_description_count(user_id)
+    
     st.title("💎 Faça Upgrade do Seu Plano")
     
     # Mostrar plano atual
@@ -13,17 +21,21 @@ def show_upgrade_page(user_id, user_plan, db):
     with col_current2:
         if user_plan == 'free':
             st.error("**🎯 Plano Gratuito**")
-            descricoes_usadas = db.get_user_description_count(user_id)
-            st.progress(min(descricoes_usadas / 5, 1.0))
-            st.caption(f"{descricoes_usadas}/5 descrições usadas")
+            limite = quota.monthly_limit(user_plan)
+            no_mes = db.get_usage(user_id)['month']
+            st.progress(min(no_mes / limite, 1.0))
+            st.caption(f"{no_mes}/{limite} descrições usadas neste mês")
         elif user_plan == 'pro':
             st.success("**🚀 Plano Pro**")
-            st.metric("Descrições geradas", db.get_user_description_count(user_id))
+            st.metric("Descrições geradas", descricoes_usadas)
         else:
             st.info("**🏢 Plano Enterprise**")
     
     st.divider()
     
+    # Pagamento em andamento ou recém-concluído
+    mostrar_pagamento(user_id)
+    
     # Mostrar opções de planos
     st.header("Escolha Seu Novo Plano")
     
@@ -65,9 +77,11 @@ def show_upgrade_page(user_id, user_plan, db):
         if user_plan == 'pro':
             st.button("Plano Atual ✓", disabled=True, use_container_width=True)
         else:
-            if st.button("👉 Upgrade para Pro", type="primary", use_container_width=True):
-                # Simular pagamento
-                simulate_payment(user_id, 'pro', 29.90, db)
+            em_andamento = bool(st.session_state.get('pagamento_id'))
+            if st.button("👉 Upgrade para Pro", type="primary", use_container_width=True,
+                         disabled=em_andamento):
+                iniciar_pagamento(user_id, 'pro')
+                st.rerun()
     
     with col3:
         st.subheader("🏢 Enterprise")
@@ -155,52 +169,95 @@ def show_upgrade_page(user_id, user_plan, db):
     
     st.caption("*Pagamento recorrente mensal. Cancele a qualquer momento.*")
 
-def simulate_payment(user_id, plan, amount, db):
-    """Simula um pagamento e atualiza o plano do usuário"""
+def iniciar_pagamento(user_id, plan):
+    """Registra o pagamento e agenda a cobrança, sem bloquear a sessão"""
+    processor = resources.get_payments()
     
-    with st.spinner("Processando pagamento..."):
-        # Simular processamento
-        import time
-        time.sleep(2)
-        
-        # Registrar pagamento no banco
-        db.record_payment(user_id, plan, amount)
-        
-        # Atualizar plano do usuário
-        db.update_user_plan(user_id, plan)
+    # Mesma chave enquanto a tentativa estiver em aberto: clique duplo e
+    # reruns não criam (nem cobram) um segundo pagamento
+    chave = st.session_state.get('pagamento_chave')
+    anterior = processor.db.get_payment_by_key(chave) if chave else None
+    if anterior is None or anterior['status'] not in ('pending', 'processing') or anterior['plan'] != plan:
+        chave = payments.new_idempotency_key()
+        st.session_state.pagamento_chave = chave
+    
+    pagamento = processor.start(user_id, plan, chave)
+    st.session_state.pagamento_id = pagamento['id']
+
+def _acompanhar_pagamento(payment_id):
+    """Mostra o andamento do pagamento; quando ele termina, recarrega a página"""
+    pagamento = resources.get_payments().status(payment_id)
+    if pagamento['status'] in ('pending', 'processing'):
+        st.info("⏳ Processando pagamento... você pode continuar usando o app.")
+        if not hasattr(st, 'fragment'):
+            st.button("🔄 Atualizar status", key="atualizar_pagamento")
+    else:
+        st.rerun()
+
+# Consulta o status a cada segundo sem rerodar a página inteira (Streamlit >= 1.37)
+if hasattr(st, 'fragment'):
+    _acompanhar_pagamento = st.fragment(run_every=1)(_acompanhar_pagamento)
+
+def mostrar_pagamento(user_id):
+    """Exibe o pagamento em andamento ou o resultado do último"""
+    payment_id = st.session_state.get('pagamento_id')
+    if not payment_id:
+        return
+    
+    pagamento = resources.get_payments().status(payment_id)
+    if pagamento is None or pagamento['user_id'] != user_id:
+        st.session_state.pagamento_id = None
+        return
+    
+    if pagamento['status'] in ('pending', 'processing'):
+        _acompanhar_pagamento(payment_id)
+        return
+    
+    if pagamento['status'] != 'approved':
+        st.session_state.pagamento_id = None
+        st.error(f"❌ Pagamento não aprovado: {pagamento['error'] or 'tente novamente'}")
+        return
+    
+    plan = pagamento['plan']
+    if st.session_state.user_plan != plan:
+        # O plano já foi gravado com o pagamento; recarregar para a barra lateral refletir
         st.session_state.user_plan = plan
-        
-        st.success(f"""
-        ✅ Pagamento processado com sucesso!
-        
-        **Plano {plan.upper()} ativado!**
-        - Valor: R$ {amount:.2f}
-        - Data: {datetime.now().strftime('%d/%m/%Y')}
-        - Próxima cobrança: {(datetime.now().replace(day=28) if datetime.now().day > 28 else datetime.now()).strftime('%d/%m/%Y')}
-        
-        **Recursos agora disponíveis:**
-        {'- Descrições ilimitadas' if plan == 'pro' else ''}
-        {'- Todos os templates' if plan == 'pro' else ''}
-        {'- Analytics avançados' if plan == 'pro' else ''}
-        
-        Obrigado por fazer upgrade! 🎉
+        st.rerun()
+    
+    # Pagamento concluído: mostrar o recibo uma vez
+    st.session_state.pagamento_id = None
+    amount = pagamento['amount_cents'] / 100
+    
+    st.success(f"""
+    ✅ Pagamento processado com sucesso!
+    
+    **Plano {plan.upper()} ativado!**
+    - Valor: R$ {amount:.2f}
+    - Data: {datetime.now().strftime('%d/%m/%Y')}
+    - Próxima cobrança: {(datetime.now().replace(day=28) if datetime.now().day > 28 else datetime.now()).strftime('%d/%m/%Y')}
+    
+    **Recursos agora disponíveis:**
+    {'- Descrições ilimitadas' if plan == 'pro' else ''}
+    {'- Todos os templates' if plan == 'pro' else ''}
+    {'- Analytics avançados' if plan == 'pro' else ''}
+    
+    Obrigado por fazer upgrade! 🎉
+    """)
+    
+    # Mostrar recibo
+    with st.expander("📄 Ver Recibo", expanded=True):
+        st.code(f"""
+        ==================================
+        DESCRIÇÕESIA PRO - RECIBO
+        ==================================
+        Cliente: {st.session_state.user_email}
+        Plano: {plan.upper()}
+        Valor: R$ {amount:.2f}
+        Data: {pagamento['updated_at']}
+        ID da Transação: {pagamento['provider_ref']}
+        Status: APROVADO
+        ==================================
         """)
-        
-        # Mostrar recibo
-        with st.expander("📄 Ver Recibo", expanded=True):
-            st.code(f"""
-            ==================================
-            DESCRIÇÕESIA PRO - RECIBO
-            ==================================
-            Cliente: {st.session_state.user_email}
-            Plano: {plan.upper()}
-            Valor: R$ {amount:.2f}
-            Data: {datetime.now().strftime('%d/%m/%Y %H:%M')}
-            ID da Transação: TX{datetime.now().strftime('%Y%m%d%H%M%S')}
-            Status: APROVADO
-            ==================================
-            """)
-        
 
 def show_enterprise_form():
     """Exibe formulário para plano Enterprise"""
@@ -1,28 +1,39 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import json
+import html
+import io
+import re
+import zipfile
 
-def export_to_txt(description, product_name):
-    """Exporta descrição para arquivo .txt"""
-    filename = f"descricao_{product_name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-    
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(description)
-    
-    return filename
+import bulk
+from renderer import markdown_to_html
 
-def export_to_html(description, product_name):
-    """Exporta descrição para arquivo .html"""
+# Nome de arquivo seguro: só letras, números, hífen e sublinhado
+NOME_ARQUIVO_INVALIDO = re.compile(r'[^\w-]+')
+
+def nome_seguro(product_name):
+    """Nome do produto sem caracteres inválidos em nomes de arquivo"""
+    return NOME_ARQUIVO_INVALIDO.sub('_', product_name or '').strip('_')[:60] or 'produto'
+
+def export_filename(product_name, extensao, prefixo='descricao'):
+    """Nome sugerido para o download (nada é gravado no servidor)"""
+    return f"{prefixo}_{nome_seguro(product_name)}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extensao}"
+
+def render_txt(description):
+    """Conteúdo do .txt em bytes"""
+    return description.encode('utf-8')
+
+def render_html(description, product_name):
+    """Conteúdo do .html em bytes (Markdown convertido por renderer.markdown_to_html)"""
+    corpo = markdown_to_html(description)
     html_content = f"""
     <!DOCTYPE html>
     <html lang="pt-BR">
     <head>
         <meta charset="UTF-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Descrição: {product_name}</title>
+        <title>Descrição: {html.escape(product_name)}</title>
         <style>
             body {{ font-family: Arial, sans-serif; line-height: 1.6; padding: 20px; max-width: 800px; margin: 0 auto; }}
             .description {{ background: #f9f9f9; padding: 20px; border-radius: 10px; }}
@@ -31,9 +42,9 @@ def export_to_html(description, product_name):
         </style>
     </head>
     <body>
-        <h1 class="title">📦 {product_name}</h1>
+        <h1 class="title">📦 {html.escape(product_name)}</h1>
         <div class="description">
-            {description.replace('**', '<strong>').replace('**', '</strong>').replace('\\n', '<br>')}
+            {corpo}
         </div>
         <div class="footer">
             Gerado por DescriçõesIA Pro • {datetime.now().strftime('%d/%m/%Y %H:%M')}
@@ -41,53 +52,73 @@ def export_to_html(description, product_name):
     </body>
     </html>
     """
+    return html_content.encode('utf-8')
+
+RENDERIZADORES = {
+    'txt': lambda description, product_name: render_txt(description),
+    'html': render_html,
+}
+
+def export_to_txt(description, product_name):
+    """Exporta descrição para .txt em memória; retorna (nome do arquivo, BytesIO)"""
+    return export_filename(product_name, 'txt'), io.BytesIO(render_txt(description))
+
+def export_to_html(description, product_name):
+    """Exporta descrição para .html em memória; retorna (nome do arquivo, BytesIO)"""
+    return export_filename(product_name, 'html'), io.BytesIO(render_html(description, product_name))
+
+def export_to_zip(descriptions, formato='txt'):
+    """Compacta várias descrições em um .zip em memória; retorna (nome do arquivo, BytesIO)
     
-    filename = f"descricao_{product_name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
-    
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(html_content)
-    
-    return filename
+    `descriptions` é um iterável de (id, product_name, description), por
+    exemplo os blocos de Database.iter_user_descriptions já achatados: cada
+    descrição é renderizada e escrita no arquivo assim que chega, então só
+    o zip comprimido fica em memória.
+    """
+    renderizar = RENDERIZADORES[formato]
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as arquivo_zip:
+        for desc_id, product_name, description in descriptions:
+            with arquivo_zip.open(f"{desc_id:06d}_{nome_seguro(product_name)}.{formato}", 'w') as entrada:
+                entrada.write(renderizar(description or '', product_name or ''))
+    buffer.seek(0)
+    return f"descricoes_{datetime.now().strftime('%Y%m%d')}.zip", buffer
+
+# Colunas do CSV de estatísticas e seus títulos
+ESTATISTICAS_COLUNAS = ('id', 'product_name', 'category', 'tone', 'keywords', 'size', 'template', 'created_at')
+ESTATISTICAS_ROTULOS = ('ID', 'Produto', 'Categoria', 'Tom', 'Palavras-chave', 'Tamanho', 'Template', 'Data')
 
 def show_analytics(user_id, db):
     """Exibe painel de analytics para o usuário"""
+    # Plotly só é carregado quando alguém abre a aba de analytics
+    import plotly.express as px
+    import plotly.graph_objects as go
     
-    # Obter dados do banco
+    # Obter agregados do banco (sem carregar o texto das descrições)
     analytics_data = db.get_user_analytics(user_id)
     category_stats = db.get_category_stats(user_id)
     template_stats = db.get_template_stats(user_id)
-    descriptions = db.get_user_descriptions(user_id, limit=100)
+    daily_activity = db.get_daily_activity(user_id)
     
     # Métricas principais
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        total_descriptions = len(descriptions) if descriptions else 0
-        st.metric("Total de Descrições", total_descriptions)
+        st.metric("Total de Descrições", analytics_data['total'])
     
     with col2:
-        if analytics_data and analytics_data[2]:
-            st.metric("Categoria Mais Usada", analytics_data[2])
-        else:
-            st.metric("Categoria Mais Usada", "-")
+        st.metric("Categoria Mais Usada", analytics_data['most_used_category'] or "-")
     
     with col3:
-        if analytics_data and analytics_data[3]:
-            st.metric("Template Favorito", analytics_data[3])
-        else:
-            st.metric("Template Favorito", "-")
+        st.metric("Template Favorito", analytics_data['favorite_template'] or "-")
     
     with col4:
-        if descriptions:
-            last_activity = descriptions[0][9] if len(descriptions[0]) > 9 else "-"
-            st.metric("Última Atividade", last_activity[:10])
-        else:
-            st.metric("Última Atividade", "-")
+        st.metric("Última Atividade", analytics_data['last_activity'] or "-")
     
     st.divider()
     
     # Gráficos
-    if descriptions and len(descriptions) > 1:
+    if analytics_data['total'] > 1:
         col_chart1, col_chart2 = st.columns(2)
         
         with col_chart1:
@@ -124,21 +155,11 @@ def show_analytics(user_id, db):
         # Atividade ao longo do tempo
         st.subheader("📈 Atividade ao Longo do Tempo")
         
-        # Criar DataFrame com datas
-        dates = []
-        for desc in descriptions:
-            if len(desc) > 9:
-                date_str = desc[9][:10]  # Pegar apenas a data
-                dates.append(date_str)
-        
-        if dates:
-            df_dates = pd.DataFrame({'date': dates})
-            daily_counts = df_dates['date'].value_counts().sort_index()
-            
+        if daily_activity:
             fig = go.Figure()
             fig.add_trace(go.Scatter(
-                x=daily_counts.index,
-                y=daily_counts.values,
+                x=[day for day, _ in daily_activity],
+                y=[count for _, count in daily_activity],
                 mode='lines+markers',
                 name='Descrições por dia',
                 line=dict(color='#4CAF50', width=3)
@@ -161,35 +182,24 @@ def show_analytics(user_id, db):
     
     with col_export1:
         if st.button("📊 Exportar Estatísticas (CSV)", use_container_width=True):
-            # Criar DataFrame com estatísticas
-            if descriptions:
-                data = []
-                for desc in descriptions:
-                    data.append({
-                        'ID': desc[0],
-                        'Produto': desc[1],
-                        'Categoria': desc[2],
-                        'Tom': desc[3],
-                        'Palavras-chave': desc[4],
-                        'Tamanho': desc[5],
-                        'Template': desc[6],
-                        'Data': desc[9] if len(desc) > 9 else ''
-                    })
-                
-                df = pd.DataFrame(data)
-                csv = df.to_csv(index=False)
-                
-                st.download_button(
-                    label="⬇️ Baixar CSV",
-                    data=csv,
-                    file_name=f"estatisticas_descricoes_{datetime.now().strftime('%Y%m%d')}.csv",
-                    mime="text/csv"
-                )
+            # Histórico inteiro, lido do banco em blocos (sem o texto das descrições)
+            csv = b''.join(bulk.exportar_csv(
+                db.iter_user_descriptions(user_id, ESTATISTICAS_COLUNAS),
+                ESTATISTICAS_COLUNAS,
+                rotulos=ESTATISTICAS_ROTULOS
+            ))
+            
+            st.download_button(
+                label="⬇️ Baixar CSV",
+                data=csv,
+                file_name=f"estatisticas_descricoes_{datetime.now().strftime('%Y%m%d')}.csv",
+                mime="text/csv"
+            )
     
     with col_export2:
         if st.button("📈 Exportar Gráficos (HTML)", use_container_width=True):
             # Criar relatório HTML com gráficos
-            html_report = create_html_report(user_id, db, descriptions)
+            html_report = create_html_report(user_id, db, db.get_description_summaries(user_id, limit=10))
             st.download_button(
                 label="⬇️ Baixar Relatório",
                 data=html_report,
@@ -230,15 +240,15 @@ def create_html_report(user_id, db, descriptions):
         <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(250px, 1fr)); gap: 20px;">
             <div class="metric">
                 <h3>Total de Descrições</h3>
-                <p style="font-size: 2em; font-weight: bold;">{len(descriptions) if descriptions else 0}</p>
+                <p style="font-size: 2em; font-weight: bold;">{analytics_data['total']}</p>
             </div>
             <div class="metric">
                 <h3>Categoria Mais Usada</h3>
-                <p style="font-size: 1.5em;">{analytics_data[2] if analytics_data and analytics_data[2] else '-'}</p>
+                <p style="font-size: 1.5em;">{analytics_data['most_used_category'] or '-'}</p>
             </div>
             <div class="metric">
                 <h3>Template Favorito</h3>
-                <p style="font-size: 1.5em;">{analytics_data[3] if analytics_data and analytics_data[3] else '-'}</p>
+                <p style="font-size: 1.5em;">{analytics_data['favorite_template'] or '-'}</p>
             </div>
         </div>
         
@@ -258,8 +268,8 @@ def create_html_report(user_id, db, descriptions):
             <tr>
                 <td>{desc[1]}</td>
                 <td>{desc[2]}</td>
-                <td>{desc[6] if len(desc) > 6 else '-'}</td>
-                <td>{desc[9][:10] if len(desc) > 9 else '-'}</td>
+                <td>{desc[6] or '-'}</td>
+                <td>{desc[9][:10]}</td>
             </tr>
         """
     